@@ -0,0 +1,45 @@
+use std::path::Path;
+
+use xdvdfs::read::index::{ImageIndex, ImageStamp};
+
+async fn build_index(img_path: &Path) -> Result<ImageIndex, anyhow::Error> {
+    let stamp = ImageStamp::from_metadata(&std::fs::metadata(img_path)?)?;
+    let mut img = crate::cmd_read::open_image(img_path).await?;
+    let volume = xdvdfs::read::read_volume(&mut img).await?;
+
+    Ok(ImageIndex::build(&volume, &mut img, stamp).await?)
+}
+
+/// Loads the sidecar index for an image, if one has been created with `xdvdfs index`.
+/// If the sidecar no longer matches the image, it is rebuilt.
+pub async fn load_index(img_path: &Path) -> Result<Option<ImageIndex>, anyhow::Error> {
+    if !ImageIndex::sidecar_path(img_path).exists() {
+        return Ok(None);
+    }
+
+    if let Some(index) = ImageIndex::load_sidecar(img_path)? {
+        return Ok(Some(index));
+    }
+
+    eprintln!(
+        "Index for {} is out of date, rebuilding",
+        img_path.display()
+    );
+    let index = build_index(img_path).await?;
+    index.write_sidecar(img_path)?;
+    Ok(Some(index))
+}
+
+pub async fn cmd_index(img_path: &str) -> Result<(), anyhow::Error> {
+    let img_path = Path::new(img_path);
+    let index = build_index(img_path).await?;
+    index.write_sidecar(img_path)?;
+
+    println!(
+        "Indexed {} entries to {}",
+        index.len(),
+        ImageIndex::sidecar_path(img_path).display()
+    );
+
+    Ok(())
+}
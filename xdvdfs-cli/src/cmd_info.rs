@@ -1,6 +1,7 @@
 use std::path::Path;
 
 use xdvdfs::layout::{DirectoryEntryNode, VolumeDescriptor};
+use xdvdfs::read::index::ImageIndex;
 
 fn print_volume(volume: &VolumeDescriptor) {
     let time = volume.filetime;
@@ -48,7 +49,33 @@ fn print_dirent(dirent: &DirectoryEntryNode) -> Result<(), anyhow::Error> {
     Ok(())
 }
 
+fn print_index_info(index: &ImageIndex, entry: Option<&String>) -> Result<(), anyhow::Error> {
+    match entry {
+        Some(path) => {
+            let dirent = index.walk_path::<std::io::Error>(path)?;
+            print_dirent(&dirent)?;
+
+            if dirent.node.dirent.is_directory() {
+                println!();
+                for node in index.list_dir::<std::io::Error>(path)? {
+                    let name = node.name_str::<std::io::Error>()?;
+                    println!("{}", name);
+                    print_dirent(&node)?;
+                    println!();
+                }
+            }
+        }
+        None => print_volume(&index.volume()),
+    }
+
+    Ok(())
+}
+
 pub async fn cmd_info(img_path: &String, entry: Option<&String>) -> Result<(), anyhow::Error> {
+    if let Some(index) = crate::cmd_index::load_index(Path::new(img_path)).await? {
+        return print_index_info(&index, entry);
+    }
+
     let mut img = crate::cmd_read::open_image(Path::new(img_path)).await?;
     let volume = xdvdfs::read::read_volume(&mut img).await?;
 
@@ -1,26 +1,94 @@
+use std::sync::atomic::{AtomicUsize, Ordering};
+
 use md5::{Digest, Md5};
-use std::fs::File;
+use xdvdfs::blockdev::{BlockDeviceRead, SharedReader};
+use xdvdfs::layout::DirectoryEntryNode;
+use xdvdfs::read::stream::FileReader;
 use xdvdfs::util;
 
+use crate::cmd_read::{ImageSource, OpenedImage, ReadAhead};
+
+/// Returns the number of worker threads to use when none is given
+pub fn default_jobs() -> usize {
+    std::thread::available_parallelism().map_or(1, |n| n.get())
+}
+
+/// Checksums computed by one worker, with the index of each entry in the tree
+type WorkerChecksums = Result<Vec<(usize, String)>, util::Error<std::io::Error>>;
+
 async fn md5_file_dirent<E>(
-    img: &mut impl xdvdfs::blockdev::BlockDeviceRead<E>,
-    file: xdvdfs::layout::DirectoryEntryNode,
+    img: &mut impl BlockDeviceRead<E>,
+    file: &DirectoryEntryNode,
 ) -> Result<String, util::Error<E>> {
-    let file_buf = file.node.dirent.read_data_all(img).await?;
+    let mut reader = FileReader::new(img, &file.node.dirent)?;
 
     let mut hasher = Md5::new();
-    hasher.update(file_buf);
+    while let Some(chunk) = reader.next_chunk().await? {
+        hasher.update(chunk);
+    }
     let result = hasher.finalize();
 
     Ok(format!("{:x}", result))
 }
 
-async fn md5_file_tree<E>(
-    img: &mut impl xdvdfs::blockdev::BlockDeviceRead<E>,
-    tree: &Vec<(String, xdvdfs::layout::DirectoryEntryNode)>,
+/// Hashes every entry of `tree` on `jobs` worker threads.
+///
+/// Workers take entries in sector order, so the image is read mostly sequentially,
+/// while the checksums are returned in the order of `tree`.
+fn md5_entries(
+    img: &impl ImageSource,
+    tree: &[(String, DirectoryEntryNode)],
+    jobs: usize,
+) -> Result<Vec<String>, util::Error<std::io::Error>> {
+    let mut order: Vec<usize> = (0..tree.len()).collect();
+    order.sort_by_key(|idx| tree[*idx].1.node.dirent.data.sector);
+
+    let hints = ReadAhead::new(img, order.iter().map(|idx| tree[*idx].1.node.dirent.data));
+    let next = AtomicUsize::new(0);
+    let worker = || {
+        let mut dev = SharedReader::new(img);
+        let mut checksums = Vec::new();
+        loop {
+            let pos = next.fetch_add(1, Ordering::Relaxed);
+            let Some(&idx) = order.get(pos) else {
+                return Ok(checksums);
+            };
+
+            hints.start(pos);
+            let checksum = futures::executor::block_on(md5_file_dirent(&mut dev, &tree[idx].1));
+            hints.finish(pos);
+            checksums.push((idx, checksum?));
+        }
+    };
+
+    let results: Vec<WorkerChecksums> = std::thread::scope(|s| {
+        let workers: Vec<_> = (0..jobs.clamp(1, tree.len().max(1)))
+            .map(|_| s.spawn(worker))
+            .collect();
+        workers
+            .into_iter()
+            .map(|worker| worker.join().expect("md5 worker panicked"))
+            .collect()
+    });
+
+    let mut checksums = vec![String::new(); tree.len()];
+    for result in results {
+        for (idx, checksum) in result? {
+            checksums[idx] = checksum;
+        }
+    }
+
+    Ok(checksums)
+}
+
+fn md5_file_tree(
+    img: &impl ImageSource,
+    tree: &[(String, DirectoryEntryNode)],
     base: &str,
-) -> Result<(), util::Error<E>> {
-    for (dir, file) in tree {
+    jobs: usize,
+) -> Result<(), util::Error<std::io::Error>> {
+    let checksums = md5_entries(img, tree, jobs)?;
+    for ((dir, file), checksum) in tree.iter().zip(checksums) {
         let dir = if base.is_empty() {
             String::from(dir)
         } else if dir.is_empty() {
@@ -28,7 +96,6 @@ async fn md5_file_tree<E>(
         } else {
             format!("{}/{}", base, dir)
         };
-        let checksum = md5_file_dirent(img, *file).await?;
         let name = file.name_str()?;
         println!("{}  {}/{}", checksum, dir, name);
     }
@@ -36,40 +103,95 @@ async fn md5_file_tree<E>(
     Ok(())
 }
 
-async fn md5_from_file_path<E>(
+async fn md5_from_file_path(
     volume: &xdvdfs::layout::VolumeDescriptor,
-    img: &mut impl xdvdfs::blockdev::BlockDeviceRead<E>,
+    img: &impl ImageSource,
     file: &str,
-) -> Result<(), util::Error<E>> {
-    let dirent = volume.root_table.walk_path(img, file).await?;
+    jobs: usize,
+) -> Result<(), util::Error<std::io::Error>> {
+    let mut dev = SharedReader::new(img);
+    let dirent = volume.root_table.walk_path(&mut dev, file).await?;
     if let Some(table) = dirent.node.dirent.dirent_table() {
-        let tree = table.file_tree(img).await?;
-        md5_file_tree(img, &tree, file).await?;
+        let tree = table.file_tree(&mut dev).await?;
+        md5_file_tree(img, &tree, file, jobs)?;
     } else {
-        let checksum = md5_file_dirent(img, dirent).await?;
+        let checksum = md5_file_dirent(&mut dev, &dirent).await?;
         println!("{}  {}", checksum, file);
     }
 
     Ok(())
 }
 
-async fn md5_from_root_tree<E>(
+async fn md5_from_root_tree(
     volume: &xdvdfs::layout::VolumeDescriptor,
-    img: &mut impl xdvdfs::blockdev::BlockDeviceRead<E>,
-) -> Result<(), util::Error<E>> {
-    let tree = volume.root_table.file_tree(img).await?;
-    md5_file_tree(img, &tree, "").await
+    img: &impl ImageSource,
+    jobs: usize,
+) -> Result<(), util::Error<std::io::Error>> {
+    let tree = volume
+        .root_table
+        .file_tree(&mut SharedReader::new(img))
+        .await?;
+    md5_file_tree(img, &tree, "", jobs)
+}
+
+async fn md5_from_index(
+    index: &xdvdfs::read::index::ImageIndex,
+    img: &impl ImageSource,
+    path: Option<&str>,
+    jobs: usize,
+) -> Result<(), util::Error<std::io::Error>> {
+    let Some(path) = path else {
+        let tree = index.file_tree()?;
+        return md5_file_tree(img, &tree, "", jobs);
+    };
+
+    let idx = index.find(path)?;
+    let dirent = index.dirent(idx);
+    if dirent.node.dirent.is_directory() {
+        // Match the entries under `path`, by the name stored in the index
+        let prefix = format!("{}/{}", index.parent_path(idx)?, dirent.name_str()?);
+        let tree: Vec<_> = index
+            .file_tree()?
+            .into_iter()
+            .filter_map(|(dir, node)| {
+                let rel = dir.strip_prefix(&prefix)?;
+                (rel.is_empty() || rel.starts_with('/')).then(|| (String::from(rel), node))
+            })
+            .collect();
+        md5_file_tree(img, &tree, path, jobs)?;
+    } else {
+        let checksum = md5_file_dirent(&mut SharedReader::new(img), &dirent).await?;
+        println!("{}  {}", checksum, path);
+    }
+
+    Ok(())
 }
 
-pub async fn cmd_md5(img_path: &str, path: Option<&str>) -> Result<(), anyhow::Error> {
-    let mut img = File::options().read(true).open(img_path)?;
-    let volume = xdvdfs::read::read_volume(&mut img).await?;
+async fn md5_image(
+    img: &impl ImageSource,
+    img_path: &std::path::Path,
+    path: Option<&str>,
+    jobs: usize,
+) -> Result<(), anyhow::Error> {
+    if let Some(index) = crate::cmd_index::load_index(img_path).await? {
+        return Ok(md5_from_index(&index, img, path, jobs).await?);
+    }
+
+    let volume = xdvdfs::read::read_volume(&mut SharedReader::new(img)).await?;
 
     let result = if let Some(path) = path {
-        md5_from_file_path(&volume, &mut img, path).await
+        md5_from_file_path(&volume, img, path, jobs).await
     } else {
-        md5_from_root_tree(&volume, &mut img).await
+        md5_from_root_tree(&volume, img, jobs).await
     };
 
     Ok(result?)
 }
+
+pub async fn cmd_md5(img_path: &str, path: Option<&str>, jobs: usize) -> Result<(), anyhow::Error> {
+    let img_path = std::path::Path::new(img_path);
+    match crate::cmd_read::open_image_source(img_path).await? {
+        OpenedImage::Mapped(img) => md5_image(&img, img_path, path, jobs).await,
+        OpenedImage::File(img) => md5_image(&img, img_path, path, jobs).await,
+    }
+}
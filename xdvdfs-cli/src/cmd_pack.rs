@@ -1,5 +1,10 @@
 use std::path::{Path, PathBuf};
 
+use xdvdfs::blockdev::BlockDeviceWrite;
+use xdvdfs::write::sector::{
+    AlignedAllocator, AllocationPolicy, NameOrderAllocator, SectorAllocator, TightAllocator,
+    ECC_BLOCK_SECTORS,
+};
 use xdvdfs::write::{self, img::ProgressInfo};
 
 fn get_default_image_path(source_path: &Path) -> Option<PathBuf> {
@@ -13,52 +18,275 @@ fn get_default_image_path(source_path: &Path) -> Option<PathBuf> {
     Some(output)
 }
 
-pub async fn cmd_pack(
-    source_path: &String,
-    image_path: &Option<String>,
-) -> Result<(), anyhow::Error> {
-    let source_path = PathBuf::from(source_path);
+/// How sectors are allocated to directory tables and files
+#[derive(clap::ValueEnum, Clone, Copy, Debug, Default)]
+pub enum Layout {
+    /// Place regions one after another from sector 33
+    #[default]
+    Compat,
 
-    let image_path = image_path
-        .as_ref()
-        .map(PathBuf::from)
-        .unwrap_or_else(|| get_default_image_path(&source_path).unwrap());
+    /// Use the sectors before the volume descriptor, and give empty files no space
+    Tight,
 
-    let image = std::fs::File::options()
-        .write(true)
-        .truncate(true)
-        .create(true)
-        .open(image_path)?;
-    let mut image = std::io::BufWriter::with_capacity(1024 * 1024, image);
+    /// Start large files on 16 sector ECC block boundaries
+    Ecc16,
+
+    /// Start large files on 32 sector boundaries
+    Ecc32,
+}
+
+/// Settings for `cmd_pack`, from the command line
+pub struct PackOptions {
+    pub io_uring: bool,
+    pub sparse: bool,
+
+    /// Size in bytes of each buffer used to copy files into the image
+    pub buffer_size: usize,
+    pub dry_run: bool,
+    pub jobs: usize,
+    pub dedup: bool,
+    pub layout: Layout,
+    pub order_by_name: bool,
+}
+
+fn allocation_policy(options: &PackOptions) -> Box<dyn AllocationPolicy> {
+    fn ordered<P: AllocationPolicy + 'static>(
+        policy: P,
+        by_name: bool,
+    ) -> Box<dyn AllocationPolicy> {
+        if by_name {
+            Box::new(NameOrderAllocator::new(policy))
+        } else {
+            Box::new(policy)
+        }
+    }
+
+    let by_name = options.order_by_name;
+    match options.layout {
+        Layout::Compat => ordered(SectorAllocator::default(), by_name),
+        Layout::Tight => ordered(TightAllocator::default(), by_name),
+        Layout::Ecc16 => ordered(AlignedAllocator::new(ECC_BLOCK_SECTORS), by_name),
+        Layout::Ecc32 => ordered(AlignedAllocator::new(2 * ECC_BLOCK_SECTORS), by_name),
+    }
+}
 
-    let progress_callback = |pi| match pi {
+fn source_filesystem(options: &PackOptions) -> write::fs::StdFilesystem {
+    write::fs::StdFilesystem::new()
+        .with_copy_buffers(options.buffer_size, write::fs::DEFAULT_COPY_BUFFERS)
+        .with_dedup(options.dedup)
+}
+
+fn progress_logger(log_to_stderr: bool) -> impl Fn(ProgressInfo) {
+    let log = move |msg: String| {
+        if log_to_stderr {
+            eprintln!("{}", msg);
+        } else {
+            println!("{}", msg);
+        }
+    };
+
+    move |pi| match pi {
         ProgressInfo::DirAdded(path, sector) => {
-            println!("Added dir: {:?} at sector {}", path, sector);
+            log(format!("Added dir: {:?} at sector {}", path, sector));
         }
         ProgressInfo::FileAdded(path, sector) => {
-            println!("Added file: {:?} at sector {}", path, sector);
+            log(format!("Added file: {:?} at sector {}", path, sector));
         }
         _ => {}
-    };
+    }
+}
+
+async fn pack_image<H>(
+    source_path: &Path,
+    image: &mut H,
+    options: &PackOptions,
+    log_to_stderr: bool,
+) -> Result<(), anyhow::Error>
+where
+    H: BlockDeviceWrite<std::io::Error> + std::io::Write + std::io::Seek,
+{
+    let progress_callback = progress_logger(log_to_stderr);
 
-    let meta = std::fs::metadata(&source_path)?;
+    let mut policy = allocation_policy(options);
+    let meta = std::fs::metadata(source_path)?;
     if meta.is_dir() {
-        let mut fs = write::fs::StdFilesystem;
-        write::img::create_xdvdfs_image(&source_path, &mut fs, &mut image, progress_callback)
-            .await?;
+        let mut fs = source_filesystem(options);
+        let plan = write::img::plan_xdvdfs_image::<H, _>(
+            source_path,
+            &mut fs,
+            &mut *policy,
+            &progress_callback,
+        )
+        .await?;
+        write::img::write_xdvdfs_image(&plan, &mut fs, image, &progress_callback).await?;
     } else if meta.is_file() {
-        let source = crate::cmd_read::open_image(&source_path).await?;
+        let source = crate::cmd_read::open_image(source_path).await?;
         let mut fs = write::fs::XDVDFSFilesystem::new(source).await.unwrap();
-        write::img::create_xdvdfs_image(
+        let plan = write::img::plan_xdvdfs_image::<H, _>(
             &PathBuf::from("/"),
             &mut fs,
-            &mut image,
-            progress_callback,
+            &mut *policy,
+            &progress_callback,
         )
         .await?;
+        write::img::write_xdvdfs_image(&plan, &mut fs, image, &progress_callback).await?;
     } else {
         return Err(anyhow::anyhow!("Symlink image sources are not supported"));
     }
 
     Ok(())
 }
+
+/// Packs a directory into `image` with `options.jobs` threads copying files at once
+async fn pack_image_parallel(
+    source_path: &Path,
+    image: &std::fs::File,
+    options: &PackOptions,
+) -> Result<(), anyhow::Error> {
+    let progress_callback = progress_logger(false);
+    let mut fs = source_filesystem(options);
+    let mut policy = allocation_policy(options);
+    let plan = write::img::plan_xdvdfs_image::<std::fs::File, _>(
+        source_path,
+        &mut fs,
+        &mut *policy,
+        &progress_callback,
+    )
+    .await?;
+    write::img::write_xdvdfs_image_parallel(&plan, image, options.jobs, &progress_callback)?;
+    Ok(())
+}
+
+/// Prints the layout of the image that `source_path` would be packed into, as JSON
+async fn print_plan(source_path: &Path, options: &PackOptions) -> Result<(), anyhow::Error> {
+    let mut policy = allocation_policy(options);
+    let meta = std::fs::metadata(source_path)?;
+    let plan = if meta.is_dir() {
+        let mut fs = source_filesystem(options);
+        write::img::plan_xdvdfs_image::<std::fs::File, _>(
+            source_path,
+            &mut fs,
+            &mut *policy,
+            |_| {},
+        )
+        .await?
+    } else if meta.is_file() {
+        let source = crate::cmd_read::open_image(source_path).await?;
+        let mut fs = write::fs::XDVDFSFilesystem::new(source).await.unwrap();
+        write::img::plan_xdvdfs_image::<std::fs::File, _>(
+            &PathBuf::from("/"),
+            &mut fs,
+            &mut *policy,
+            |_| {},
+        )
+        .await?
+    } else {
+        return Err(anyhow::anyhow!("Symlink image sources are not supported"));
+    };
+
+    println!("{}", serde_json::to_string_pretty(&plan)?);
+    Ok(())
+}
+
+pub async fn cmd_pack(
+    source_path: &String,
+    image_path: &Option<String>,
+    options: &PackOptions,
+) -> Result<(), anyhow::Error> {
+    let PackOptions {
+        io_uring,
+        sparse,
+        buffer_size,
+        dry_run,
+        jobs,
+        ..
+    } = *options;
+
+    let source_path = PathBuf::from(source_path);
+    if dry_run {
+        return print_plan(&source_path, options).await;
+    }
+
+    let image_path = image_path
+        .as_ref()
+        .map(PathBuf::from)
+        .unwrap_or_else(|| get_default_image_path(&source_path).unwrap());
+
+    // Pipes and other special files cannot seek, so the image is streamed to them in order
+    let to_stdout = image_path.as_os_str() == "-";
+    let stream =
+        to_stdout || std::fs::metadata(&image_path).is_ok_and(|meta| !meta.file_type().is_file());
+
+    // Flags are checked before the output is opened, which truncates it
+    #[cfg(not(target_os = "linux"))]
+    if io_uring {
+        return Err(anyhow::anyhow!("io_uring is only supported on Linux"));
+    }
+
+    if io_uring && sparse {
+        return Err(anyhow::anyhow!(
+            "--io-uring cannot be combined with --sparse"
+        ));
+    }
+
+    if stream && (io_uring || sparse || jobs > 1) {
+        return Err(anyhow::anyhow!(
+            "--io-uring, --sparse and --jobs need a regular output file"
+        ));
+    }
+
+    if jobs > 1 && (io_uring || sparse || !source_path.is_dir()) {
+        return Err(anyhow::anyhow!(
+            "--jobs needs a source directory, and cannot be combined with --io-uring or --sparse"
+        ));
+    }
+
+    if to_stdout {
+        let stdout = std::io::BufWriter::with_capacity(buffer_size, std::io::stdout().lock());
+        let mut image = xdvdfs::blockdev::sequential::SequentialWriter::new(stdout);
+        pack_image(&source_path, &mut image, options, true).await?;
+        image.into_inner()?;
+        return Ok(());
+    }
+
+    let image = std::fs::File::options()
+        .write(true)
+        .truncate(true)
+        .create(true)
+        .open(image_path)?;
+
+    if jobs > 1 {
+        return pack_image_parallel(&source_path, &image, options).await;
+    }
+
+    if stream {
+        let image = std::io::BufWriter::with_capacity(buffer_size, image);
+        let mut image = xdvdfs::blockdev::sequential::SequentialWriter::new(image);
+        pack_image(&source_path, &mut image, options, false).await?;
+        image.into_inner()?;
+        return Ok(());
+    }
+
+    if sparse {
+        let mut image = xdvdfs::blockdev::sparse::SparseFile::new(image)?;
+        pack_image(&source_path, &mut image, options, false).await?;
+        image.finish()?;
+        return Ok(());
+    }
+
+    if io_uring {
+        #[cfg(target_os = "linux")]
+        {
+            let mut image = xdvdfs::blockdev::uring::IoUringDevice::new(image)?;
+            pack_image(&source_path, &mut image, options, false).await?;
+            image.flush_writes()?;
+            return Ok(());
+        }
+
+        #[cfg(not(target_os = "linux"))]
+        return Err(anyhow::anyhow!("io_uring is only supported on Linux"));
+    }
+
+    let mut image = std::io::BufWriter::with_capacity(buffer_size, image);
+    pack_image(&source_path, &mut image, options, false).await
+}
@@ -1,10 +1,18 @@
 use std::{
+    borrow::Cow,
     fs::File,
-    io::{BufReader, Read, Write},
+    io::{BufReader, Write},
     path::{Path, PathBuf},
     str::FromStr,
+    sync::atomic::{AtomicBool, AtomicUsize, Ordering},
+    sync::{Condvar, Mutex},
 };
-use xdvdfs::blockdev::OffsetWrapper;
+use xdvdfs::blockdev::sparse::SparseFile;
+use xdvdfs::blockdev::{
+    AccessHint, BlockDeviceRead, BlockDeviceReadAt, MmapBlockDevice, OffsetWrapper, SharedReader,
+};
+use xdvdfs::layout::{DirectoryEntryDiskData, DiskRegion};
+use xdvdfs::read::DirentOrder;
 
 pub async fn open_image(
     path: &Path,
@@ -14,7 +22,174 @@ pub async fn open_image(
     Ok(xdvdfs::blockdev::OffsetWrapper::new(img).await?)
 }
 
-pub async fn cmd_ls(img_path: &str, dir_path: &str) -> Result<(), anyhow::Error> {
+pub type MappedImage = OffsetWrapper<MmapBlockDevice, std::io::Error>;
+
+pub type FileImage = OffsetWrapper<File, std::io::Error>;
+
+/// An image that several threads can read file data from at once
+pub trait ImageSource: BlockDeviceReadAt<std::io::Error> + Sync {
+    /// Returns the image file
+    fn file(&self) -> &File;
+
+    /// Returns the offset of the volume within the image file
+    fn volume_offset(&self) -> u64;
+
+    /// Returns the image mapping, if file data can be borrowed from memory
+    fn mapped(&self) -> Option<&MappedImage> {
+        None
+    }
+}
+
+impl ImageSource for MappedImage {
+    fn file(&self) -> &File {
+        self.get_ref().file()
+    }
+
+    fn volume_offset(&self) -> u64 {
+        self.offset()
+    }
+
+    fn mapped(&self) -> Option<&MappedImage> {
+        Some(self)
+    }
+}
+
+impl ImageSource for FileImage {
+    fn file(&self) -> &File {
+        self.get_ref()
+    }
+
+    fn volume_offset(&self) -> u64 {
+        self.offset()
+    }
+}
+
+pub enum OpenedImage {
+    Mapped(MappedImage),
+    File(FileImage),
+}
+
+/// Maps the image into memory, so file data can be borrowed from it without copies.
+///
+/// Images that cannot be mapped are read through the file. This includes block devices
+/// such as optical drives, which report a length of 0.
+pub async fn open_image_source(path: &Path) -> Result<OpenedImage, anyhow::Error> {
+    if let Ok(img) = MmapBlockDevice::open(path) {
+        if !img.is_empty() {
+            return Ok(OpenedImage::Mapped(OffsetWrapper::new(img).await?));
+        }
+    }
+
+    let img = File::options().read(true).open(path)?;
+    Ok(OpenedImage::File(OffsetWrapper::new(img).await?))
+}
+
+/// Returns the data of the file `dirent`, borrowed from the image if it is mapped
+async fn file_data<'a>(
+    img: &'a impl ImageSource,
+    dirent: &DirectoryEntryDiskData,
+) -> Result<Cow<'a, [u8]>, anyhow::Error> {
+    match img.mapped() {
+        Some(img) => Ok(Cow::Borrowed(dirent.data_slice(img)?)),
+        None => {
+            let data = dirent.read_data_all(&mut SharedReader::new(img)).await?;
+            Ok(Cow::Owned(data.into_vec()))
+        }
+    }
+}
+
+/// How far past the region being read to prefetch the image
+const READ_AHEAD_WINDOW: u64 = 32 * 1024 * 1024;
+
+/// Issues read-ahead and drop-behind hints for a list of regions that are read
+/// in ascending sector order, so the image is streamed in one forward pass.
+///
+/// Regions may be finished out of order when several workers read them.
+/// Hints are only given for mapped images.
+pub struct ReadAhead<'a> {
+    img: Option<&'a MappedImage>,
+    regions: Vec<(u64, u64)>,
+    prefetched: Mutex<usize>,
+}
+
+impl<'a> ReadAhead<'a> {
+    pub fn new(img: &'a impl ImageSource, regions: impl IntoIterator<Item = DiskRegion>) -> Self {
+        let img = img.mapped();
+        // Empty regions are kept as placeholders, so indices match the caller's list
+        let regions = regions
+            .into_iter()
+            .map(|region| match region.offset::<()>(0) {
+                Ok(offset) if !region.is_empty() => (offset, region.size() as u64),
+                _ => (0, 0),
+            })
+            .collect();
+
+        if let Some(img) = img {
+            let dev = img.get_ref();
+            let _ = dev.advise(img.offset(), dev.len(), AccessHint::Sequential);
+        }
+
+        Self {
+            img,
+            regions,
+            prefetched: Mutex::new(0),
+        }
+    }
+
+    fn advise(&self, (offset, len): (u64, u64), hint: AccessHint) {
+        // Hints are best-effort, failing to apply one only costs performance
+        if let Some(img) = self.img {
+            let _ = img.get_ref().advise(offset + img.offset(), len, hint);
+        }
+    }
+
+    /// Called before reading the region at `idx`, prefetching it and those within the window after it
+    pub fn start(&self, idx: usize) {
+        let Some(&(offset, _)) = self.regions.get(idx) else {
+            return;
+        };
+
+        let mut prefetched = self.prefetched.lock().unwrap();
+        *prefetched = (*prefetched).max(idx);
+        while let Some(&region) = self.regions.get(*prefetched) {
+            if region.0 > offset + READ_AHEAD_WINDOW {
+                break;
+            }
+
+            self.advise(region, AccessHint::WillNeed);
+            *prefetched += 1;
+        }
+    }
+
+    /// Called once the region at `idx` has been read, dropping it from the page cache
+    pub fn finish(&self, idx: usize) {
+        if let Some(&region) = self.regions.get(idx) {
+            self.advise(region, AccessHint::DontNeed);
+        }
+    }
+}
+
+fn dirent_order(disk_order: bool) -> DirentOrder {
+    if disk_order {
+        DirentOrder::Disk
+    } else {
+        DirentOrder::Tree
+    }
+}
+
+pub async fn cmd_ls(img_path: &str, dir_path: &str, disk_order: bool) -> Result<(), anyhow::Error> {
+    // The index lists entries in tree order only
+    if !disk_order {
+        if let Some(index) = crate::cmd_index::load_index(Path::new(img_path)).await? {
+            for dirent in index.list_dir::<std::io::Error>(dir_path)? {
+                let name = dirent.name_str::<std::io::Error>()?;
+                println!("{}", name);
+            }
+
+            return Ok(());
+        }
+    }
+
     let mut img = open_image(Path::new(img_path)).await?;
     let volume = xdvdfs::read::read_volume(&mut img).await?;
 
@@ -31,7 +206,9 @@ pub async fn cmd_ls(img_path: &str, dir_path: &str) -> Result<(), anyhow::Error>
             .ok_or(anyhow::anyhow!("Not a directory"))?
     };
 
-    let listing = dirent_table.walk_dirent_tree(&mut img).await?;
+    let listing = dirent_table
+        .read_dirents(&mut img, dirent_order(disk_order))
+        .await?;
 
     for dirent in listing {
         let name = dirent.name_str::<std::io::Error>()?;
@@ -41,11 +218,24 @@ pub async fn cmd_ls(img_path: &str, dir_path: &str) -> Result<(), anyhow::Error>
     Ok(())
 }
 
-pub async fn cmd_tree(img_path: &str) -> Result<(), anyhow::Error> {
-    let mut img = open_image(Path::new(img_path)).await?;
-    let volume = xdvdfs::read::read_volume(&mut img).await?;
+pub async fn cmd_tree(img_path: &str, disk_order: bool) -> Result<(), anyhow::Error> {
+    let index = match disk_order {
+        false => crate::cmd_index::load_index(Path::new(img_path)).await?,
+        true => None,
+    };
 
-    let tree = volume.root_table.file_tree(&mut img).await?;
+    let tree = match index {
+        Some(index) => index.file_tree::<std::io::Error>()?,
+        None => {
+            let mut img = open_image(Path::new(img_path)).await?;
+            let volume = xdvdfs::read::read_volume(&mut img).await?;
+
+            volume
+                .root_table
+                .file_tree_with_order(&mut img, dirent_order(disk_order))
+                .await?
+        }
+    };
 
     let mut total_size: usize = 0;
     let mut file_count: usize = 0;
@@ -68,7 +258,188 @@ pub async fn cmd_tree(img_path: &str) -> Result<(), anyhow::Error> {
     Ok(())
 }
 
-pub async fn cmd_unpack(img_path: &str, target_dir: &Option<String>) -> Result<(), anyhow::Error> {
+/// Writes `data` to `file` through io_uring, reusing one ring across files
+#[cfg(target_os = "linux")]
+async fn write_uring(
+    dev: &mut Option<xdvdfs::blockdev::uring::IoUringDevice>,
+    file: File,
+    data: &[u8],
+) -> Result<(), anyhow::Error> {
+    use xdvdfs::blockdev::BlockDeviceWrite;
+
+    // Bounds the memory held by queued writes
+    const CHUNK_SIZE: usize = 1024 * 1024;
+
+    let dev = match dev {
+        Some(dev) => {
+            dev.set_file(file)?;
+            dev
+        }
+        None => dev.insert(xdvdfs::blockdev::uring::IoUringDevice::new(file)?),
+    };
+
+    for (idx, chunk) in data.chunks(CHUNK_SIZE).enumerate() {
+        BlockDeviceWrite::write(dev, (idx * CHUNK_SIZE) as u64, chunk).await?;
+    }
+
+    Ok(())
+}
+
+/// Upper bound on the file data that parallel unpack workers hold in memory at once
+const UNPACK_BUDGET: u64 = 64 * 1024 * 1024;
+
+/// Largest single read issued by an unpack worker
+const UNPACK_CHUNK: u64 = 8 * 1024 * 1024;
+
+/// Counts the bytes that unpack workers may still buffer, blocking workers when it runs out
+struct ByteBudget {
+    available: Mutex<u64>,
+    released: Condvar,
+}
+
+impl ByteBudget {
+    fn new(limit: u64) -> Self {
+        Self {
+            available: Mutex::new(limit),
+            released: Condvar::new(),
+        }
+    }
+
+    fn acquire(&self, amount: u64) {
+        let mut available = self.available.lock().unwrap();
+        while *available < amount {
+            available = self.released.wait(available).unwrap();
+        }
+
+        *available -= amount;
+    }
+
+    fn release(&self, amount: u64) {
+        *self.available.lock().unwrap() += amount;
+        self.released.notify_all();
+    }
+}
+
+/// Copies a file's data out of the image in chunks, within the shared byte budget
+fn unpack_file<T>(
+    dev: &mut SharedReader<'_, T, std::io::Error>,
+    budget: &ByteBudget,
+    file_path: &Path,
+    dirent: &DirectoryEntryDiskData,
+    sparse: bool,
+) -> Result<(), anyhow::Error>
+where
+    T: BlockDeviceReadAt<std::io::Error> + ?Sized,
+{
+    let mut file = File::options()
+        .write(true)
+        .truncate(true)
+        .create(true)
+        .open(file_path)?;
+
+    let size = dirent.data.size as u64;
+    if size == 0 {
+        return Ok(());
+    }
+
+    let mut sparse_file = match sparse {
+        true => Some(SparseFile::new(file.try_clone()?)?),
+        false => None,
+    };
+
+    let offset = dirent.data.offset::<std::io::Error>(0)?;
+    let mut pos = 0;
+    while pos < size {
+        let len = (size - pos).min(UNPACK_CHUNK);
+        budget.acquire(len);
+
+        let mut buf = vec![0; len as usize];
+        let res = futures::executor::block_on(dev.read(offset + pos, &mut buf))
+            .map_err(anyhow::Error::from)
+            .and_then(|_| match &mut sparse_file {
+                Some(sparse_file) => Ok(sparse_file.write_at(pos, &buf)?),
+                None => Ok(file.write_all(&buf)?),
+            });
+        drop(buf);
+        budget.release(len);
+
+        res?;
+        pos += len;
+    }
+
+    if let Some(sparse_file) = sparse_file {
+        sparse_file.finish()?;
+    }
+
+    Ok(())
+}
+
+/// Extracts `files` on `jobs` worker threads, each reading through positional
+/// reads on the shared image
+fn unpack_parallel(
+    img: &impl ImageSource,
+    files: &[(PathBuf, DirectoryEntryDiskData)],
+    hints: &ReadAhead,
+    jobs: usize,
+    sparse: bool,
+) -> Result<(), anyhow::Error> {
+    let budget = ByteBudget::new(UNPACK_BUDGET);
+    let next = AtomicUsize::new(0);
+    let failed = AtomicBool::new(false);
+
+    let worker = || -> Result<(), anyhow::Error> {
+        let mut dev = SharedReader::new(img);
+        while !failed.load(Ordering::Relaxed) {
+            let idx = next.fetch_add(1, Ordering::Relaxed);
+            let Some((file_path, dirent)) = files.get(idx) else {
+                break;
+            };
+
+            println!("Extracting file {}", file_path.display());
+            hints.start(idx);
+            let res = unpack_file(&mut dev, &budget, file_path, dirent, sparse);
+            hints.finish(idx);
+            if res.is_err() {
+                failed.store(true, Ordering::Relaxed);
+                return res;
+            }
+        }
+
+        Ok(())
+    };
+
+    std::thread::scope(|s| {
+        let workers: Vec<_> = (0..jobs.min(files.len()))
+            .map(|_| s.spawn(worker))
+            .collect();
+        workers
+            .into_iter()
+            .try_for_each(|worker| worker.join().expect("unpack worker panicked"))
+    })
+}
+
+pub async fn cmd_unpack(
+    img_path: &str,
+    target_dir: &Option<String>,
+    io_uring: bool,
+    jobs: usize,
+    sparse: bool,
+) -> Result<(), anyhow::Error> {
+    #[cfg(not(target_os = "linux"))]
+    if io_uring {
+        return Err(anyhow::anyhow!("io_uring is only supported on Linux"));
+    }
+
+    if io_uring && jobs > 1 {
+        return Err(anyhow::anyhow!("--io-uring cannot be combined with --jobs"));
+    }
+
+    if io_uring && sparse {
+        return Err(anyhow::anyhow!(
+            "--io-uring cannot be combined with --sparse"
+        ));
+    }
+
     let target_dir = match target_dir {
         Some(path) => PathBuf::from_str(path).unwrap(),
         None => {
@@ -77,25 +448,41 @@ pub async fn cmd_unpack(img_path: &str, target_dir: &Option<String>) -> Result<(
         }
     };
 
-    let mut img = open_image(Path::new(img_path)).await?;
-    let volume = xdvdfs::read::read_volume(&mut img).await?;
-    let tree = volume.root_table.file_tree(&mut img).await?;
+    match open_image_source(Path::new(img_path)).await? {
+        OpenedImage::Mapped(img) => unpack_image(&img, &target_dir, io_uring, jobs, sparse).await,
+        OpenedImage::File(img) => unpack_image(&img, &target_dir, io_uring, jobs, sparse).await,
+    }
+}
+
+async fn unpack_image(
+    img: &impl ImageSource,
+    target_dir: &Path,
+    io_uring: bool,
+    jobs: usize,
+    sparse: bool,
+) -> Result<(), anyhow::Error> {
+    #[cfg(target_os = "linux")]
+    let mut uring = None;
 
+    #[cfg(not(target_os = "linux"))]
+    let _ = io_uring;
+
+    let mut dev = SharedReader::new(img);
+    let volume = xdvdfs::read::read_volume(&mut dev).await?;
+    let tree = volume.root_table.file_tree(&mut dev).await?;
+
+    // Create the directory structure first, then extract files in the order they appear
+    // on disk, so the image is read in a single forward pass
+    let mut files = Vec::new();
     for (dir, dirent) in &tree {
         let dir = dir.trim_start_matches('/');
         let dirname = target_dir.join(dir);
         let file_name = dirent.name_str::<std::io::Error>()?;
         let file_path = dirname.join(&*file_name);
-        let is_dir = dirent.node.dirent.is_directory();
-
-        println!(
-            "Extracting {} {}",
-            if is_dir { "directory" } else { "file" },
-            file_path.display()
-        );
 
         std::fs::create_dir_all(dirname)?;
         if dirent.node.dirent.is_directory() {
+            println!("Extracting directory {}", file_path.display());
             std::fs::create_dir(file_path)?;
             continue;
         }
@@ -105,26 +492,47 @@ pub async fn cmd_unpack(img_path: &str, target_dir: &Option<String>) -> Result<(
             continue;
         }
 
-        let mut file = File::options()
+        files.push((file_path, dirent.node.dirent));
+    }
+
+    files.sort_by_key(|(_, dirent)| dirent.data.sector);
+    let hints = ReadAhead::new(img, files.iter().map(|(_, dirent)| dirent.data));
+
+    if jobs > 1 {
+        return unpack_parallel(img, &files, &hints, jobs, sparse);
+    }
+
+    for (idx, (file_path, dirent)) in files.iter().enumerate() {
+        println!("Extracting file {}", file_path.display());
+        hints.start(idx);
+
+        let file = File::options()
             .write(true)
             .truncate(true)
             .create(true)
             .open(file_path)?;
 
-        dirent.node.dirent.seek_to(img.get_mut())?;
-        let data = img.get_ref().get_ref().try_clone();
-        match data {
-            Ok(data) => {
-                let data = data.take(dirent.node.dirent.data.size as u64);
-                let mut data = std::io::BufReader::new(data);
-                std::io::copy(&mut data, &mut file)?;
-            }
-            Err(err) => {
-                eprintln!("Error in fast path, falling back to slow path: {:?}", err);
-                let data = dirent.node.dirent.read_data_all(&mut img).await?;
-                file.write_all(&data)?;
-            }
+        #[cfg(target_os = "linux")]
+        if io_uring {
+            write_uring(&mut uring, file, &file_data(img, dirent).await?).await?;
+            hints.finish(idx);
+            continue;
         }
+
+        if sparse {
+            let mut file = SparseFile::new(file)?;
+            file.write_at(0, &file_data(img, dirent).await?)?;
+            file.finish()?;
+        } else {
+            dirent.copy_to_file(img.file(), img.volume_offset(), &file)?;
+        }
+
+        hints.finish(idx);
+    }
+
+    #[cfg(target_os = "linux")]
+    if let Some(mut dev) = uring {
+        dev.flush_writes()?;
     }
 
     Ok(())
@@ -1,5 +1,6 @@
 use clap::{Parser, Subcommand};
 
+mod cmd_index;
 mod cmd_info;
 mod cmd_md5;
 mod cmd_pack;
@@ -21,11 +22,23 @@ enum Cmd {
 
         #[arg(default_value = "/", help = "Directory to list")]
         path: String,
+
+        #[arg(
+            long,
+            help = "List entries in on-disk order by scanning the directory table linearly"
+        )]
+        disk_order: bool,
     },
     #[command(about = "List all files in an image, recursively")]
     Tree {
         #[arg(help = "Path to XISO image")]
         image_path: String,
+
+        #[arg(
+            long,
+            help = "List entries in on-disk order by scanning directory tables linearly"
+        )]
+        disk_order: bool,
     },
     #[command(about = "Show MD5 checksums for files in an image")]
     Md5 {
@@ -34,6 +47,13 @@ enum Cmd {
 
         #[arg(help = "Target file within image")]
         path: Option<String>,
+
+        #[arg(
+            short,
+            long,
+            help = "Number of files to checksum in parallel [default: number of CPUs]"
+        )]
+        jobs: Option<usize>,
     },
     #[command(
         about = "Print information about image metadata",
@@ -49,6 +69,17 @@ enum Cmd {
         #[arg(help = "Path to file/directory within image")]
         file_entry: Option<String>,
     },
+    #[command(
+        about = "Write a sidecar index of an image's file tree",
+        long_about = "\
+        Write a sidecar index of an image's file tree next to the image. \
+        When the index exists, ls, tree, info and md5 read metadata from it \
+        instead of the image, and rebuild it if the image has changed."
+    )]
+    Index {
+        #[arg(help = "Path to XISO image")]
+        image_path: String,
+    },
     #[command(about = "Unpack an entire image to a directory")]
     Unpack {
         #[arg(help = "Path to XISO image")]
@@ -56,32 +87,131 @@ enum Cmd {
 
         #[arg(help = "Output directory")]
         path: Option<String>,
+
+        #[arg(long, help = "Write extracted files through io_uring (Linux only)")]
+        io_uring: bool,
+
+        #[arg(
+            short,
+            long,
+            default_value_t = 1,
+            help = "Number of files to extract in parallel"
+        )]
+        jobs: usize,
+
+        #[arg(long, help = "Leave holes in extracted files in place of zero blocks")]
+        sparse: bool,
     },
     #[command(about = "Pack an image from a given directory")]
     Pack {
         #[arg(help = "Path to source directory")]
         source_path: String,
 
-        #[arg(help = "Path to output image")]
+        #[arg(help = "Path to output image, or - to write it to stdout")]
         image_path: Option<String>,
+
+        #[arg(long, help = "Write the image through io_uring (Linux only)")]
+        io_uring: bool,
+
+        #[arg(long, help = "Leave holes in the image in place of zero blocks")]
+        sparse: bool,
+
+        #[arg(
+            long,
+            default_value_t = 1024,
+            help = "Size in KiB of each buffer used to copy files into the image"
+        )]
+        buffer_size: usize,
+
+        #[arg(
+            long,
+            help = "Print the image layout and size as JSON, without writing the image"
+        )]
+        dry_run: bool,
+
+        #[arg(
+            short,
+            long,
+            default_value_t = 1,
+            help = "Number of files to copy into the image in parallel"
+        )]
+        jobs: usize,
+
+        #[arg(
+            long,
+            help = "Store files with identical contents only once in the image"
+        )]
+        dedup: bool,
+
+        #[arg(
+            long,
+            value_enum,
+            default_value_t,
+            help = "How sectors are allocated to directories and files"
+        )]
+        layout: cmd_pack::Layout,
+
+        #[arg(long, help = "Place directories and files in order of their path")]
+        order_by_name: bool,
     },
 }
 
 async fn run_command(cmd: &Cmd) -> Result<(), anyhow::Error> {
     use Cmd::*;
     match cmd {
-        Ls { image_path, path } => cmd_read::cmd_ls(image_path, path).await,
-        Tree { image_path } => cmd_read::cmd_tree(image_path).await,
-        Md5 { image_path, path } => cmd_md5::cmd_md5(image_path, path.clone().as_deref()).await,
+        Ls {
+            image_path,
+            path,
+            disk_order,
+        } => cmd_read::cmd_ls(image_path, path, *disk_order).await,
+        Tree {
+            image_path,
+            disk_order,
+        } => cmd_read::cmd_tree(image_path, *disk_order).await,
+        Md5 {
+            image_path,
+            path,
+            jobs,
+        } => {
+            let jobs = jobs.unwrap_or_else(cmd_md5::default_jobs);
+            cmd_md5::cmd_md5(image_path, path.clone().as_deref(), jobs).await
+        }
         Info {
             image_path,
             file_entry,
         } => cmd_info::cmd_info(image_path, file_entry.as_ref()).await,
-        Unpack { image_path, path } => cmd_read::cmd_unpack(image_path, path).await,
+        Index { image_path } => cmd_index::cmd_index(image_path).await,
+        Unpack {
+            image_path,
+            path,
+            io_uring,
+            jobs,
+            sparse,
+        } => cmd_read::cmd_unpack(image_path, path, *io_uring, *jobs, *sparse).await,
         Pack {
             source_path,
             image_path,
-        } => cmd_pack::cmd_pack(source_path, image_path).await,
+            io_uring,
+            sparse,
+            buffer_size,
+            dry_run,
+            jobs,
+            dedup,
+            layout,
+            order_by_name,
+        } => {
+            let options = cmd_pack::PackOptions {
+                io_uring: *io_uring,
+                sparse: *sparse,
+                buffer_size: (*buffer_size).max(1) * 1024,
+                dry_run: *dry_run,
+                jobs: *jobs,
+                dedup: *dedup,
+                layout: *layout,
+                order_by_name: *order_by_name,
+            };
+            cmd_pack::cmd_pack(source_path, image_path, &options).await
+        }
     }
 }
 
@@ -0,0 +1,73 @@
+//! Compares sequential write and read throughput of the std `File` block device
+//! with `IoUringDevice`.
+//!
+//! Usage: cargo run --release --example uring_bench --features io_uring -- [path] [size in MiB]
+
+#[cfg(target_os = "linux")]
+fn main() -> std::io::Result<()> {
+    use futures::executor::block_on;
+    use std::time::Instant;
+    use xdvdfs::blockdev::uring::IoUringDevice;
+    use xdvdfs::blockdev::{BlockDeviceRead, BlockDeviceWrite};
+
+    const BLOCK_SIZE: usize = 1024 * 1024;
+
+    let mut args = std::env::args().skip(1);
+    let path = args
+        .next()
+        .map(std::path::PathBuf::from)
+        .unwrap_or_else(|| std::env::temp_dir().join("xdvdfs-uring-bench"));
+    let size_mib: usize = args.next().and_then(|s| s.parse().ok()).unwrap_or(1024);
+
+    let block: Vec<u8> = (0..BLOCK_SIZE).map(|i| (i % 251) as u8).collect();
+    let mut buf = vec![0; BLOCK_SIZE];
+    let open = || {
+        std::fs::File::options()
+            .read(true)
+            .write(true)
+            .create(true)
+            .truncate(true)
+            .open(&path)
+    };
+    let report = |name: &str, start: Instant| {
+        let secs = start.elapsed().as_secs_f64();
+        println!("{:<16} {:>8.1} MiB/s", name, size_mib as f64 / secs);
+    };
+
+    let mut file = open()?;
+    let start = Instant::now();
+    for idx in 0..size_mib {
+        block_on(file.write((idx * BLOCK_SIZE) as u64, &block))?;
+    }
+    file.sync_all()?;
+    report("std write", start);
+
+    let start = Instant::now();
+    for idx in 0..size_mib {
+        block_on(file.read((idx * BLOCK_SIZE) as u64, &mut buf))?;
+    }
+    report("std read", start);
+
+    let mut dev = IoUringDevice::new(open()?)?;
+    let start = Instant::now();
+    for idx in 0..size_mib {
+        block_on(dev.write((idx * BLOCK_SIZE) as u64, &block))?;
+    }
+    dev.flush_writes()?;
+    dev.get_ref().sync_all()?;
+    report("io_uring write", start);
+
+    let start = Instant::now();
+    for idx in 0..size_mib {
+        block_on(dev.read((idx * BLOCK_SIZE) as u64, &mut buf))?;
+    }
+    report("io_uring read", start);
+
+    drop(dev);
+    std::fs::remove_file(&path)
+}
+
+#[cfg(not(target_os = "linux"))]
+fn main() {
+    eprintln!("io_uring is only supported on Linux");
+}
@@ -1,6 +1,18 @@
 use alloc::boxed::Box;
 use async_trait::async_trait;
 
+#[cfg(feature = "std")]
+pub mod copy;
+
+#[cfg(feature = "std")]
+pub mod sequential;
+
+#[cfg(feature = "std")]
+pub mod sparse;
+
+#[cfg(all(feature = "io_uring", target_os = "linux"))]
+pub mod uring;
+
 const XDVD_OFFSETS: &[u64] = &[0, 387 * 1024 * 1024];
 
 /// Trait for read operations on some block device containing an XDVDFS filesystem
@@ -10,6 +22,105 @@ const XDVD_OFFSETS: &[u64] = &[0, 387 * 1024 * 1024];
 #[async_trait(?Send)]
 pub trait BlockDeviceRead<E> {
     async fn read(&mut self, offset: u64, buffer: &mut [u8]) -> Result<(), E>;
+
+    /// Fills each buffer with the data at its offset.
+    ///
+    /// The default implementation reads each request in turn. Devices where
+    /// round trips are expensive can instead merge nearby requests,
+    /// for example with `read_coalesced`.
+    async fn read_batch(&mut self, requests: &mut [(u64, &mut [u8])]) -> Result<(), E> {
+        for (offset, buffer) in requests.iter_mut() {
+            self.read(*offset, buffer).await?;
+        }
+
+        Ok(())
+    }
+}
+
+/// Largest gap between two requests that `read_coalesced` will read through
+/// to merge them, by default
+#[cfg(feature = "read")]
+pub const DEFAULT_COALESCE_GAP: u64 = 16 * crate::layout::SECTOR_SIZE;
+
+/// Largest single read that `read_coalesced` will issue when merging requests, by default
+#[cfg(feature = "read")]
+pub const DEFAULT_COALESCE_LIMIT: u64 = 4 * 1024 * 1024;
+
+/// Reads a batch of requests, merging requests that are adjacent, overlapping,
+/// or at most `max_gap` bytes apart into a single device read of at most `max_len` bytes.
+///
+/// Requests are read in order of offset, and merged reads are scattered back into
+/// the caller buffers. Requests that cannot be merged are read directly into their buffer.
+#[cfg(feature = "read")]
+pub async fn read_coalesced<E>(
+    dev: &mut (impl BlockDeviceRead<E> + ?Sized),
+    requests: &mut [(u64, &mut [u8])],
+    max_gap: u64,
+    max_len: u64,
+) -> Result<(), E> {
+    use alloc::vec::Vec;
+
+    let mut order: Vec<usize> = (0..requests.len()).collect();
+    order.sort_by_key(|idx| requests[*idx].0);
+
+    let mut start = 0;
+    while start < order.len() {
+        let span_start = requests[order[start]].0;
+        let mut span_end = span_start + requests[order[start]].1.len() as u64;
+
+        let mut end = start + 1;
+        while let Some(idx) = order.get(end) {
+            let (offset, buffer) = &requests[*idx];
+            let req_end = core::cmp::max(span_end, offset + buffer.len() as u64);
+            if *offset > span_end + max_gap || req_end - span_start > max_len {
+                break;
+            }
+
+            span_end = req_end;
+            end += 1;
+        }
+
+        if end - start == 1 {
+            let (offset, buffer) = &mut requests[order[start]];
+            dev.read(*offset, buffer).await?;
+        } else {
+            dprintln!(
+                "[read_coalesced] Merging {} reads into {}..{}",
+                end - start,
+                span_start,
+                span_end
+            );
+
+            let mut span = alloc::vec![0; (span_end - span_start) as usize];
+            dev.read(span_start, &mut span).await?;
+            for idx in &order[start..end] {
+                let (offset, buffer) = &mut requests[*idx];
+                let pos = (*offset - span_start) as usize;
+                buffer.copy_from_slice(&span[pos..pos + buffer.len()]);
+            }
+        }
+
+        start = end;
+    }
+
+    Ok(())
+}
+
+/// Trait for positional reads that only need a shared reference to the device,
+/// allowing several readers to use the same device at once.
+///
+/// Use `SharedReader` to pass such a device to APIs that take a `BlockDeviceRead`.
+#[cfg(feature = "read")]
+#[async_trait(?Send)]
+pub trait BlockDeviceReadAt<E> {
+    async fn read_at(&self, offset: u64, buffer: &mut [u8]) -> Result<(), E>;
+}
+
+/// Trait for block devices whose contents are already in memory,
+/// allowing a region to be borrowed without copying it into a buffer
+#[cfg(feature = "read")]
+pub trait BlockDeviceSlice<E> {
+    fn slice(&self, offset: u64, len: u64) -> Result<&[u8], E>;
 }
 
 /// Trait for write operations on some block device
@@ -24,6 +135,13 @@ pub trait BlockDeviceWrite<E> {
     async fn is_empty(&mut self) -> Result<bool, E> {
         self.len().await.map(|len| len == 0)
     }
+
+    /// Returns the plain file backing this device, with any buffered writes flushed,
+    /// so that data can be copied into it directly at an offset.
+    /// Devices that are not a plain file return `None`.
+    fn as_file(&mut self) -> Option<&std::fs::File> {
+        None
+    }
 }
 
 #[derive(Copy, Clone, Debug)]
@@ -38,12 +156,102 @@ impl<T: AsRef<[u8]>> BlockDeviceRead<OutOfBounds> for T {
         }
 
         let size = core::cmp::min(self.as_ref().len() - offset, buffer.len());
+        if size < buffer.len() {
+            return Err(OutOfBounds);
+        }
+
         let range = offset..(offset + size);
         buffer.copy_from_slice(&self.as_ref()[range]);
         Ok(())
     }
 }
 
+#[cfg(feature = "read")]
+impl<T: AsRef<[u8]>> BlockDeviceSlice<OutOfBounds> for T {
+    fn slice(&self, offset: u64, len: u64) -> Result<&[u8], OutOfBounds> {
+        let data = self.as_ref();
+        offset
+            .checked_add(len)
+            .filter(|end| *end <= data.len() as u64)
+            .map(|end| &data[offset as usize..end as usize])
+            .ok_or(OutOfBounds)
+    }
+}
+
+#[cfg(feature = "read")]
+#[async_trait(?Send)]
+impl<T: AsRef<[u8]>> BlockDeviceReadAt<OutOfBounds> for T {
+    async fn read_at(&self, offset: u64, buffer: &mut [u8]) -> Result<(), OutOfBounds> {
+        let data = self.slice(offset, buffer.len() as u64)?;
+        buffer.copy_from_slice(data);
+        Ok(())
+    }
+}
+
+/// Adapter that implements `BlockDeviceRead` over a shared `BlockDeviceReadAt`.
+///
+/// Adapters are cheap to copy, and each concurrent reader should hold its own,
+/// all borrowing the same underlying device.
+#[cfg(feature = "read")]
+pub struct SharedReader<'a, T, E>
+where
+    T: BlockDeviceReadAt<E> + ?Sized,
+{
+    dev: &'a T,
+    etype: core::marker::PhantomData<E>,
+}
+
+#[cfg(feature = "read")]
+impl<'a, T, E> SharedReader<'a, T, E>
+where
+    T: BlockDeviceReadAt<E> + ?Sized,
+{
+    pub fn new(dev: &'a T) -> Self {
+        Self {
+            dev,
+            etype: core::marker::PhantomData,
+        }
+    }
+
+    pub fn get_ref(&self) -> &'a T {
+        self.dev
+    }
+}
+
+#[cfg(feature = "read")]
+impl<T, E> Clone for SharedReader<'_, T, E>
+where
+    T: BlockDeviceReadAt<E> + ?Sized,
+{
+    fn clone(&self) -> Self {
+        *self
+    }
+}
+
+#[cfg(feature = "read")]
+impl<T, E> Copy for SharedReader<'_, T, E> where T: BlockDeviceReadAt<E> + ?Sized {}
+
+#[cfg(feature = "read")]
+#[async_trait(?Send)]
+impl<T, E> BlockDeviceRead<E> for SharedReader<'_, T, E>
+where
+    T: BlockDeviceReadAt<E> + ?Sized,
+{
+    async fn read(&mut self, offset: u64, buffer: &mut [u8]) -> Result<(), E> {
+        self.dev.read_at(offset, buffer).await
+    }
+}
+
+#[cfg(feature = "read")]
+impl<T, E> BlockDeviceSlice<E> for SharedReader<'_, T, E>
+where
+    T: BlockDeviceReadAt<E> + BlockDeviceSlice<E> + ?Sized,
+{
+    fn slice(&self, offset: u64, len: u64) -> Result<&[u8], E> {
+        self.dev.slice(offset, len)
+    }
+}
+
 pub struct OffsetWrapper<T, E>
 where
     T: BlockDeviceRead<E> + Sized,
@@ -83,6 +291,11 @@ where
     pub fn get_mut(&mut self) -> &mut T {
         &mut self.inner
     }
+
+    /// Byte offset of the XDVDFS volume within the inner device
+    pub fn offset(&self) -> u64 {
+        self.offset
+    }
 }
 
 #[async_trait(?Send)]
@@ -93,6 +306,40 @@ where
     async fn read(&mut self, offset: u64, buffer: &mut [u8]) -> Result<(), E> {
         self.inner.read(offset + self.offset, buffer).await
     }
+
+    async fn read_batch(&mut self, requests: &mut [(u64, &mut [u8])]) -> Result<(), E> {
+        for (offset, _) in requests.iter_mut() {
+            *offset += self.offset;
+        }
+
+        let res = self.inner.read_batch(requests).await;
+        for (offset, _) in requests.iter_mut() {
+            *offset -= self.offset;
+        }
+
+        res
+    }
+}
+
+#[cfg(feature = "read")]
+impl<T, E> BlockDeviceSlice<E> for OffsetWrapper<T, E>
+where
+    T: BlockDeviceRead<E> + BlockDeviceSlice<E>,
+{
+    fn slice(&self, offset: u64, len: u64) -> Result<&[u8], E> {
+        self.inner.slice(offset + self.offset, len)
+    }
+}
+
+#[cfg(feature = "read")]
+#[async_trait(?Send)]
+impl<T, E> BlockDeviceReadAt<E> for OffsetWrapper<T, E>
+where
+    T: BlockDeviceRead<E> + BlockDeviceReadAt<E>,
+{
+    async fn read_at(&self, offset: u64, buffer: &mut [u8]) -> Result<(), E> {
+        self.inner.read_at(offset + self.offset, buffer).await
+    }
 }
 
 #[cfg(feature = "write")]
@@ -110,6 +357,383 @@ where
     }
 }
 
+/// Read-only, memory-mapped image file.
+///
+/// Reads copy directly out of the mapping, and `BlockDeviceSlice` borrows
+/// file data from it without any copy, leaving caching to the OS page cache.
+///
+/// The image must not be modified by another process while it is mapped.
+#[cfg(feature = "mmap")]
+pub struct MmapBlockDevice {
+    map: memmap2::Mmap,
+    file: std::fs::File,
+}
+
+/// Expected access pattern for a region of a memory-mapped image
+#[cfg(feature = "mmap")]
+#[derive(Copy, Clone, Debug, Eq, PartialEq)]
+pub enum AccessHint {
+    /// The region will be read front to back
+    Sequential,
+
+    /// The region will be read soon, and can be fetched ahead of time
+    WillNeed,
+
+    /// The region has been consumed, and its cached pages can be dropped
+    DontNeed,
+}
+
+#[cfg(feature = "mmap")]
+impl MmapBlockDevice {
+    pub fn open(path: impl AsRef<std::path::Path>) -> std::io::Result<Self> {
+        let file = std::fs::File::open(path)?;
+        Self::from_file(&file)
+    }
+
+    pub fn from_file(file: &std::fs::File) -> std::io::Result<Self> {
+        // Safety: The mapping is read-only, and images are not expected
+        // to change while they are being read.
+        let map = unsafe { memmap2::Mmap::map(file)? };
+        let file = file.try_clone()?;
+        Ok(Self { map, file })
+    }
+
+    /// Advises the OS how a region of the image will be accessed.
+    ///
+    /// Hints are best-effort, and do nothing on platforms that do not support them.
+    #[cfg(target_os = "linux")]
+    pub fn advise(&self, offset: u64, len: u64, hint: AccessHint) -> std::io::Result<()> {
+        use std::os::fd::AsRawFd;
+
+        let end = offset.saturating_add(len).min(self.len());
+        if offset >= end {
+            return Ok(());
+        }
+
+        // madvise requires a page-aligned start address
+        let page_size = unsafe { libc::sysconf(libc::_SC_PAGESIZE) } as u64;
+        let start = offset - offset % page_size;
+        let addr = unsafe { self.map.as_ptr().add(start as usize) } as *mut libc::c_void;
+        let map_len = (end - start) as usize;
+
+        let advice = match hint {
+            AccessHint::Sequential => libc::MADV_SEQUENTIAL,
+            AccessHint::WillNeed => libc::MADV_WILLNEED,
+            AccessHint::DontNeed => libc::MADV_DONTNEED,
+        };
+
+        // Safety: The range lies within the mapping. The mapping is read-only and
+        // file-backed, so dropping its pages only causes them to be read back from
+        // the file on the next access, and borrowed slices see the same data.
+        if unsafe { libc::madvise(addr, map_len, advice) } != 0 {
+            return Err(std::io::Error::last_os_error());
+        }
+
+        // Unmapped pages stay in the page cache until they are dropped from the file as well
+        if hint == AccessHint::DontNeed {
+            let res = unsafe {
+                libc::posix_fadvise(
+                    self.file.as_raw_fd(),
+                    start as libc::off_t,
+                    (end - start) as libc::off_t,
+                    libc::POSIX_FADV_DONTNEED,
+                )
+            };
+            if res != 0 {
+                return Err(std::io::Error::from_raw_os_error(res));
+            }
+        }
+
+        Ok(())
+    }
+
+    /// Advises the OS how a region of the image will be accessed.
+    ///
+    /// Hints are best-effort, and do nothing on platforms that do not support them.
+    #[cfg(not(target_os = "linux"))]
+    pub fn advise(&self, _offset: u64, _len: u64, _hint: AccessHint) -> std::io::Result<()> {
+        Ok(())
+    }
+
+    pub fn len(&self) -> u64 {
+        self.map.len() as u64
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.map.is_empty()
+    }
+
+    pub fn as_slice(&self) -> &[u8] {
+        &self.map
+    }
+
+    /// Returns the mapped file, for operations such as `copy::copy_range`
+    /// that work on the file instead of the mapping
+    pub fn file(&self) -> &std::fs::File {
+        &self.file
+    }
+}
+
+#[cfg(feature = "mmap")]
+impl BlockDeviceSlice<std::io::Error> for MmapBlockDevice {
+    fn slice(&self, offset: u64, len: u64) -> Result<&[u8], std::io::Error> {
+        offset
+            .checked_add(len)
+            .filter(|end| *end <= self.len())
+            .map(|end| &self.map[offset as usize..end as usize])
+            .ok_or_else(|| std::io::Error::from(std::io::ErrorKind::UnexpectedEof))
+    }
+}
+
+#[cfg(feature = "mmap")]
+#[async_trait(?Send)]
+impl BlockDeviceRead<std::io::Error> for MmapBlockDevice {
+    async fn read(&mut self, offset: u64, buffer: &mut [u8]) -> Result<(), std::io::Error> {
+        let data = self.slice(offset, buffer.len() as u64)?;
+        buffer.copy_from_slice(data);
+        Ok(())
+    }
+}
+
+#[cfg(feature = "mmap")]
+#[async_trait(?Send)]
+impl BlockDeviceReadAt<std::io::Error> for MmapBlockDevice {
+    async fn read_at(&self, offset: u64, buffer: &mut [u8]) -> Result<(), std::io::Error> {
+        let data = self.slice(offset, buffer.len() as u64)?;
+        buffer.copy_from_slice(data);
+        Ok(())
+    }
+}
+
+/// Default size of a page in a `CachingBlockDevice`, in bytes
+#[cfg(feature = "read")]
+pub const DEFAULT_PAGE_SIZE: u64 = 16 * crate::layout::SECTOR_SIZE;
+
+/// Default number of pages held by a `CachingBlockDevice`
+#[cfg(feature = "read")]
+pub const DEFAULT_PAGE_CAPACITY: usize = 256;
+
+/// Counters describing how well a `CachingBlockDevice` is performing
+#[cfg(feature = "read")]
+#[derive(Copy, Clone, Debug, Default, Eq, PartialEq)]
+pub struct PageCacheStats {
+    /// Number of pages served from the cache
+    pub hits: u64,
+
+    /// Number of pages that had to be read from the device
+    pub misses: u64,
+
+    /// Number of pages dropped to stay within capacity
+    pub evictions: u64,
+
+    /// Number of pages read ahead of a sequential access
+    pub prefetched: u64,
+}
+
+#[cfg(feature = "read")]
+struct CachedPage {
+    data: Box<[u8]>,
+    last_used: u64,
+}
+
+/// Wrapper that caches reads from the underlying device in fixed-size,
+/// sector-aligned pages.
+///
+/// Small reads, such as directory entry headers, are served from cached pages.
+/// When consecutive pages are accessed, the following `read_ahead` pages are
+/// fetched with the same device read. Reads larger than a page bypass the cache.
+///
+/// The cache holds at most `capacity` pages, evicting the least recently used.
+#[cfg(feature = "read")]
+pub struct CachingBlockDevice<T, E>
+where
+    T: BlockDeviceRead<E> + Sized,
+{
+    inner: T,
+    page_size: u64,
+    capacity: usize,
+    read_ahead: u64,
+    pages: alloc::collections::BTreeMap<u64, CachedPage>,
+    recency: alloc::collections::BTreeMap<u64, u64>,
+    last_page: Option<u64>,
+    tick: u64,
+    stats: PageCacheStats,
+    etype: core::marker::PhantomData<E>,
+}
+
+#[cfg(feature = "read")]
+impl<T, E> CachingBlockDevice<T, E>
+where
+    T: BlockDeviceRead<E> + Sized,
+{
+    /// Wraps `dev` with a cache of `capacity` pages of `page_size` bytes.
+    /// The page size is rounded up to a whole number of sectors.
+    pub fn new(dev: T, page_size: u64, capacity: usize) -> Self {
+        let sector_size = crate::layout::SECTOR_SIZE;
+        let page_size = core::cmp::max(page_size, 1);
+        let page_size = page_size + (sector_size - page_size % sector_size) % sector_size;
+
+        Self {
+            inner: dev,
+            page_size,
+            capacity: core::cmp::max(capacity, 1),
+            read_ahead: 0,
+            pages: alloc::collections::BTreeMap::new(),
+            recency: alloc::collections::BTreeMap::new(),
+            last_page: None,
+            tick: 0,
+            stats: PageCacheStats::default(),
+            etype: core::marker::PhantomData,
+        }
+    }
+
+    /// Sets the number of pages to prefetch on sequential access
+    pub fn with_read_ahead(mut self, pages: u64) -> Self {
+        self.read_ahead = pages;
+        self
+    }
+
+    pub fn page_size(&self) -> u64 {
+        self.page_size
+    }
+
+    pub fn capacity(&self) -> usize {
+        self.capacity
+    }
+
+    pub fn stats(&self) -> PageCacheStats {
+        self.stats
+    }
+
+    /// Drops all cached pages. Counters are preserved.
+    pub fn clear(&mut self) {
+        self.pages.clear();
+        self.recency.clear();
+        self.last_page = None;
+    }
+
+    pub fn get_ref(&self) -> &T {
+        &self.inner
+    }
+
+    pub fn get_mut(&mut self) -> &mut T {
+        &mut self.inner
+    }
+
+    pub fn into_inner(self) -> T {
+        self.inner
+    }
+
+    fn insert(&mut self, page: u64, data: Box<[u8]>) {
+        while self.pages.len() >= self.capacity {
+            let Some((_, evicted)) = self.recency.pop_first() else {
+                break;
+            };
+
+            self.pages.remove(&evicted);
+            self.stats.evictions += 1;
+        }
+
+        self.tick += 1;
+        self.recency.insert(self.tick, page);
+        self.pages.insert(
+            page,
+            CachedPage {
+                data,
+                last_used: self.tick,
+            },
+        );
+    }
+
+    /// Reads `page`, along with any uncached pages that follow it
+    /// if the access is sequential. Returns false if the page could not be read.
+    async fn fill(&mut self, page: u64) -> bool {
+        let sequential = page > 0 && self.last_page == Some(page - 1);
+        let mut count = 1;
+        if sequential {
+            // Prefetched pages must not evict the requested page, which is inserted first
+            let limit = core::cmp::min(self.read_ahead + 1, self.capacity as u64);
+            while count < limit && !self.pages.contains_key(&(page + count)) {
+                count += 1;
+            }
+        }
+
+        let page_size = self.page_size as usize;
+        let mut buf = alloc::vec![0; page_size * count as usize];
+        let mut result = self.inner.read(page * self.page_size, &mut buf).await;
+
+        // Prefetching may run past the end of the device, retry with only the requested page
+        if result.is_err() && count > 1 {
+            count = 1;
+            buf.truncate(page_size);
+            result = self.inner.read(page * self.page_size, &mut buf).await;
+        }
+
+        if result.is_err() {
+            return false;
+        }
+
+        self.stats.misses += 1;
+        self.stats.prefetched += count - 1;
+        for (idx, data) in buf.chunks_exact(page_size).enumerate() {
+            self.insert(page + idx as u64, data.into());
+        }
+
+        true
+    }
+
+    fn touch(&mut self, page: u64) -> bool {
+        self.tick += 1;
+        let tick = self.tick;
+
+        match self.pages.get_mut(&page) {
+            Some(entry) => {
+                self.recency.remove(&entry.last_used);
+                self.recency.insert(tick, page);
+                entry.last_used = tick;
+                true
+            }
+            None => false,
+        }
+    }
+}
+
+#[cfg(feature = "read")]
+#[async_trait(?Send)]
+impl<T, E> BlockDeviceRead<E> for CachingBlockDevice<T, E>
+where
+    T: BlockDeviceRead<E>,
+{
+    async fn read(&mut self, offset: u64, buffer: &mut [u8]) -> Result<(), E> {
+        if buffer.len() as u64 > self.page_size {
+            return self.inner.read(offset, buffer).await;
+        }
+
+        let end = offset + buffer.len() as u64;
+        let mut pos = offset;
+        while pos < end {
+            let page = pos / self.page_size;
+            if self.touch(page) {
+                self.stats.hits += 1;
+            } else if !self.fill(page).await {
+                // The page extends past the end of the device, read only what was asked for
+                return self.inner.read(offset, buffer).await;
+            }
+
+            self.last_page = Some(page);
+
+            let page_offset = (pos - page * self.page_size) as usize;
+            let len = core::cmp::min(end - pos, self.page_size - page_offset as u64) as usize;
+            let data = &self.pages[&page].data;
+            let dest = (pos - offset) as usize;
+            buffer[dest..dest + len].copy_from_slice(&data[page_offset..page_offset + len]);
+            pos += len as u64;
+        }
+
+        Ok(())
+    }
+}
+
 #[cfg(all(feature = "std", feature = "read"))]
 #[async_trait(?Send)]
 impl<R> BlockDeviceRead<std::io::Error> for R
@@ -122,6 +746,40 @@ where
 
         Ok(())
     }
+
+    async fn read_batch(
+        &mut self,
+        requests: &mut [(u64, &mut [u8])],
+    ) -> Result<(), std::io::Error> {
+        read_coalesced(self, requests, DEFAULT_COALESCE_GAP, DEFAULT_COALESCE_LIMIT).await
+    }
+}
+
+#[cfg(all(feature = "std", feature = "read", unix))]
+#[async_trait(?Send)]
+impl BlockDeviceReadAt<std::io::Error> for std::fs::File {
+    async fn read_at(&self, offset: u64, buffer: &mut [u8]) -> Result<(), std::io::Error> {
+        std::os::unix::fs::FileExt::read_exact_at(self, buffer, offset)
+    }
+}
+
+#[cfg(all(feature = "std", feature = "read", windows))]
+#[async_trait(?Send)]
+impl BlockDeviceReadAt<std::io::Error> for std::fs::File {
+    async fn read_at(&self, offset: u64, buffer: &mut [u8]) -> Result<(), std::io::Error> {
+        use std::os::windows::fs::FileExt;
+
+        // seek_read moves the file cursor, but never depends on it
+        let mut read = 0;
+        while read < buffer.len() {
+            match self.seek_read(&mut buffer[read..], offset + read as u64)? {
+                0 => return Err(std::io::Error::from(std::io::ErrorKind::UnexpectedEof)),
+                n => read += n,
+            }
+        }
+
+        Ok(())
+    }
 }
 
 #[cfg(all(feature = "std", feature = "write"))]
@@ -138,6 +796,10 @@ impl BlockDeviceWrite<std::io::Error> for std::fs::File {
     async fn len(&mut self) -> Result<u64, std::io::Error> {
         Ok(self.metadata()?.len())
     }
+
+    fn as_file(&mut self) -> Option<&std::fs::File> {
+        Some(self)
+    }
 }
 
 #[cfg(all(feature = "std", feature = "write"))]
@@ -152,6 +814,249 @@ impl BlockDeviceWrite<std::io::Error> for std::io::BufWriter<std::fs::File> {
     }
 
     async fn len(&mut self) -> Result<u64, std::io::Error> {
-        Ok(self.get_mut().metadata()?.len())
+        // Buffered writes may extend the file
+        std::io::Write::flush(self)?;
+        Ok(self.get_ref().metadata()?.len())
+    }
+
+    fn as_file(&mut self) -> Option<&std::fs::File> {
+        // If the flush fails, the caller falls back to writing through the buffer,
+        // which reports the error
+        std::io::Write::flush(self).ok()?;
+        Some(self.get_ref())
+    }
+}
+
+#[cfg(all(test, feature = "read"))]
+mod test {
+    use alloc::vec::Vec;
+    use futures::executor;
+
+    use alloc::boxed::Box;
+    use async_trait::async_trait;
+
+    use super::{
+        read_coalesced, BlockDeviceRead, BlockDeviceReadAt, BlockDeviceSlice, CachingBlockDevice,
+        OffsetWrapper, OutOfBounds, SharedReader,
+    };
+    use crate::layout::{DirectoryEntryDiskData, DirentAttributes, DiskRegion};
+
+    fn image() -> Vec<u8> {
+        (0..16 * 2048).map(|i| (i % 251) as u8).collect()
+    }
+
+    #[test]
+    fn test_caching_small_reads() {
+        let data = image();
+        let mut dev = CachingBlockDevice::new(data.clone(), 2048, 4);
+
+        let mut buf = [0; 14];
+        executor::block_on(dev.read(100, &mut buf)).unwrap();
+        assert_eq!(&buf, &data[100..114]);
+        executor::block_on(dev.read(200, &mut buf)).unwrap();
+        assert_eq!(&buf, &data[200..214]);
+
+        // Straddles the first and second page
+        executor::block_on(dev.read(2040, &mut buf)).unwrap();
+        assert_eq!(&buf, &data[2040..2054]);
+
+        let stats = dev.stats();
+        assert_eq!((stats.hits, stats.misses, stats.evictions), (2, 2, 0));
+
+        // Larger than a page, read directly
+        let mut big = [0; 4096];
+        executor::block_on(dev.read(0, &mut big)).unwrap();
+        assert_eq!(&big[..], &data[0..4096]);
+        assert_eq!(dev.stats().misses, 2);
+    }
+
+    #[test]
+    fn test_caching_read_ahead_and_eviction() {
+        let data = image();
+        let mut dev = CachingBlockDevice::new(data.clone(), 2048, 4).with_read_ahead(2);
+
+        let mut buf = [0; 16];
+        for page in 0..8 {
+            let offset = page * 2048 + 8;
+            executor::block_on(dev.read(offset, &mut buf)).unwrap();
+            assert_eq!(&buf, &data[offset as usize..offset as usize + 16]);
+        }
+
+        // Page 0 is read on its own, then each sequential miss prefetches two pages
+        let stats = dev.stats();
+        assert_eq!(stats.misses, 4);
+        assert_eq!(stats.prefetched, 6);
+        assert_eq!(stats.hits, 4);
+        assert!(stats.evictions > 0);
+    }
+
+    #[test]
+    fn test_caching_read_ahead_exceeds_capacity() {
+        let data = image();
+        for (capacity, read_ahead) in [(2, 2), (4, 4), (1, 3)] {
+            let mut dev =
+                CachingBlockDevice::new(data.clone(), 2048, capacity).with_read_ahead(read_ahead);
+
+            let mut buf = [0; 16];
+            for page in 0..8 {
+                let offset = page * 2048 + 8;
+                executor::block_on(dev.read(offset, &mut buf)).unwrap();
+                assert_eq!(&buf, &data[offset as usize..offset as usize + 16]);
+            }
+
+            assert!(dev.stats().prefetched <= 8 * (capacity as u64 - 1));
+        }
+    }
+
+    #[test]
+    fn test_caching_end_of_device() {
+        let data = image();
+        let mut dev = CachingBlockDevice::new(data.clone(), 3 * 2048, 4).with_read_ahead(4);
+
+        // The last page is only partially backed by the device
+        let mut buf = [0; 16];
+        let offset = data.len() as u64 - 16;
+        executor::block_on(dev.read(offset, &mut buf)).unwrap();
+        assert_eq!(&buf, &data[data.len() - 16..]);
+
+        let res = executor::block_on(dev.read(data.len() as u64 - 8, &mut buf));
+        assert!(matches!(res, Err(OutOfBounds)));
+    }
+
+    #[test]
+    fn test_slice_borrows_file_data() {
+        let data = image();
+        assert_eq!(data.slice(4, 4).unwrap(), &data[4..8]);
+        assert!(data.slice(data.len() as u64 - 2, 4).is_err());
+
+        let dirent = DirectoryEntryDiskData {
+            data: DiskRegion {
+                sector: 2,
+                size: 100,
+            },
+            attributes: DirentAttributes(0),
+            filename_length: 0,
+        };
+        let slice = dirent.data_slice(&data).unwrap();
+        assert_eq!(slice, &data[4096..4196]);
+        assert_eq!(slice.as_ptr(), data[4096..].as_ptr());
+    }
+
+    #[test]
+    fn test_shared_readers() {
+        let data = image();
+        let mut a = SharedReader::new(&data);
+        let mut b = a;
+
+        let mut buf_a = [0; 32];
+        let mut buf_b = [0; 32];
+        executor::block_on(a.read(4000, &mut buf_a)).unwrap();
+        executor::block_on(b.read(8000, &mut buf_b)).unwrap();
+        executor::block_on(data.read_at(12000, &mut buf_a[0..16])).unwrap();
+        assert_eq!(&buf_a[0..16], &data[12000..12016]);
+        assert_eq!(&buf_a[16..], &data[4016..4032]);
+        assert_eq!(&buf_b, &data[8000..8032]);
+    }
+
+    #[cfg(feature = "std")]
+    #[test]
+    fn test_shared_readers_across_threads() {
+        let data = image();
+        std::thread::scope(|scope| {
+            for thread in 0..4 {
+                let mut reader = SharedReader::new(&data);
+                let data = &data;
+                scope.spawn(move || {
+                    let mut buf = [0; 2048];
+                    for sector in (thread..16).step_by(4) {
+                        let offset = sector * 2048;
+                        executor::block_on(reader.read(offset as u64, &mut buf)).unwrap();
+                        assert_eq!(&buf, &data[offset..offset + 2048]);
+                    }
+                });
+            }
+        });
+    }
+
+    struct CountingDevice {
+        data: Vec<u8>,
+        reads: Vec<(u64, usize)>,
+    }
+
+    #[async_trait(?Send)]
+    impl BlockDeviceRead<OutOfBounds> for CountingDevice {
+        async fn read(&mut self, offset: u64, buffer: &mut [u8]) -> Result<(), OutOfBounds> {
+            self.reads.push((offset, buffer.len()));
+            self.data.read(offset, buffer).await
+        }
+    }
+
+    #[test]
+    fn test_read_coalesced() {
+        let data = image();
+        let mut dev = CountingDevice {
+            data: data.clone(),
+            reads: Vec::new(),
+        };
+
+        let mut a = [0; 16];
+        let mut b = [0; 16];
+        let mut c = [0; 16];
+        let mut d = [0; 8];
+        let mut requests: [(u64, &mut [u8]); 4] =
+            [(20000, &mut c), (100, &mut a), (120, &mut b), (110, &mut d)];
+        executor::block_on(read_coalesced(&mut dev, &mut requests, 64, 4096)).unwrap();
+
+        assert_eq!(dev.reads, [(100, 36), (20000, 16)]);
+        assert_eq!(&a, &data[100..116]);
+        assert_eq!(&b, &data[120..136]);
+        assert_eq!(&c, &data[20000..20016]);
+        assert_eq!(&d, &data[110..118]);
+
+        // Too far apart to merge with no gap allowed
+        dev.reads.clear();
+        let mut requests: [(u64, &mut [u8]); 2] = [(0, &mut a), (20, &mut b)];
+        executor::block_on(read_coalesced(&mut dev, &mut requests, 0, 4096)).unwrap();
+        assert_eq!(dev.reads.len(), 2);
+    }
+
+    #[test]
+    fn test_read_batch_through_offset() {
+        let data = image();
+        let mut dev = OffsetWrapper {
+            inner: data.clone(),
+            offset: 2048,
+            etype: core::marker::PhantomData,
+        };
+
+        let mut a = [0; 16];
+        let mut b = [0; 16];
+        let mut requests: [(u64, &mut [u8]); 2] = [(0, &mut a), (4096, &mut b)];
+        executor::block_on(dev.read_batch(&mut requests)).unwrap();
+        assert_eq!(requests[1].0, 4096);
+        assert_eq!(&a, &data[2048..2064]);
+        assert_eq!(&b, &data[6144..6160]);
+    }
+
+    #[cfg(feature = "mmap")]
+    #[test]
+    fn test_mmap_advise_keeps_data() {
+        use super::{AccessHint, MmapBlockDevice};
+
+        let data = image();
+        let path = std::env::temp_dir().join(std::format!("xdvdfs-mmap-{}", std::process::id()));
+        std::fs::write(&path, &data).unwrap();
+
+        let dev = MmapBlockDevice::open(&path).unwrap();
+        dev.advise(0, dev.len(), AccessHint::Sequential).unwrap();
+        dev.advise(100, 5000, AccessHint::WillNeed).unwrap();
+        assert_eq!(dev.slice(100, 16).unwrap(), &data[100..116]);
+
+        dev.advise(100, 5000, AccessHint::DontNeed).unwrap();
+        dev.advise(dev.len(), 10, AccessHint::DontNeed).unwrap();
+        assert_eq!(dev.as_slice(), &data[..]);
+
+        drop(dev);
+        std::fs::remove_file(path).unwrap();
     }
 }
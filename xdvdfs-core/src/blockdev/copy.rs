@@ -0,0 +1,377 @@
+use std::fs::File;
+use std::io;
+
+/// Size of the buffer used when data has to be copied through userspace
+const COPY_BUFFER_SIZE: usize = 1024 * 1024;
+
+/// Largest copy requested from the kernel in one call
+#[cfg(target_os = "linux")]
+const KERNEL_COPY_CHUNK: u64 = 1024 * 1024 * 1024;
+
+/// Copies `len` bytes from `src` at `src_offset` into `dst` at `dst_offset`.
+///
+/// On Linux the data is copied with `copy_file_range`, which never leaves the kernel
+/// and lets filesystems such as btrfs and XFS share extents between the two files
+/// instead of copying them. If that is unsupported for the pair of files, `sendfile`
+/// is tried next. Otherwise the source is memory mapped and written from the mapping
+/// when the `mmap` feature is enabled, or copied through a userspace buffer if not.
+pub fn copy_range(
+    src: &File,
+    src_offset: u64,
+    dst: &File,
+    dst_offset: u64,
+    len: u64,
+) -> io::Result<()> {
+    copy_range_with(src, src_offset, dst, dst_offset, len, true)
+}
+
+/// Like `copy_range`, but never uses the file position of `dst`, so that several
+/// threads can copy into disjoint ranges of the same file at once.
+///
+/// `sendfile` writes at the file position, so it is not used as a fallback.
+/// Targets without positional I/O, such as wasm, still move the file position.
+pub fn copy_range_at(
+    src: &File,
+    src_offset: u64,
+    dst: &File,
+    dst_offset: u64,
+    len: u64,
+) -> io::Result<()> {
+    copy_range_with(src, src_offset, dst, dst_offset, len, false)
+}
+
+fn copy_range_with(
+    src: &File,
+    src_offset: u64,
+    dst: &File,
+    dst_offset: u64,
+    len: u64,
+    allow_sendfile: bool,
+) -> io::Result<()> {
+    #[cfg(target_os = "linux")]
+    let copied = copy_in_kernel(src, src_offset, dst, dst_offset, len, allow_sendfile)?;
+
+    #[cfg(not(target_os = "linux"))]
+    let _ = allow_sendfile;
+
+    #[cfg(not(target_os = "linux"))]
+    let copied = 0;
+
+    #[cfg(feature = "mmap")]
+    if let Some(res) = copy_mapped(
+        src,
+        src_offset + copied,
+        dst,
+        dst_offset + copied,
+        len - copied,
+    ) {
+        return res;
+    }
+
+    copy_buffered(
+        src,
+        src_offset + copied,
+        dst,
+        dst_offset + copied,
+        len - copied,
+    )
+}
+
+#[cfg(unix)]
+fn read_exact_at(file: &File, buf: &mut [u8], offset: u64) -> io::Result<()> {
+    std::os::unix::fs::FileExt::read_exact_at(file, buf, offset)
+}
+
+#[cfg(unix)]
+fn write_all_at(file: &File, buf: &[u8], offset: u64) -> io::Result<()> {
+    std::os::unix::fs::FileExt::write_all_at(file, buf, offset)
+}
+
+#[cfg(windows)]
+fn read_exact_at(file: &File, buf: &mut [u8], offset: u64) -> io::Result<()> {
+    use std::os::windows::fs::FileExt;
+
+    // seek_read moves the file cursor, but never depends on it
+    let mut read = 0;
+    while read < buf.len() {
+        match file.seek_read(&mut buf[read..], offset + read as u64)? {
+            0 => return Err(io::ErrorKind::UnexpectedEof.into()),
+            n => read += n,
+        }
+    }
+
+    Ok(())
+}
+
+#[cfg(windows)]
+fn write_all_at(file: &File, buf: &[u8], offset: u64) -> io::Result<()> {
+    use std::os::windows::fs::FileExt;
+
+    let mut written = 0;
+    while written < buf.len() {
+        match file.seek_write(&buf[written..], offset + written as u64)? {
+            0 => return Err(io::ErrorKind::WriteZero.into()),
+            n => written += n,
+        }
+    }
+
+    Ok(())
+}
+
+// Other targets, such as wasm, have no positional I/O and no threads to race with,
+// so the file position is moved instead
+#[cfg(not(any(unix, windows)))]
+fn read_exact_at(file: &File, buf: &mut [u8], offset: u64) -> io::Result<()> {
+    use std::io::{Read, Seek, SeekFrom};
+
+    let mut file = file;
+    file.seek(SeekFrom::Start(offset))?;
+    file.read_exact(buf)
+}
+
+#[cfg(not(any(unix, windows)))]
+fn write_all_at(file: &File, buf: &[u8], offset: u64) -> io::Result<()> {
+    use std::io::{Seek, SeekFrom, Write};
+
+    let mut file = file;
+    file.seek(SeekFrom::Start(offset))?;
+    file.write_all(buf)
+}
+
+fn copy_buffered(
+    src: &File,
+    src_offset: u64,
+    dst: &File,
+    dst_offset: u64,
+    len: u64,
+) -> io::Result<()> {
+    if len == 0 {
+        return Ok(());
+    }
+
+    let mut buf = alloc::vec![0; (len as usize).min(COPY_BUFFER_SIZE)];
+    let mut copied = 0;
+    while copied < len {
+        let chunk = &mut buf[0..((len - copied) as usize).min(COPY_BUFFER_SIZE)];
+        read_exact_at(src, chunk, src_offset + copied)?;
+        write_all_at(dst, chunk, dst_offset + copied)?;
+        copied += chunk.len() as u64;
+    }
+
+    Ok(())
+}
+
+/// Writes the range from a memory mapping of `src`, so that it is only copied once.
+/// Returns `None` if `src` cannot be mapped, or if the mapping does not cover the range,
+/// as files such as those in procfs report a shorter length than they can be read for.
+#[cfg(feature = "mmap")]
+fn copy_mapped(
+    src: &File,
+    src_offset: u64,
+    dst: &File,
+    dst_offset: u64,
+    len: u64,
+) -> Option<io::Result<()>> {
+    if len == 0 {
+        return Some(Ok(()));
+    }
+
+    let map = unsafe { memmap2::Mmap::map(src) }.ok()?;
+    let data = usize::try_from(src_offset)
+        .ok()
+        .zip(usize::try_from(len).ok())
+        .and_then(|(start, len)| map.get(start..start.checked_add(len)?))?;
+
+    Some(write_all_at(dst, data, dst_offset))
+}
+
+/// Errors that mean the kernel cannot copy between this pair of files,
+/// rather than that the copy itself failed
+#[cfg(target_os = "linux")]
+fn is_unsupported(err: &io::Error) -> bool {
+    matches!(
+        err.raw_os_error(),
+        Some(libc::EXDEV | libc::EINVAL | libc::ENOSYS | libc::EOPNOTSUPP)
+    )
+}
+
+/// Copies as much of the range as the kernel supports, returning the number of bytes copied
+#[cfg(target_os = "linux")]
+fn copy_in_kernel(
+    src: &File,
+    src_offset: u64,
+    dst: &File,
+    dst_offset: u64,
+    len: u64,
+    allow_sendfile: bool,
+) -> io::Result<u64> {
+    use std::io::{Seek, SeekFrom};
+    use std::os::fd::AsRawFd;
+
+    let mut copied = 0;
+    let mut use_sendfile = false;
+    while copied < len {
+        let count = (len - copied).min(KERNEL_COPY_CHUNK) as usize;
+        let mut off_in = (src_offset + copied) as libc::loff_t;
+
+        let res = if use_sendfile {
+            unsafe { libc::sendfile(dst.as_raw_fd(), src.as_raw_fd(), &mut off_in, count) }
+        } else {
+            let mut off_out = (dst_offset + copied) as libc::loff_t;
+            unsafe {
+                libc::copy_file_range(
+                    src.as_raw_fd(),
+                    &mut off_in,
+                    dst.as_raw_fd(),
+                    &mut off_out,
+                    count,
+                    0,
+                )
+            }
+        };
+
+        if res > 0 {
+            copied += res as u64;
+            continue;
+        }
+
+        if res < 0 {
+            let err = io::Error::last_os_error();
+            if err.kind() == io::ErrorKind::Interrupted {
+                continue;
+            }
+
+            if !is_unsupported(&err) {
+                return Err(err);
+            }
+        }
+
+        // Some filesystems return 0 rather than an error when they cannot copy in the kernel,
+        // so the fallbacks are tried, and report the end of the source if it was reached
+        if use_sendfile || !allow_sendfile {
+            break;
+        }
+
+        // sendfile writes at the destination's file position
+        use_sendfile = true;
+        let mut dst = dst;
+        dst.seek(SeekFrom::Start(dst_offset + copied))?;
+    }
+
+    Ok(copied)
+}
+
+#[cfg(test)]
+mod test {
+    use alloc::vec::Vec;
+    use std::io::Write;
+
+    use super::{copy_buffered, copy_range, copy_range_at};
+
+    fn temp_file(name: &str, data: &[u8]) -> (std::path::PathBuf, std::fs::File) {
+        let path =
+            std::env::temp_dir().join(std::format!("xdvdfs-copy-{}-{}", name, std::process::id()));
+        let mut file = std::fs::File::options()
+            .read(true)
+            .write(true)
+            .create(true)
+            .truncate(true)
+            .open(&path)
+            .unwrap();
+        file.write_all(data).unwrap();
+        (path, file)
+    }
+
+    #[test]
+    fn test_copy_range() {
+        let data: Vec<u8> = (0..3 * 1024 * 1024).map(|i| (i % 251) as u8).collect();
+        let (src_path, src) = temp_file("src", &data);
+        let (dst_path, dst) = temp_file("dst", b"head");
+
+        copy_range(&src, 1000, &dst, 4, 2 * 1024 * 1024).unwrap();
+        let out = std::fs::read(&dst_path).unwrap();
+        assert_eq!(&out[0..4], b"head");
+        assert_eq!(&out[4..], &data[1000..1000 + 2 * 1024 * 1024]);
+
+        let res = copy_range(&src, data.len() as u64 - 10, &dst, 0, 20);
+        assert!(res.is_err());
+
+        std::fs::remove_file(src_path).unwrap();
+        std::fs::remove_file(dst_path).unwrap();
+    }
+
+    #[cfg(target_os = "linux")]
+    #[test]
+    fn test_copy_range_from_procfs() {
+        // procfs reports a length of 0, and copy_file_range may copy nothing from it
+        let version = std::fs::read("/proc/version").unwrap();
+        let src = std::fs::File::open("/proc/version").unwrap();
+        let (dst_path, dst) = temp_file("proc", &[]);
+
+        for copy in [copy_range, copy_range_at] {
+            copy(&src, 0, &dst, 0, 8).unwrap();
+            assert_eq!(std::fs::read(&dst_path).unwrap(), &version[0..8]);
+        }
+
+        std::fs::remove_file(dst_path).unwrap();
+    }
+
+    #[test]
+    fn test_copy_range_at_threads() {
+        let data: Vec<u8> = (0..400_000).map(|i| (i % 251) as u8).collect();
+        let (src_path, src) = temp_file("tsrc", &data);
+        let (dst_path, dst) = temp_file("tdst", &[]);
+
+        std::thread::scope(|s| {
+            let workers: Vec<_> = (0..4u64)
+                .map(|chunk| {
+                    let (src, dst) = (&src, &dst);
+                    let offset = chunk * 100_000;
+                    s.spawn(move || copy_range_at(src, offset, dst, offset, 100_000))
+                })
+                .collect();
+            for worker in workers {
+                worker.join().unwrap().unwrap();
+            }
+        });
+        assert_eq!(std::fs::read(&dst_path).unwrap(), data);
+
+        std::fs::remove_file(src_path).unwrap();
+        std::fs::remove_file(dst_path).unwrap();
+    }
+
+    #[cfg(feature = "mmap")]
+    #[test]
+    fn test_copy_mapped() {
+        let data: Vec<u8> = (0..100_000).map(|i| (i % 251) as u8).collect();
+        let (src_path, src) = temp_file("msrc", &data);
+        let (dst_path, dst) = temp_file("mdst", b"head");
+
+        super::copy_mapped(&src, 10, &dst, 4, 90_000)
+            .unwrap()
+            .unwrap();
+        let out = std::fs::read(&dst_path).unwrap();
+        assert_eq!(&out[0..4], b"head");
+        assert_eq!(&out[4..], &data[10..90_010]);
+
+        // Ranges past the end of the mapping are left to the buffered copy
+        assert!(super::copy_mapped(&src, data.len() as u64 - 10, &dst, 0, 20).is_none());
+        assert!(super::copy_range(&src, data.len() as u64 - 10, &dst, 0, 20).is_err());
+
+        std::fs::remove_file(src_path).unwrap();
+        std::fs::remove_file(dst_path).unwrap();
+    }
+
+    #[test]
+    fn test_copy_buffered() {
+        let data: Vec<u8> = (0..100_000).map(|i| (i % 251) as u8).collect();
+        let (src_path, src) = temp_file("bsrc", &data);
+        let (dst_path, dst) = temp_file("bdst", &[]);
+
+        copy_buffered(&src, 10, &dst, 0, 90_000).unwrap();
+        assert_eq!(std::fs::read(&dst_path).unwrap(), &data[10..90_010]);
+
+        std::fs::remove_file(src_path).unwrap();
+        std::fs::remove_file(dst_path).unwrap();
+    }
+}
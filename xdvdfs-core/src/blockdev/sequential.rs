@@ -0,0 +1,131 @@
+use std::io::{self, Seek, SeekFrom, Write};
+
+#[cfg(feature = "write")]
+use alloc::boxed::Box;
+#[cfg(feature = "write")]
+use async_trait::async_trait;
+
+#[cfg(feature = "write")]
+use super::BlockDeviceWrite;
+
+/// Output that can only be written in ascending offset order, such as a pipe or stdout.
+///
+/// Gaps between writes are filled with zeros. Seeking only moves the position of the
+/// next write, so it may move backwards as long as nothing is written there; a write
+/// below the end of the data already written fails with `InvalidInput`.
+pub struct SequentialWriter<W: Write> {
+    inner: W,
+    written: u64,
+    pos: u64,
+}
+
+impl<W: Write> SequentialWriter<W> {
+    pub fn new(inner: W) -> Self {
+        Self {
+            inner,
+            written: 0,
+            pos: 0,
+        }
+    }
+
+    /// Returns the number of bytes written so far, including gaps
+    pub fn written(&self) -> u64 {
+        self.written
+    }
+
+    /// Writes `buf` at `offset`, padding the output with zeros up to it
+    pub fn write_at(&mut self, offset: u64, buf: &[u8]) -> io::Result<()> {
+        if buf.is_empty() {
+            return Ok(());
+        }
+
+        if offset < self.written {
+            return Err(io::Error::new(
+                io::ErrorKind::InvalidInput,
+                "sequential output cannot be written out of order",
+            ));
+        }
+
+        self.pad_to(offset)?;
+        self.inner.write_all(buf)?;
+        self.written += buf.len() as u64;
+        Ok(())
+    }
+
+    fn pad_to(&mut self, offset: u64) -> io::Result<()> {
+        static ZEROS: [u8; 64 * 1024] = [0; 64 * 1024];
+
+        while self.written < offset {
+            let chunk = (offset - self.written).min(ZEROS.len() as u64) as usize;
+            self.inner.write_all(&ZEROS[0..chunk])?;
+            self.written += chunk as u64;
+        }
+
+        Ok(())
+    }
+
+    /// Flushes the output, and returns it
+    pub fn into_inner(mut self) -> io::Result<W> {
+        self.inner.flush()?;
+        Ok(self.inner)
+    }
+}
+
+#[cfg(feature = "write")]
+#[async_trait(?Send)]
+impl<W: Write> BlockDeviceWrite<io::Error> for SequentialWriter<W> {
+    async fn write(&mut self, offset: u64, buffer: &[u8]) -> Result<(), io::Error> {
+        self.write_at(offset, buffer)
+    }
+
+    async fn len(&mut self) -> Result<u64, io::Error> {
+        Ok(self.written)
+    }
+}
+
+impl<W: Write> Write for SequentialWriter<W> {
+    fn write(&mut self, buf: &[u8]) -> io::Result<usize> {
+        self.write_at(self.pos, buf)?;
+        self.pos += buf.len() as u64;
+        Ok(buf.len())
+    }
+
+    fn flush(&mut self) -> io::Result<()> {
+        self.inner.flush()
+    }
+}
+
+impl<W: Write> Seek for SequentialWriter<W> {
+    fn seek(&mut self, pos: SeekFrom) -> io::Result<u64> {
+        let pos = match pos {
+            SeekFrom::Start(pos) => Some(pos),
+            SeekFrom::Current(delta) => self.pos.checked_add_signed(delta),
+            SeekFrom::End(delta) => self.written.checked_add_signed(delta),
+        };
+
+        self.pos = pos.ok_or_else(|| io::Error::from(io::ErrorKind::InvalidInput))?;
+        Ok(self.pos)
+    }
+}
+
+#[cfg(test)]
+mod test {
+    use alloc::vec::Vec;
+    use std::io::{Seek, SeekFrom, Write};
+
+    use super::SequentialWriter;
+
+    #[test]
+    fn test_sequential_writer_pads_gaps() {
+        let mut writer = SequentialWriter::new(Vec::new());
+        writer.write_at(4, b"abc").unwrap();
+        writer.seek(SeekFrom::Start(0)).unwrap();
+        writer.write_all(&[]).unwrap();
+        writer.seek(SeekFrom::Start(10)).unwrap();
+        writer.write_all(b"de").unwrap();
+
+        assert!(writer.write_at(8, b"x").is_err());
+        assert_eq!(writer.written(), 12);
+        assert_eq!(writer.into_inner().unwrap(), b"\0\0\0\0abc\0\0\0de");
+    }
+}
@@ -0,0 +1,241 @@
+use alloc::vec::Vec;
+use std::fs::File;
+use std::io::{self, Seek, SeekFrom, Write};
+
+#[cfg(feature = "write")]
+use alloc::boxed::Box;
+#[cfg(feature = "write")]
+use async_trait::async_trait;
+
+#[cfg(feature = "write")]
+use super::BlockDeviceWrite;
+
+/// Size of the blocks that `SparseFile` checks for zeros.
+/// Blocks that are entirely zero are left as holes.
+pub const SPARSE_BLOCK_SIZE: u64 = 4096;
+
+/// Output file that leaves holes in place of zero blocks.
+///
+/// Writes are split into blocks aligned to `SPARSE_BLOCK_SIZE`, and only blocks
+/// that contain data are written. Zero blocks are skipped, so the file must be
+/// new or truncated, and not already contain data in the regions being written.
+///
+/// The length of the file is tracked as if every write had been made in full.
+/// `finish`, or flushing through `std::io::Write`, extends the file over any
+/// trailing hole.
+pub struct SparseFile {
+    file: File,
+    len: u64,
+    pos: u64,
+}
+
+fn is_zero(buf: &[u8]) -> bool {
+    buf.iter().all(|b| *b == 0)
+}
+
+impl SparseFile {
+    pub fn new(file: File) -> io::Result<Self> {
+        let len = file.metadata()?.len();
+        Ok(Self { file, len, pos: 0 })
+    }
+
+    pub fn get_ref(&self) -> &File {
+        &self.file
+    }
+
+    /// Writes the non-zero blocks of `buf` at `offset`
+    pub fn write_at(&mut self, offset: u64, buf: &[u8]) -> io::Result<()> {
+        let mut start = 0;
+        while start < buf.len() {
+            // Blocks are aligned to the file, not to the buffer
+            let block_len = |at: usize| {
+                let abs = offset + at as u64;
+                ((SPARSE_BLOCK_SIZE - abs % SPARSE_BLOCK_SIZE) as usize).min(buf.len() - at)
+            };
+
+            // Skip zero blocks, then gather the following run of data blocks
+            let len = block_len(start);
+            if is_zero(&buf[start..start + len]) {
+                start += len;
+                continue;
+            }
+
+            let mut end = start + len;
+            while end < buf.len() {
+                let len = block_len(end);
+                if is_zero(&buf[end..end + len]) {
+                    break;
+                }
+
+                end += len;
+            }
+
+            self.file.seek(SeekFrom::Start(offset + start as u64))?;
+            self.file.write_all(&buf[start..end])?;
+            start = end;
+        }
+
+        self.len = self.len.max(offset + buf.len() as u64);
+        Ok(())
+    }
+
+    /// Extends the file to its full length if it ends in a hole
+    pub fn sync_len(&self) -> io::Result<()> {
+        if self.file.metadata()?.len() < self.len {
+            self.file.set_len(self.len)?;
+        }
+
+        Ok(())
+    }
+
+    /// Extends the file over any trailing hole, and returns it
+    pub fn finish(self) -> io::Result<File> {
+        self.sync_len()?;
+        Ok(self.file)
+    }
+}
+
+#[cfg(feature = "write")]
+#[async_trait(?Send)]
+impl BlockDeviceWrite<io::Error> for SparseFile {
+    async fn write(&mut self, offset: u64, buffer: &[u8]) -> Result<(), io::Error> {
+        self.write_at(offset, buffer)
+    }
+
+    async fn len(&mut self) -> Result<u64, io::Error> {
+        Ok(self.len)
+    }
+}
+
+impl Write for SparseFile {
+    fn write(&mut self, buf: &[u8]) -> io::Result<usize> {
+        self.write_at(self.pos, buf)?;
+        self.pos += buf.len() as u64;
+        Ok(buf.len())
+    }
+
+    fn flush(&mut self) -> io::Result<()> {
+        self.sync_len()
+    }
+}
+
+impl Seek for SparseFile {
+    fn seek(&mut self, pos: SeekFrom) -> io::Result<u64> {
+        let pos = match pos {
+            SeekFrom::Start(pos) => Some(pos),
+            SeekFrom::Current(delta) => self.pos.checked_add_signed(delta),
+            SeekFrom::End(delta) => self.len.checked_add_signed(delta),
+        };
+
+        self.pos = pos.ok_or_else(|| io::Error::from(io::ErrorKind::InvalidInput))?;
+        Ok(self.pos)
+    }
+}
+
+/// Returns the regions of `file` that hold data, as `(offset, len)` pairs, skipping holes.
+///
+/// On Linux the regions are found with `SEEK_DATA` and `SEEK_HOLE`. Elsewhere, or if
+/// the filesystem does not report holes, the whole file is returned as one region.
+/// The position of `file` is left unchanged.
+pub fn data_regions(file: &File) -> io::Result<Vec<(u64, u64)>> {
+    let len = file.metadata()?.len();
+
+    #[cfg(target_os = "linux")]
+    {
+        let mut file = file;
+        let pos = file.stream_position()?;
+        let regions = seek_data_regions(file, len);
+        file.seek(SeekFrom::Start(pos))?;
+
+        if let Some(regions) = regions? {
+            return Ok(regions);
+        }
+    }
+
+    Ok(if len == 0 {
+        Vec::new()
+    } else {
+        alloc::vec![(0, len)]
+    })
+}
+
+#[cfg(target_os = "linux")]
+fn seek_data_regions(file: &File, len: u64) -> io::Result<Option<Vec<(u64, u64)>>> {
+    use std::os::fd::AsRawFd;
+
+    let seek = |offset: u64, whence| {
+        let res = unsafe { libc::lseek(file.as_raw_fd(), offset as libc::off_t, whence) };
+        if res < 0 {
+            Err(io::Error::last_os_error())
+        } else {
+            Ok(res as u64)
+        }
+    };
+
+    let mut regions = Vec::new();
+    let mut offset = 0;
+    while offset < len {
+        let start = match seek(offset, libc::SEEK_DATA) {
+            Ok(start) => start,
+            // No data past `offset`
+            Err(e) if e.raw_os_error() == Some(libc::ENXIO) => break,
+            Err(e) if e.raw_os_error() == Some(libc::EINVAL) => return Ok(None),
+            Err(e) => return Err(e),
+        };
+
+        let end = seek(start, libc::SEEK_HOLE)?.min(len);
+        if end > start {
+            regions.push((start, end - start));
+        }
+
+        offset = end;
+    }
+
+    Ok(Some(regions))
+}
+
+#[cfg(test)]
+mod test {
+    use alloc::vec::Vec;
+
+    use super::{data_regions, SparseFile, SPARSE_BLOCK_SIZE};
+
+    fn temp_path(name: &str) -> std::path::PathBuf {
+        std::env::temp_dir().join(std::format!(
+            "xdvdfs-sparse-{}-{}",
+            name,
+            std::process::id()
+        ))
+    }
+
+    #[test]
+    fn test_sparse_file_round_trip() {
+        let path = temp_path("rt");
+        let file = std::fs::File::create(&path).unwrap();
+        let mut sparse = SparseFile::new(file).unwrap();
+
+        let block = SPARSE_BLOCK_SIZE as usize;
+        let mut data: Vec<u8> = alloc::vec![0; 16 * block];
+        data[100] = 1;
+        data[5 * block + 7] = 2;
+        data[6 * block..7 * block].fill(3);
+        sparse.write_at(10, &data).unwrap();
+        sparse.write_at(20 * block as u64, &[0; 100]).unwrap();
+        sparse.finish().unwrap();
+
+        let out = std::fs::read(&path).unwrap();
+        assert_eq!(out.len(), 20 * block + 100);
+        assert_eq!(&out[10..10 + data.len()], &data[..]);
+        assert!(out[10 + data.len()..].iter().all(|b| *b == 0));
+
+        let regions = data_regions(&std::fs::File::open(&path).unwrap()).unwrap();
+        for (idx, _) in out.iter().enumerate().filter(|(_, b)| **b != 0) {
+            let idx = idx as u64;
+            assert!(regions
+                .iter()
+                .any(|(offset, len)| *offset <= idx && idx < offset + len));
+        }
+
+        std::fs::remove_file(path).unwrap();
+    }
+}
@@ -0,0 +1,426 @@
+use alloc::boxed::Box;
+use alloc::collections::BTreeMap;
+use alloc::vec::Vec;
+use std::fs::File;
+use std::io;
+use std::os::unix::io::AsRawFd;
+
+use async_trait::async_trait;
+use io_uring::{opcode, types, IoUring};
+
+use super::{BlockDeviceRead, BlockDeviceWrite};
+
+/// Default number of operations kept in flight by an `IoUringDevice`
+pub const DEFAULT_QUEUE_DEPTH: u32 = 32;
+
+/// Large reads are split into chunks of this size, which are serviced in parallel
+const READ_CHUNK_SIZE: usize = 256 * 1024;
+
+/// Marks completions that belong to reads rather than writes
+const READ_FLAG: u64 = 1 << 63;
+
+struct PendingWrite {
+    buf: Box<[u8]>,
+    offset: u64,
+    written: usize,
+}
+
+/// Block device for a file, with I/O submitted through io_uring.
+///
+/// Writes are copied into an owned buffer and queued, so up to `depth` writes
+/// are in flight at once. Errors from queued writes are returned by a later
+/// call, or by `flush`. Reads wait for queued writes, and large reads and
+/// batches are split into chunks that are submitted together.
+///
+/// The device also implements `std::io::Write` and `std::io::Seek`,
+/// queueing writes at the current position.
+pub struct IoUringDevice {
+    ring: IoUring,
+    file: File,
+    depth: usize,
+    writes: BTreeMap<u64, PendingWrite>,
+    next_id: u64,
+    error: Option<io::Error>,
+    pos: u64,
+}
+
+fn completion_error(res: i32) -> io::Error {
+    io::Error::from_raw_os_error(-res)
+}
+
+impl IoUringDevice {
+    pub fn new(file: File) -> io::Result<Self> {
+        Self::with_queue_depth(file, DEFAULT_QUEUE_DEPTH)
+    }
+
+    pub fn with_queue_depth(file: File, depth: u32) -> io::Result<Self> {
+        let depth = core::cmp::max(depth, 1);
+        Ok(Self {
+            ring: IoUring::new(depth)?,
+            file,
+            depth: depth as usize,
+            writes: BTreeMap::new(),
+            next_id: 0,
+            error: None,
+            pos: 0,
+        })
+    }
+
+    pub fn get_ref(&self) -> &File {
+        &self.file
+    }
+
+    /// Waits for all queued writes, then replaces the underlying file.
+    /// The previous file is closed.
+    pub fn set_file(&mut self, file: File) -> io::Result<()> {
+        self.flush_writes()?;
+        self.file = file;
+        self.pos = 0;
+        Ok(())
+    }
+
+    /// Waits for all queued writes to complete,
+    /// returning the first error from any of them
+    pub fn flush_writes(&mut self) -> io::Result<()> {
+        while !self.writes.is_empty() {
+            self.reap_writes(1)?;
+        }
+
+        self.error.take().map_or(Ok(()), Err)
+    }
+
+    fn push(&mut self, entry: &io_uring::squeue::Entry) -> io::Result<()> {
+        // Safety: Callers keep the buffer referenced by `entry` alive
+        // until its completion has been reaped.
+        unsafe {
+            self.ring
+                .submission()
+                .push(entry)
+                .map_err(|_| io::Error::other("submission queue is full"))
+        }
+    }
+
+    fn submit_and_wait(&mut self, want: usize) -> io::Result<()> {
+        loop {
+            match self.ring.submit_and_wait(want) {
+                Ok(_) => return Ok(()),
+                Err(err) if err.kind() == io::ErrorKind::Interrupted => continue,
+                Err(err) => return Err(err),
+            }
+        }
+    }
+
+    fn submit_write(&mut self, id: u64) -> io::Result<()> {
+        let write = &self.writes[&id];
+        let remaining = &write.buf[write.written..];
+        let entry = opcode::Write::new(
+            types::Fd(self.file.as_raw_fd()),
+            remaining.as_ptr(),
+            remaining.len() as u32,
+        )
+        .offset(write.offset + write.written as u64)
+        .build()
+        .user_data(id);
+
+        self.push(&entry)?;
+        self.ring.submit()?;
+        Ok(())
+    }
+
+    /// Waits for at least `want` completions, requeueing short writes
+    fn reap_writes(&mut self, want: usize) -> io::Result<()> {
+        if let Err(err) = self.submit_and_wait(want) {
+            // The kernel may still reference the buffers, so they can never be freed
+            for (_, write) in core::mem::take(&mut self.writes) {
+                core::mem::forget(write.buf);
+            }
+
+            return Err(err);
+        }
+
+        let completions: Vec<(u64, i32)> = self
+            .ring
+            .completion()
+            .map(|cqe| (cqe.user_data(), cqe.result()))
+            .collect();
+        for (id, res) in completions {
+            let Some(write) = self.writes.get_mut(&id) else {
+                continue;
+            };
+
+            if res <= 0 {
+                self.writes.remove(&id);
+                let err = match res {
+                    0 => io::Error::from(io::ErrorKind::WriteZero),
+                    res => completion_error(res),
+                };
+                self.error.get_or_insert(err);
+                continue;
+            }
+
+            write.written += res as usize;
+            if write.written < write.buf.len() {
+                self.submit_write(id)?;
+            } else {
+                self.writes.remove(&id);
+            }
+        }
+
+        Ok(())
+    }
+
+    /// Copies `buf` and queues it to be written at `offset`
+    fn queue_write(&mut self, offset: u64, buf: &[u8]) -> io::Result<()> {
+        if let Some(err) = self.error.take() {
+            return Err(err);
+        }
+
+        while self.writes.len() >= self.depth {
+            self.reap_writes(1)?;
+        }
+
+        let id = self.next_id;
+        self.next_id = (self.next_id + 1) & !READ_FLAG;
+        self.writes.insert(
+            id,
+            PendingWrite {
+                buf: buf.into(),
+                offset,
+                written: 0,
+            },
+        );
+
+        self.submit_write(id)
+    }
+
+    /// Reads every request, submitting up to `depth` chunks at a time
+    fn read_chunks(&mut self, requests: &mut [(u64, &mut [u8])]) -> io::Result<()> {
+        self.flush_writes()?;
+
+        let fd = types::Fd(self.file.as_raw_fd());
+        let mut chunks = requests.iter_mut().flat_map(|(offset, buf)| {
+            let offset = *offset;
+            buf.chunks_mut(READ_CHUNK_SIZE)
+                .enumerate()
+                .map(move |(idx, chunk)| (offset + (idx * READ_CHUNK_SIZE) as u64, chunk))
+        });
+
+        loop {
+            let mut batch: Vec<(u64, &mut [u8])> = chunks.by_ref().take(self.depth).collect();
+            if batch.is_empty() {
+                return Ok(());
+            }
+
+            let mut pushed = 0;
+            let mut push_error = None;
+            for (idx, (offset, chunk)) in batch.iter_mut().enumerate() {
+                let entry = opcode::Read::new(fd, chunk.as_mut_ptr(), chunk.len() as u32)
+                    .offset(*offset)
+                    .build()
+                    .user_data(READ_FLAG | idx as u64);
+                if let Err(err) = self.push(&entry) {
+                    push_error = Some(err);
+                    break;
+                }
+
+                pushed += 1;
+            }
+
+            // The chunks borrow the caller's buffers, so every submitted read
+            // must complete before returning, even on error.
+            let mut results = alloc::vec![None; batch.len()];
+            let mut completed = 0;
+            let mut wait_error = None;
+            while completed < pushed {
+                // Failures such as EBUSY or ENOMEM are transient, so keep
+                // waiting for the reads and report the error once they are done
+                if let Err(err) = self.submit_and_wait(1) {
+                    wait_error.get_or_insert(err);
+                    std::thread::yield_now();
+                }
+
+                for cqe in self.ring.completion() {
+                    if cqe.user_data() & READ_FLAG != 0 {
+                        results[(cqe.user_data() & !READ_FLAG) as usize] = Some(cqe.result());
+                        completed += 1;
+                    }
+                }
+            }
+
+            if let Some(err) = push_error.or(wait_error) {
+                return Err(err);
+            }
+
+            for ((offset, chunk), res) in batch.into_iter().zip(results) {
+                let res = res.unwrap_or(0);
+                if res < 0 {
+                    return Err(completion_error(res));
+                }
+
+                // Short reads are finished synchronously
+                let read = res as usize;
+                if read < chunk.len() {
+                    std::os::unix::fs::FileExt::read_exact_at(
+                        &self.file,
+                        &mut chunk[read..],
+                        offset + read as u64,
+                    )?;
+                }
+            }
+        }
+    }
+}
+
+impl Drop for IoUringDevice {
+    fn drop(&mut self) {
+        // The kernel must be done with the queued buffers before they are freed
+        let _ = self.flush_writes();
+    }
+}
+
+#[async_trait(?Send)]
+impl BlockDeviceRead<io::Error> for IoUringDevice {
+    async fn read(&mut self, offset: u64, buffer: &mut [u8]) -> Result<(), io::Error> {
+        self.read_chunks(&mut [(offset, buffer)])
+    }
+
+    async fn read_batch(&mut self, requests: &mut [(u64, &mut [u8])]) -> Result<(), io::Error> {
+        self.read_chunks(requests)
+    }
+}
+
+#[async_trait(?Send)]
+impl BlockDeviceWrite<io::Error> for IoUringDevice {
+    async fn write(&mut self, offset: u64, buffer: &[u8]) -> Result<(), io::Error> {
+        self.queue_write(offset, buffer)
+    }
+
+    async fn len(&mut self) -> Result<u64, io::Error> {
+        self.flush_writes()?;
+        Ok(self.file.metadata()?.len())
+    }
+}
+
+impl io::Write for IoUringDevice {
+    fn write(&mut self, buf: &[u8]) -> io::Result<usize> {
+        self.queue_write(self.pos, buf)?;
+        self.pos += buf.len() as u64;
+        Ok(buf.len())
+    }
+
+    fn flush(&mut self) -> io::Result<()> {
+        self.flush_writes()
+    }
+}
+
+impl io::Seek for IoUringDevice {
+    fn seek(&mut self, pos: io::SeekFrom) -> io::Result<u64> {
+        let pos = match pos {
+            io::SeekFrom::Start(pos) => Some(pos),
+            io::SeekFrom::Current(delta) => self.pos.checked_add_signed(delta),
+            io::SeekFrom::End(delta) => {
+                self.flush_writes()?;
+                self.file.metadata()?.len().checked_add_signed(delta)
+            }
+        };
+
+        self.pos = pos.ok_or_else(|| io::Error::from(io::ErrorKind::InvalidInput))?;
+        Ok(self.pos)
+    }
+}
+
+#[cfg(test)]
+mod test {
+    use alloc::vec::Vec;
+    use futures::executor;
+    use std::io::{Seek, SeekFrom, Write};
+
+    use super::IoUringDevice;
+    use crate::blockdev::{BlockDeviceRead, BlockDeviceWrite};
+
+    fn temp_file(name: &str) -> (std::path::PathBuf, std::fs::File) {
+        let path =
+            std::env::temp_dir().join(std::format!("xdvdfs-uring-{}-{}", name, std::process::id()));
+        let file = std::fs::File::options()
+            .read(true)
+            .write(true)
+            .create(true)
+            .truncate(true)
+            .open(&path)
+            .unwrap();
+        (path, file)
+    }
+
+    /// Returns `None` where io_uring is unavailable, such as under
+    /// a seccomp profile that blocks it, so the test can be skipped
+    fn uring_device(file: std::fs::File, depth: u32) -> Option<IoUringDevice> {
+        match IoUringDevice::with_queue_depth(file, depth) {
+            Ok(dev) => Some(dev),
+            Err(err) => {
+                std::eprintln!("skipping io_uring test: {}", err);
+                None
+            }
+        }
+    }
+
+    #[test]
+    fn test_uring_write_then_read() {
+        let (path, file) = temp_file("rw");
+        let Some(mut dev) = uring_device(file, 4) else {
+            std::fs::remove_file(path).unwrap();
+            return;
+        };
+
+        let data: Vec<u8> = (0..1024 * 1024).map(|i| (i % 251) as u8).collect();
+        for (idx, chunk) in data.chunks(4096).enumerate().rev() {
+            executor::block_on(BlockDeviceWrite::write(
+                &mut dev,
+                (idx * 4096) as u64,
+                chunk,
+            ))
+            .unwrap();
+        }
+
+        assert_eq!(executor::block_on(dev.len()).unwrap(), data.len() as u64);
+
+        let mut buf = alloc::vec![0; data.len()];
+        executor::block_on(dev.read(0, &mut buf)).unwrap();
+        assert_eq!(buf, data);
+
+        let mut a = [0; 16];
+        let mut b = [0; 16];
+        let mut requests: [(u64, &mut [u8]); 2] = [(500_000, &mut a), (10, &mut b)];
+        executor::block_on(dev.read_batch(&mut requests)).unwrap();
+        assert_eq!(&a, &data[500_000..500_016]);
+        assert_eq!(&b, &data[10..26]);
+
+        let res = executor::block_on(dev.read(data.len() as u64 - 4, &mut a));
+        assert!(res.is_err());
+
+        drop(dev);
+        std::fs::remove_file(path).unwrap();
+    }
+
+    #[test]
+    fn test_uring_io_write_seek() {
+        let (path, file) = temp_file("seek");
+        let Some(mut dev) = uring_device(file, super::DEFAULT_QUEUE_DEPTH) else {
+            std::fs::remove_file(path).unwrap();
+            return;
+        };
+
+        dev.seek(SeekFrom::Start(8)).unwrap();
+        dev.write_all(b"world").unwrap();
+        dev.seek(SeekFrom::Start(0)).unwrap();
+        dev.write_all(b"hello, ").unwrap();
+        assert_eq!(dev.seek(SeekFrom::End(0)).unwrap(), 13);
+        dev.flush().unwrap();
+
+        let data = std::fs::read(&path).unwrap();
+        assert_eq!(&data[0..7], b"hello, ");
+        assert_eq!(&data[8..], b"world");
+
+        drop(dev);
+        std::fs::remove_file(path).unwrap();
+    }
+}
@@ -94,6 +94,15 @@ pub struct DirectoryEntryNode {
     pub name: [u8; 256],
 }
 
+/// Directory entry borrowed from a buffer holding a directory entry table.
+///
+/// Unlike `DirectoryEntryNode`, the file name is not copied out of the buffer.
+#[derive(Debug, Copy, Clone)]
+pub struct DirectoryEntryView<'a> {
+    pub node: DirectoryEntryDiskNode,
+    name: &'a [u8],
+}
+
 /// In-memory structure to contain the on-disk dirent data,
 /// and file name information.
 ///
@@ -109,6 +118,13 @@ pub struct DirectoryEntryData {
 }
 
 impl DiskRegion {
+    fn parse(buf: &[u8]) -> Self {
+        Self {
+            sector: u32::from_le_bytes([buf[0], buf[1], buf[2], buf[3]]),
+            size: u32::from_le_bytes([buf[4], buf[5], buf[6], buf[7]]),
+        }
+    }
+
     pub fn is_empty(&self) -> bool {
         self.size == 0
     }
@@ -166,12 +182,17 @@ impl VolumeDescriptor {
             .map_err(|e| util::Error::SerializationFailed(e))
     }
 
+    /// Parses a volume descriptor from its little-endian on-disk representation
     pub fn deserialize<E>(buf: &[u8; 0x800]) -> Result<Self, util::Error<E>> {
-        bincode::DefaultOptions::new()
-            .with_fixint_encoding()
-            .with_little_endian()
-            .deserialize(buf)
-            .map_err(|e| util::Error::SerializationFailed(e))
+        let mut volume = Self::new(DirectoryEntryTable {
+            region: DiskRegion::parse(&buf[0x14..0x1c]),
+        });
+
+        volume.magic0.copy_from_slice(&buf[0..0x14]);
+        volume.filetime = u64::from_le_bytes(buf[0x1c..0x24].try_into().unwrap());
+        volume.unused.copy_from_slice(&buf[0x24..0x7ec]);
+        volume.magic1.copy_from_slice(&buf[0x7ec..0x800]);
+        Ok(volume)
     }
 }
 
@@ -266,6 +287,45 @@ impl DirectoryEntryDiskData {
         Ok(buf)
     }
 
+    /// Borrows the file data directly from a device that holds the image in memory
+    #[cfg(feature = "read")]
+    pub fn data_slice<'a, E>(
+        &self,
+        dev: &'a impl super::blockdev::BlockDeviceSlice<E>,
+    ) -> Result<&'a [u8], util::Error<E>> {
+        if self.data.size == 0 {
+            return Ok(&[]);
+        }
+
+        let offset = self.data.offset(0)?;
+        dev.slice(offset, self.data.size as u64)
+            .map_err(|e| util::Error::IOError(e))
+    }
+
+    /// Copies the file data out of the image file into `dest`, inside the kernel where
+    /// the platform supports it. `image_offset` is the offset of the volume within `image`.
+    #[cfg(all(feature = "read", feature = "std"))]
+    pub fn copy_to_file(
+        &self,
+        image: &std::fs::File,
+        image_offset: u64,
+        dest: &std::fs::File,
+    ) -> Result<(), util::Error<std::io::Error>> {
+        if self.data.size == 0 {
+            return Ok(());
+        }
+
+        let offset = self.data.offset(0)?;
+        super::blockdev::copy::copy_range(
+            image,
+            image_offset + offset,
+            dest,
+            0,
+            self.data.size as u64,
+        )?;
+        Ok(())
+    }
+
     #[cfg(all(feature = "read", feature = "std"))]
     pub fn seek_to(
         &self,
@@ -280,6 +340,14 @@ impl DirectoryEntryDiskData {
 }
 
 impl DirectoryEntryNode {
+    /// Returns a view of this entry that borrows its name
+    pub fn view(&self) -> DirectoryEntryView<'_> {
+        DirectoryEntryView {
+            node: self.node,
+            name: self.name_slice(),
+        }
+    }
+
     pub fn name_slice(&self) -> &[u8] {
         let name_len = self.node.dirent.filename_length as usize;
         &self.name[0..name_len]
@@ -355,20 +423,99 @@ impl DirectoryEntryDiskNode {
             .map_err(|e| util::Error::SerializationFailed(e))
     }
 
+    /// Parses a tree node from its little-endian on-disk representation
     pub fn deserialize<E>(buf: &[u8; 0xe]) -> Result<Self, util::Error<E>> {
-        bincode::DefaultOptions::new()
-            .with_fixint_encoding()
-            .with_little_endian()
-            .deserialize(buf)
-            .map_err(|e| util::Error::SerializationFailed(e))
+        Ok(Self::parse(buf))
+    }
+
+    pub(crate) fn parse(buf: &[u8; 0xe]) -> Self {
+        Self {
+            left_entry_offset: u16::from_le_bytes([buf[0], buf[1]]),
+            right_entry_offset: u16::from_le_bytes([buf[2], buf[3]]),
+            dirent: DirectoryEntryDiskData {
+                data: DiskRegion::parse(&buf[4..0xc]),
+                attributes: DirentAttributes(buf[0xc]),
+                filename_length: buf[0xd],
+            },
+        }
+    }
+}
+
+impl<'a> DirectoryEntryView<'a> {
+    /// Creates a view from a parsed node and its name,
+    /// which must be `filename_length` bytes long
+    pub(crate) fn new(node: DirectoryEntryDiskNode, name: &'a [u8]) -> Self {
+        debug_assert_eq!(node.dirent.filename_length as usize, name.len());
+        Self { node, name }
+    }
+
+    pub fn name_slice(&self) -> &'a [u8] {
+        self.name
+    }
+
+    /// Returns a UTF-8 encoded representation of the file name.
+    /// ASCII names are borrowed from the underlying buffer.
+    pub fn name_str<E>(&self) -> Result<alloc::borrow::Cow<'a, str>, util::Error<E>> {
+        WINDOWS_1252
+            .decode_without_bom_handling_and_without_replacement(self.name)
+            .ok_or(util::Error::StringEncodingError)
+    }
+
+    /// Copies the entry into an owned `DirectoryEntryNode`
+    pub fn to_node(&self) -> DirectoryEntryNode {
+        let mut dirent = DirectoryEntryNode {
+            node: self.node,
+            name: [0; 256],
+        };
+
+        dirent.name[0..self.name.len()].copy_from_slice(self.name);
+        dirent
     }
 }
 
 #[cfg(test)]
 mod test {
-    use super::{DirectoryEntryDiskData, DirentAttributes, DiskRegion};
+    use super::{
+        DirectoryEntryDiskData, DirectoryEntryDiskNode, DirectoryEntryTable, DirentAttributes,
+        DiskRegion, VolumeDescriptor,
+    };
     use futures::executor;
 
+    #[test]
+    fn test_dirent_node_round_trip() {
+        let node = DirectoryEntryDiskNode {
+            left_entry_offset: 0x1234,
+            right_entry_offset: 0xffff,
+            dirent: DirectoryEntryDiskData {
+                data: DiskRegion {
+                    sector: 0x01020304,
+                    size: 0xa0b0c0d0,
+                },
+                attributes: DirentAttributes(0x10),
+                filename_length: 12,
+            },
+        };
+
+        let buf: [u8; 0xe] = node.serialize::<()>().unwrap().try_into().unwrap();
+        let parsed = DirectoryEntryDiskNode::deserialize::<()>(&buf).unwrap();
+        assert_eq!({ parsed.left_entry_offset }, 0x1234);
+        assert_eq!({ parsed.right_entry_offset }, 0xffff);
+        assert_eq!(parsed.dirent, node.dirent);
+    }
+
+    #[test]
+    fn test_volume_round_trip() {
+        let mut volume = VolumeDescriptor::new(DirectoryEntryTable::new(0x800, 33));
+        volume.filetime = 0x0102030405060708;
+
+        let buf: [u8; 0x800] = volume.serialize::<()>().unwrap().try_into().unwrap();
+        let parsed = VolumeDescriptor::deserialize::<()>(&buf).unwrap();
+        assert!(parsed.is_valid());
+        assert_eq!({ parsed.filetime }, 0x0102030405060708);
+        assert_eq!({ parsed.root_table.region }, { volume.root_table.region });
+        assert_eq!(parsed.serialize::<()>().unwrap(), buf);
+    }
+
     #[test]
     fn test_read_file_empty() {
         let mut data: [u8; 8] = [0; 8];
@@ -0,0 +1,288 @@
+use alloc::collections::BTreeMap;
+use alloc::string::String;
+use alloc::vec::Vec;
+
+use crate::blockdev::BlockDeviceRead;
+use crate::layout::{DirectoryEntryNode, DirectoryEntryTable};
+use crate::util;
+
+use super::LoadedDirectoryEntryTable;
+
+/// Default number of directory entry tables kept by a `DirectoryCache`
+pub const DEFAULT_CAPACITY: usize = 256;
+
+/// Counters describing how well a `DirectoryCache` is performing
+#[derive(Copy, Clone, Debug, Default, Eq, PartialEq)]
+pub struct CacheStats {
+    /// Number of directory entry tables served from the cache
+    pub hits: u64,
+
+    /// Number of directory entry tables that had to be read from the device
+    pub misses: u64,
+
+    /// Number of directory entry tables dropped to stay within capacity
+    pub evictions: u64,
+}
+
+struct CachedTable {
+    table: LoadedDirectoryEntryTable,
+    last_used: u64,
+}
+
+/// Cache for resolving paths within a single XDVDFS volume.
+///
+/// Directory paths are case-folded and mapped to their loaded directory entry
+/// table. When a path is resolved, the longest cached prefix is reused, and only
+/// the remaining path segments are read from the device. Lookups of children
+/// within a cached directory are served from memory.
+///
+/// The cache holds at most `capacity` tables, evicting the least recently used.
+pub struct DirectoryCache {
+    root: DirectoryEntryTable,
+    capacity: usize,
+    tables: BTreeMap<String, CachedTable>,
+    recency: BTreeMap<u64, String>,
+    tick: u64,
+    stats: CacheStats,
+}
+
+fn split_path(path: &str) -> Vec<&str> {
+    path.trim_start_matches('/').split_terminator('/').collect()
+}
+
+fn cache_key(segments: &[&str]) -> String {
+    let mut key = String::new();
+    for segment in segments {
+        key.push('/');
+        key.push_str(&segment.to_ascii_uppercase());
+    }
+
+    key
+}
+
+impl DirectoryCache {
+    /// Creates an empty cache for the volume with the given root table,
+    /// holding at most `capacity` directory entry tables.
+    pub fn new(root: DirectoryEntryTable, capacity: usize) -> Self {
+        Self {
+            root,
+            capacity: core::cmp::max(capacity, 1),
+            tables: BTreeMap::new(),
+            recency: BTreeMap::new(),
+            tick: 0,
+            stats: CacheStats::default(),
+        }
+    }
+
+    pub fn capacity(&self) -> usize {
+        self.capacity
+    }
+
+    pub fn len(&self) -> usize {
+        self.tables.len()
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.tables.is_empty()
+    }
+
+    pub fn stats(&self) -> CacheStats {
+        self.stats
+    }
+
+    /// Drops all cached tables. Counters are preserved.
+    pub fn clear(&mut self) {
+        self.tables.clear();
+        self.recency.clear();
+    }
+
+    fn touch(&mut self, key: &str) -> bool {
+        self.tick += 1;
+        let tick = self.tick;
+
+        match self.tables.get_mut(key) {
+            Some(entry) => {
+                self.recency.remove(&entry.last_used);
+                self.recency.insert(tick, String::from(key));
+                entry.last_used = tick;
+                true
+            }
+            None => false,
+        }
+    }
+
+    fn insert(&mut self, key: String, table: LoadedDirectoryEntryTable) {
+        while self.tables.len() >= self.capacity {
+            let Some((_, evicted)) = self.recency.pop_first() else {
+                break;
+            };
+
+            dprintln!("[DirectoryCache] Evicting {}", evicted);
+            self.tables.remove(&evicted);
+            self.stats.evictions += 1;
+        }
+
+        self.tick += 1;
+        self.recency.insert(self.tick, key.clone());
+        self.tables.insert(
+            key,
+            CachedTable {
+                table,
+                last_used: self.tick,
+            },
+        );
+    }
+
+    /// Resolves the directory given by `segments`, loading any tables
+    /// that are not cached. Returns the cache key of the directory.
+    async fn resolve_dir<E>(
+        &mut self,
+        dev: &mut impl BlockDeviceRead<E>,
+        segments: &[&str],
+    ) -> Result<String, util::Error<E>> {
+        let mut depth = segments.len();
+        let mut key = cache_key(segments);
+        while depth > 0 && !self.tables.contains_key(&key) {
+            depth -= 1;
+            key = cache_key(&segments[0..depth]);
+        }
+
+        if self.touch(&key) {
+            self.stats.hits += 1;
+        } else {
+            let table = self.root.load(dev).await?;
+            self.stats.misses += 1;
+            self.insert(key.clone(), table);
+        }
+
+        for segment in &segments[depth..] {
+            let dirent = self.tables[&key].table.find_dirent(segment)?;
+            let dirtab = dirent
+                .node
+                .dirent
+                .dirent_table()
+                .ok_or(util::Error::IsNotDirectory)?;
+
+            dprintln!("[DirectoryCache] Loading {}/{}", key, segment);
+            let table = dirtab.load(dev).await?;
+            self.stats.misses += 1;
+
+            key.push('/');
+            key.push_str(&segment.to_ascii_uppercase());
+            self.insert(key.clone(), table);
+        }
+
+        Ok(key)
+    }
+
+    /// Returns the loaded directory entry table for the directory at `path`.
+    ///
+    /// `/` (or an empty path) refers to the root directory.
+    pub async fn dirent_table<E>(
+        &mut self,
+        dev: &mut impl BlockDeviceRead<E>,
+        path: &str,
+    ) -> Result<&LoadedDirectoryEntryTable, util::Error<E>> {
+        let segments = split_path(path);
+        let key = self.resolve_dir(dev, &segments).await?;
+        Ok(&self.tables[&key].table)
+    }
+
+    /// Retrieves the directory entry node corresponding to the provided path,
+    /// if it exists. This behaves like `DirectoryEntryTable::walk_path` on the
+    /// root table, but reuses cached directories.
+    ///
+    /// Returns None if the root path is provided (root has no dirent)
+    /// or the path does not exist.
+    pub async fn walk_path<E>(
+        &mut self,
+        dev: &mut impl BlockDeviceRead<E>,
+        path: &str,
+    ) -> Result<DirectoryEntryNode, util::Error<E>> {
+        if path.is_empty() || path == "/" {
+            return Err(util::Error::NoDirent);
+        }
+
+        let segments = split_path(path);
+        let (name, parents) = segments.split_last().ok_or(util::Error::DoesNotExist)?;
+        let key = self.resolve_dir(dev, parents).await?;
+        self.tables[&key].table.find_dirent(name)
+    }
+}
+
+#[cfg(all(test, feature = "write"))]
+mod test {
+    use futures::executor;
+
+    use super::{CacheStats, DirectoryCache};
+    use crate::blockdev::OutOfBounds;
+    use crate::read::test::nested_image;
+    use crate::util;
+
+    #[test]
+    fn test_cache_reuses_prefixes() {
+        let (mut image, root) = nested_image();
+        let mut cache = DirectoryCache::new(root, 8);
+
+        let dirent = executor::block_on(cache.walk_path(&mut image, "/Dir/file.bin")).unwrap();
+        assert_eq!(dirent.node.dirent.data.size(), 16);
+        assert_eq!(
+            cache.stats(),
+            CacheStats {
+                hits: 0,
+                misses: 2,
+                evictions: 0
+            }
+        );
+
+        // Different case, same directory
+        let dirent = executor::block_on(cache.walk_path(&mut image, "/dIR/SUB")).unwrap();
+        assert!(dirent.node.dirent.is_directory());
+        assert_eq!(cache.stats().hits, 1);
+        assert_eq!(cache.stats().misses, 2);
+
+        let root_listing = executor::block_on(cache.dirent_table(&mut image, "/")).unwrap();
+        assert_eq!(
+            root_listing
+                .walk_dirent_tree::<OutOfBounds>()
+                .unwrap()
+                .len(),
+            2
+        );
+        assert_eq!(cache.stats().hits, 2);
+        assert_eq!(cache.len(), 2);
+    }
+
+    #[test]
+    fn test_cache_eviction() {
+        let (mut image, root) = nested_image();
+        let mut cache = DirectoryCache::new(root, 1);
+
+        executor::block_on(cache.walk_path(&mut image, "/Dir/file.bin")).unwrap();
+        assert_eq!(cache.len(), 1);
+        assert_eq!(cache.stats().evictions, 1);
+
+        // Root was evicted in favour of /Dir, which is still cached
+        executor::block_on(cache.walk_path(&mut image, "/Dir/Sub")).unwrap();
+        assert_eq!(cache.stats().hits, 1);
+
+        executor::block_on(cache.walk_path(&mut image, "/top.xbe")).unwrap();
+        assert_eq!(cache.stats().misses, 3);
+        assert_eq!(cache.stats().evictions, 2);
+    }
+
+    #[test]
+    fn test_cache_missing_paths() {
+        let (mut image, root) = nested_image();
+        let mut cache = DirectoryCache::new(root, 8);
+
+        let res = executor::block_on(cache.walk_path(&mut image, "/"));
+        assert!(matches!(res, Err(util::Error::NoDirent)));
+
+        let res = executor::block_on(cache.walk_path(&mut image, "/Dir/missing"));
+        assert!(matches!(res, Err(util::Error::DoesNotExist)));
+
+        let res = executor::block_on(cache.dirent_table(&mut image, "/top.xbe"));
+        assert!(matches!(res, Err(util::Error::IsNotDirectory)));
+    }
+}
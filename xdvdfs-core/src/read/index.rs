@@ -0,0 +1,520 @@
+use alloc::vec;
+use alloc::vec::Vec;
+
+use crate::blockdev::BlockDeviceRead;
+use crate::layout::{DirectoryEntryNode, DirectoryEntryTable, DiskRegion, VolumeDescriptor};
+use crate::util;
+
+use super::tree::{FileTree, NO_PARENT};
+use super::DirentOrder;
+
+/// Magic bytes at the start of every index file
+pub const INDEX_MAGIC: [u8; 8] = *b"XDVDFSIX";
+
+/// Version of the index file format produced by this library.
+/// Index files with any other version are rejected.
+pub const INDEX_VERSION: u32 = 2;
+
+/// Marks an unused slot in the path hash table
+const EMPTY_SLOT: u32 = u32::MAX;
+
+const HEADER_SIZE: usize = 56;
+
+/// Size of the per-entry columns: parent, sector, size, name end and attributes
+const ENTRY_SIZE: usize = 17;
+
+/// Identifies the image an index was built from.
+///
+/// An index is considered stale if the size or modification time
+/// of its image no longer match.
+#[derive(Copy, Clone, Debug, Default, Eq, PartialEq)]
+pub struct ImageStamp {
+    pub size: u64,
+
+    /// Modification time, in nanoseconds since the Unix epoch
+    pub mtime: u64,
+}
+
+/// Flattened, serializable listing of every directory entry in an image.
+///
+/// Entries are stored in a `FileTree`, in the same order as
+/// `DirectoryEntryTable::file_tree`. A hash table over case-folded full paths
+/// allows paths to be resolved without walking any directory entry tables.
+pub struct ImageIndex {
+    stamp: ImageStamp,
+    root_table: DirectoryEntryTable,
+    filetime: u64,
+    tree: FileTree,
+    slots: Vec<u32>,
+}
+
+/// FNV-1a hash of a path, folded to uppercase as in `util::cmp_ignore_case_utf8`
+fn hash_path<'a>(segments: impl Iterator<Item = &'a str>) -> u64 {
+    fn update(hash: u64, bytes: &[u8]) -> u64 {
+        bytes.iter().fold(hash, |hash, byte| {
+            (hash ^ *byte as u64).wrapping_mul(0x0100_0000_01b3)
+        })
+    }
+
+    let mut hash: u64 = 0xcbf2_9ce4_8422_2325;
+    let mut buf = [0; 4];
+    for segment in segments {
+        hash = update(hash, b"/");
+        for c in segment.chars() {
+            hash = update(
+                hash,
+                c.to_ascii_uppercase().encode_utf8(&mut buf).as_bytes(),
+            );
+        }
+    }
+
+    hash
+}
+
+fn split_path(path: &str) -> impl Iterator<Item = &str> + Clone {
+    path.trim_start_matches('/').split_terminator('/')
+}
+
+struct Reader<'a> {
+    buf: &'a [u8],
+}
+
+impl<'a> Reader<'a> {
+    fn take<E>(&mut self, len: usize) -> Result<&'a [u8], util::Error<E>> {
+        if self.buf.len() < len {
+            return Err(util::Error::InvalidIndex);
+        }
+
+        let (head, tail) = self.buf.split_at(len);
+        self.buf = tail;
+        Ok(head)
+    }
+
+    fn u32<E>(&mut self) -> Result<u32, util::Error<E>> {
+        let bytes = self.take(4)?;
+        Ok(u32::from_le_bytes([bytes[0], bytes[1], bytes[2], bytes[3]]))
+    }
+
+    fn u64<E>(&mut self) -> Result<u64, util::Error<E>> {
+        let mut bytes = [0; 8];
+        bytes.copy_from_slice(self.take(8)?);
+        Ok(u64::from_le_bytes(bytes))
+    }
+
+    fn u32_column<E>(&mut self, len: usize) -> Result<Vec<u32>, util::Error<E>> {
+        (0..len).map(|_| self.u32()).collect()
+    }
+}
+
+fn put_u32_column(buf: &mut Vec<u8>, column: &[u32]) {
+    for value in column {
+        buf.extend_from_slice(&value.to_le_bytes());
+    }
+}
+
+impl ImageIndex {
+    /// Builds an index of every directory entry in the volume
+    pub async fn build<E>(
+        volume: &VolumeDescriptor,
+        dev: &mut impl BlockDeviceRead<E>,
+        stamp: ImageStamp,
+    ) -> Result<Self, util::Error<E>> {
+        let tree = volume
+            .root_table
+            .compact_file_tree(dev, DirentOrder::Tree)
+            .await?;
+
+        let mut index = Self {
+            stamp,
+            root_table: volume.root_table,
+            filetime: volume.filetime,
+            tree,
+            slots: Vec::new(),
+        };
+
+        index.build_slots()?;
+        Ok(index)
+    }
+
+    fn build_slots<E>(&mut self) -> Result<(), util::Error<E>> {
+        let slot_count = core::cmp::max(self.tree.len() * 2, 1).next_power_of_two();
+        self.slots = vec![EMPTY_SLOT; slot_count];
+
+        for idx in 0..self.tree.len() {
+            let segments = self.tree.path_segments(idx)?;
+            let hash = hash_path(segments.iter().map(|s| s.as_str()));
+            let mut slot = hash as usize & (slot_count - 1);
+            while self.slots[slot] != EMPTY_SLOT {
+                slot = (slot + 1) & (slot_count - 1);
+            }
+
+            self.slots[slot] = idx as u32;
+        }
+
+        Ok(())
+    }
+
+    /// Returns the number of directory entries in the index
+    pub fn len(&self) -> usize {
+        self.tree.len()
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.tree.is_empty()
+    }
+
+    /// Returns the size and modification time of the image this index was built from
+    pub fn stamp(&self) -> ImageStamp {
+        self.stamp
+    }
+
+    /// Returns true if this index was built from an image matching `stamp`
+    pub fn is_current(&self, stamp: ImageStamp) -> bool {
+        self.stamp == stamp
+    }
+
+    /// Reconstructs the volume descriptor of the indexed image
+    pub fn volume(&self) -> VolumeDescriptor {
+        let mut volume = VolumeDescriptor::new(self.root_table);
+        volume.filetime = self.filetime;
+        volume
+    }
+
+    /// Returns the indexed entries
+    pub fn tree(&self) -> &FileTree {
+        &self.tree
+    }
+
+    /// Returns the directory entry at position `idx` in the index
+    pub fn dirent(&self, idx: usize) -> DirectoryEntryNode {
+        self.tree.dirent(idx)
+    }
+
+    /// Returns the path of the directory containing entry `idx`,
+    /// in the same format as `DirectoryEntryTable::file_tree`
+    pub fn parent_path<E>(&self, idx: usize) -> Result<alloc::string::String, util::Error<E>> {
+        self.tree.parent_path(idx)
+    }
+
+    /// Looks up the position of the entry at `path` in the index, ignoring case
+    pub fn find<E>(&self, path: &str) -> Result<usize, util::Error<E>> {
+        if self.slots.is_empty() {
+            return Err(util::Error::DoesNotExist);
+        }
+
+        let slot_count = self.slots.len();
+        let mut slot = hash_path(split_path(path)) as usize & (slot_count - 1);
+        for _ in 0..slot_count {
+            let idx = self.slots[slot];
+            if idx == EMPTY_SLOT {
+                return Err(util::Error::DoesNotExist);
+            }
+
+            let segments = self.tree.path_segments(idx as usize)?;
+            let matches = segments.len() == split_path(path).count()
+                && segments
+                    .iter()
+                    .zip(split_path(path))
+                    .all(|(a, b)| util::cmp_ignore_case_utf8(a, b) == core::cmp::Ordering::Equal);
+            if matches {
+                return Ok(idx as usize);
+            }
+
+            slot = (slot + 1) & (slot_count - 1);
+        }
+
+        Err(util::Error::DoesNotExist)
+    }
+
+    /// Retrieves the directory entry node corresponding to the provided path.
+    /// This behaves like `DirectoryEntryTable::walk_path` on the root table.
+    pub fn walk_path<E>(&self, path: &str) -> Result<DirectoryEntryNode, util::Error<E>> {
+        if path.is_empty() || path == "/" {
+            return Err(util::Error::NoDirent);
+        }
+
+        self.find(path).map(|idx| self.dirent(idx))
+    }
+
+    /// Lists the directory at `path`, in the same order as `walk_dirent_tree`.
+    ///
+    /// `/` (or an empty path) refers to the root directory.
+    pub fn list_dir<E>(&self, path: &str) -> Result<Vec<DirectoryEntryNode>, util::Error<E>> {
+        let parent = if split_path(path).next().is_none() {
+            NO_PARENT
+        } else {
+            let idx = self.find(path)?;
+            if !self.tree.is_directory(idx) {
+                return Err(util::Error::IsNotDirectory);
+            }
+
+            idx as u32
+        };
+
+        Ok(self
+            .tree
+            .children(parent)
+            .map(|idx| self.dirent(idx))
+            .collect())
+    }
+
+    /// Returns every entry in the index, along with the path of its parent directory,
+    /// in the same format and order as `DirectoryEntryTable::file_tree`
+    pub fn file_tree<E>(
+        &self,
+    ) -> Result<Vec<(alloc::string::String, DirectoryEntryNode)>, util::Error<E>> {
+        self.tree.to_file_tree()
+    }
+
+    /// Serializes the index into its on-disk representation
+    pub fn serialize(&self) -> Vec<u8> {
+        let tree = &self.tree;
+        let mut buf = Vec::with_capacity(
+            HEADER_SIZE + ENTRY_SIZE * tree.len() + tree.names().len() + 4 * self.slots.len(),
+        );
+
+        let root_region = self.root_table.region;
+        buf.extend_from_slice(&INDEX_MAGIC);
+        buf.extend_from_slice(&INDEX_VERSION.to_le_bytes());
+        buf.extend_from_slice(&(tree.len() as u32).to_le_bytes());
+        buf.extend_from_slice(&(tree.names().len() as u32).to_le_bytes());
+        buf.extend_from_slice(&(self.slots.len() as u32).to_le_bytes());
+        buf.extend_from_slice(&self.stamp.size.to_le_bytes());
+        buf.extend_from_slice(&self.stamp.mtime.to_le_bytes());
+        buf.extend_from_slice(&{ root_region.sector }.to_le_bytes());
+        buf.extend_from_slice(&{ root_region.size }.to_le_bytes());
+        buf.extend_from_slice(&self.filetime.to_le_bytes());
+        assert_eq!(buf.len(), HEADER_SIZE);
+
+        put_u32_column(&mut buf, tree.parents());
+        put_u32_column(&mut buf, tree.sectors());
+        put_u32_column(&mut buf, tree.sizes());
+        put_u32_column(&mut buf, tree.name_ends());
+        buf.extend_from_slice(tree.attributes());
+        buf.extend_from_slice(tree.names());
+        put_u32_column(&mut buf, &self.slots);
+
+        buf
+    }
+
+    /// Parses an index from its on-disk representation.
+    ///
+    /// Returns `InvalidIndex` if the data is malformed or has an unsupported version.
+    pub fn deserialize<E>(buf: &[u8]) -> Result<Self, util::Error<E>> {
+        let mut reader = Reader { buf };
+
+        if reader.take(INDEX_MAGIC.len())? != INDEX_MAGIC || reader.u32()? != INDEX_VERSION {
+            return Err(util::Error::InvalidIndex);
+        }
+
+        let entry_count = reader.u32()? as usize;
+        let names_len = reader.u32()? as usize;
+        let slot_count = reader.u32()? as usize;
+        let stamp = ImageStamp {
+            size: reader.u64()?,
+            mtime: reader.u64()?,
+        };
+        let root_table = DirectoryEntryTable {
+            region: DiskRegion {
+                sector: reader.u32()?,
+                size: reader.u32()?,
+            },
+        };
+        let filetime = reader.u64()?;
+
+        let expected_len = ENTRY_SIZE
+            .checked_mul(entry_count)
+            .and_then(|len| len.checked_add(names_len))
+            .and_then(|len| len.checked_add(slot_count.checked_mul(4)?))
+            .ok_or(util::Error::InvalidIndex)?;
+        // Lookups stop at an empty slot, so the hash table must never be full
+        if reader.buf.len() != expected_len
+            || !slot_count.is_power_of_two()
+            || entry_count >= slot_count
+        {
+            return Err(util::Error::InvalidIndex);
+        }
+
+        let parents = reader.u32_column(entry_count)?;
+        let sectors = reader.u32_column(entry_count)?;
+        let sizes = reader.u32_column(entry_count)?;
+        let name_ends = reader.u32_column(entry_count)?;
+        let attributes = reader.take(entry_count)?.to_vec();
+        let names = reader.take(names_len)?.to_vec();
+        let tree = FileTree::from_parts(parents, sectors, sizes, attributes, name_ends, names)
+            .ok_or(util::Error::InvalidIndex)?;
+
+        let slots = reader.u32_column(slot_count)?;
+        if slots
+            .iter()
+            .any(|&slot| slot != EMPTY_SLOT && slot as usize >= entry_count)
+            || !slots.contains(&EMPTY_SLOT)
+        {
+            return Err(util::Error::InvalidIndex);
+        }
+
+        Ok(Self {
+            stamp,
+            root_table,
+            filetime,
+            tree,
+            slots,
+        })
+    }
+}
+
+#[cfg(feature = "std")]
+impl ImageStamp {
+    /// Creates a stamp from the metadata of an image file
+    pub fn from_metadata(metadata: &std::fs::Metadata) -> std::io::Result<Self> {
+        let mtime = metadata
+            .modified()?
+            .duration_since(std::time::UNIX_EPOCH)
+            .map(|time| time.as_nanos() as u64)
+            .unwrap_or(0);
+
+        Ok(Self {
+            size: metadata.len(),
+            mtime,
+        })
+    }
+}
+
+#[cfg(feature = "std")]
+impl ImageIndex {
+    /// Returns the path of the sidecar index file for the image at `image_path`
+    pub fn sidecar_path(image_path: &std::path::Path) -> std::path::PathBuf {
+        let mut path = image_path.as_os_str().to_os_string();
+        path.push(".xdvdfs-index");
+        std::path::PathBuf::from(path)
+    }
+
+    /// Loads the sidecar index for the image at `image_path` with a single read.
+    ///
+    /// Returns `None` if there is no sidecar, or if it is stale or unreadable
+    /// and should be rebuilt.
+    pub fn load_sidecar(image_path: &std::path::Path) -> std::io::Result<Option<Self>> {
+        let stamp = ImageStamp::from_metadata(&std::fs::metadata(image_path)?)?;
+        let data = match std::fs::read(Self::sidecar_path(image_path)) {
+            Ok(data) => data,
+            Err(err) if err.kind() == std::io::ErrorKind::NotFound => return Ok(None),
+            Err(err) => return Err(err),
+        };
+
+        match Self::deserialize::<std::io::Error>(&data) {
+            Ok(index) if index.is_current(stamp) => Ok(Some(index)),
+            _ => Ok(None),
+        }
+    }
+
+    /// Writes this index as the sidecar of the image at `image_path`
+    pub fn write_sidecar(&self, image_path: &std::path::Path) -> std::io::Result<()> {
+        std::fs::write(Self::sidecar_path(image_path), self.serialize())
+    }
+}
+
+#[cfg(all(test, feature = "write"))]
+mod test {
+    use alloc::vec::Vec;
+    use futures::executor;
+
+    use super::{ImageIndex, ImageStamp};
+    use crate::blockdev::OutOfBounds;
+    use crate::layout::VolumeDescriptor;
+    use crate::read::test::nested_image;
+    use crate::util;
+
+    fn nested_index() -> (ImageIndex, Vec<u8>, VolumeDescriptor) {
+        let (mut image, root) = nested_image();
+        let volume = VolumeDescriptor::new(root);
+        let stamp = ImageStamp {
+            size: image.len() as u64,
+            mtime: 1234,
+        };
+
+        let index = executor::block_on(ImageIndex::build(&volume, &mut image, stamp)).unwrap();
+        (index, image, volume)
+    }
+
+    #[test]
+    fn test_index_matches_file_tree() {
+        let (index, mut image, volume) = nested_index();
+        let tree = executor::block_on(volume.root_table.file_tree(&mut image)).unwrap();
+        let indexed = index.file_tree::<OutOfBounds>().unwrap();
+
+        assert_eq!(tree.len(), index.len());
+        for ((dir_a, node_a), (dir_b, node_b)) in tree.iter().zip(indexed.iter()) {
+            assert_eq!(dir_a, dir_b);
+            assert_eq!(node_a.name_slice(), node_b.name_slice());
+            assert_eq!(node_a.node.dirent, node_b.node.dirent);
+        }
+    }
+
+    #[test]
+    fn test_index_lookup() {
+        let (index, _, _) = nested_index();
+
+        let dirent = index.walk_path::<OutOfBounds>("/dir/FILE.BIN").unwrap();
+        assert_eq!(dirent.name_str::<OutOfBounds>().unwrap(), "file.bin");
+        assert_eq!(dirent.node.dirent.data.size(), 16);
+
+        assert_eq!(index.list_dir::<OutOfBounds>("/").unwrap().len(), 2);
+        assert_eq!(index.list_dir::<OutOfBounds>("/Dir").unwrap().len(), 2);
+        assert!(index
+            .list_dir::<OutOfBounds>("/Dir/Sub")
+            .unwrap()
+            .is_empty());
+
+        assert!(matches!(
+            index.walk_path::<OutOfBounds>("/Dir/missing"),
+            Err(util::Error::DoesNotExist)
+        ));
+        assert!(matches!(
+            index.list_dir::<OutOfBounds>("/top.xbe"),
+            Err(util::Error::IsNotDirectory)
+        ));
+    }
+
+    #[test]
+    fn test_index_round_trip() {
+        let (index, _, _) = nested_index();
+        let data = index.serialize();
+
+        let parsed = ImageIndex::deserialize::<OutOfBounds>(&data).unwrap();
+        assert_eq!(parsed.serialize(), data);
+        assert!(parsed.is_current(ImageStamp {
+            size: index.stamp().size,
+            mtime: 1234,
+        }));
+        assert!(!parsed.is_current(ImageStamp {
+            size: index.stamp().size,
+            mtime: 1235,
+        }));
+
+        let mut bad_version = data.clone();
+        bad_version[8] = 0xff;
+        assert!(ImageIndex::deserialize::<OutOfBounds>(&bad_version).is_err());
+        assert!(ImageIndex::deserialize::<OutOfBounds>(&data[0..data.len() - 1]).is_err());
+
+        // A slot table without empty slots would make lookups of missing paths loop forever
+        let slot_bytes = 4 * index.slots.len();
+        let mut full_slots = data.clone();
+        let slots_start = full_slots.len() - slot_bytes;
+        full_slots[slots_start..].fill(0);
+        assert!(matches!(
+            ImageIndex::deserialize::<OutOfBounds>(&full_slots),
+            Err(util::Error::InvalidIndex)
+        ));
+    }
+
+    #[test]
+    fn test_index_lookup_full_slots() {
+        let (mut index, _, _) = nested_index();
+        index.slots.fill(0);
+
+        assert!(matches!(
+            index.walk_path::<OutOfBounds>("/missing"),
+            Err(util::Error::DoesNotExist)
+        ));
+    }
+}
@@ -0,0 +1,710 @@
+use alloc::boxed::Box;
+use alloc::vec::Vec;
+
+use super::blockdev::BlockDeviceRead;
+use super::layout::{
+    self, DirectoryEntryDiskNode, DirectoryEntryNode, DirectoryEntryTable, DirectoryEntryView,
+    VolumeDescriptor,
+};
+use super::util;
+
+pub mod cache;
+pub mod index;
+pub mod stream;
+pub mod tree;
+
+/// Read the XDVDFS volume descriptor from sector 32 of the drive
+/// Returns None if the volume descriptor is invalid
+pub async fn read_volume<E>(
+    dev: &mut impl BlockDeviceRead<E>,
+) -> Result<VolumeDescriptor, util::Error<E>> {
+    let mut buffer = [0; core::mem::size_of::<VolumeDescriptor>()];
+    dev.read(layout::SECTOR_SIZE * 32, &mut buffer)
+        .await
+        .map_err(|_| util::Error::InvalidVolume)?;
+
+    let volume = VolumeDescriptor::deserialize(&buffer)?;
+    if volume.is_valid() {
+        Ok(volume)
+    } else {
+        Err(util::Error::InvalidVolume)
+    }
+}
+
+async fn read_dirent<E>(
+    dev: &mut impl BlockDeviceRead<E>,
+    offset: u64,
+) -> Result<Option<DirectoryEntryNode>, util::Error<E>> {
+    let mut dirent_buf = [0; 0xe];
+    dev.read(offset, &mut dirent_buf)
+        .await
+        .map_err(|e| util::Error::IOError(e))?;
+
+    // Empty directory entries are filled with 0xff
+    if dirent_buf == [0xff; 0xe] {
+        return Ok(None);
+    }
+
+    let node = DirectoryEntryDiskNode::deserialize(&dirent_buf)?;
+
+    let mut dirent = DirectoryEntryNode {
+        node,
+        name: [0; 256],
+    };
+
+    let name_len = dirent.node.dirent.filename_length as usize;
+    let name_buf = &mut dirent.name[0..name_len];
+    dev.read(offset + 0xe, name_buf)
+        .await
+        .map_err(|e| util::Error::IOError(e))?;
+
+    Ok(Some(dirent))
+}
+
+/// Order in which the entries of a directory entry table are listed
+#[derive(Copy, Clone, Debug, Default, Eq, PartialEq)]
+pub enum DirentOrder {
+    /// Walk the on-disk binary search tree, following child offsets
+    #[default]
+    Tree,
+
+    /// Scan the table as an array, yielding entries in the order they appear on disk
+    Disk,
+}
+
+/// In-memory copy of an entire directory entry table.
+///
+/// The table region is read from the device with a single call, rounded up
+/// to whole sectors. Lookups and listings on the loaded table are then served
+/// from memory, without issuing a read for every directory entry.
+#[derive(Clone)]
+pub struct LoadedDirectoryEntryTable {
+    table: DirectoryEntryTable,
+    data: Box<[u8]>,
+}
+
+impl LoadedDirectoryEntryTable {
+    /// Returns the on-disk region that this table was loaded from
+    pub fn table(&self) -> &DirectoryEntryTable {
+        &self.table
+    }
+
+    /// Returns the raw bytes of the table, padded to a whole number of sectors
+    pub fn as_bytes(&self) -> &[u8] {
+        &self.data
+    }
+
+    /// Parses the directory entry at `offset` in place, without copying its name.
+    /// Returns None for unused entries.
+    pub fn view_at<E>(
+        &self,
+        offset: u32,
+    ) -> Result<Option<DirectoryEntryView<'_>>, util::Error<E>> {
+        let size = self.table.region.size;
+        if offset >= size {
+            return Err(util::Error::SizeOutOfBounds(offset, size));
+        }
+
+        let start = offset as usize;
+        let header: &[u8; 0xe] = self
+            .data
+            .get(start..start + 0xe)
+            .and_then(|header| header.try_into().ok())
+            .ok_or(util::Error::SizeOutOfBounds(offset, size))?;
+
+        // Empty directory entries are filled with 0xff
+        if header == &[0xff; 0xe] {
+            return Ok(None);
+        }
+
+        let node = DirectoryEntryDiskNode::parse(header);
+        let name_len = node.dirent.filename_length as usize;
+        let name = self
+            .data
+            .get(start + 0xe..start + 0xe + name_len)
+            .ok_or(util::Error::SizeOutOfBounds(offset, size))?;
+
+        Ok(Some(DirectoryEntryView::new(node, name)))
+    }
+
+    fn find_view<E>(&self, name: &str) -> Result<DirectoryEntryView<'_>, util::Error<E>> {
+        if self.table.is_empty() {
+            return Err(util::Error::DoesNotExist);
+        }
+
+        let mut offset = 0;
+
+        loop {
+            let dirent = self.view_at(offset)?;
+            let dirent = dirent.ok_or(util::Error::DoesNotExist)?;
+            let dirent_name = dirent.name_str()?;
+            dprintln!("[find_dirent] Found {}: {:?}", dirent_name, dirent.node);
+
+            let cmp = util::cmp_ignore_case_utf8(name, &dirent_name);
+
+            let next_offset = match cmp {
+                core::cmp::Ordering::Equal => return Ok(dirent),
+                core::cmp::Ordering::Less => dirent.node.left_entry_offset,
+                core::cmp::Ordering::Greater => dirent.node.right_entry_offset,
+            };
+
+            if next_offset == 0 {
+                return Err(util::Error::DoesNotExist);
+            }
+
+            offset = 4 * next_offset as u32;
+        }
+    }
+
+    /// Searches the table for a directory entry with the given name,
+    /// comparing names without regard to case.
+    pub fn find_dirent<E>(&self, name: &str) -> Result<DirectoryEntryNode, util::Error<E>> {
+        self.find_view(name).map(|view| view.to_node())
+    }
+
+    /// Walks the loaded directory entry table in preorder,
+    /// returning views of all directory entries.
+    pub fn walk_dirent_views<E>(&self) -> Result<Vec<DirectoryEntryView<'_>>, util::Error<E>> {
+        use alloc::vec;
+
+        let mut dirents = vec![];
+        if self.table.is_empty() {
+            return Ok(dirents);
+        }
+
+        let mut stack = vec![0];
+        while let Some(top) = stack.pop() {
+            let dirent = self.view_at(top)?;
+
+            if let Some(dirent) = dirent {
+                dprintln!(
+                    "Found dirent {}: {:?} at offset {}",
+                    dirent.name_str()?,
+                    dirent,
+                    top
+                );
+
+                let left_child = dirent.node.left_entry_offset;
+                if left_child != 0 && left_child != 0xffff {
+                    stack.push(4 * dirent.node.left_entry_offset as u32);
+                }
+
+                let right_child = dirent.node.right_entry_offset;
+                if right_child != 0 && right_child != 0xffff {
+                    stack.push(4 * dirent.node.right_entry_offset as u32);
+                }
+
+                dirents.push(dirent);
+            }
+        }
+
+        Ok(dirents)
+    }
+
+    /// Walks the loaded directory entry table in preorder, returning all directory entries.
+    pub fn walk_dirent_tree<E>(&self) -> Result<Vec<DirectoryEntryNode>, util::Error<E>> {
+        Ok(self
+            .walk_dirent_views()?
+            .iter()
+            .map(DirectoryEntryView::to_node)
+            .collect())
+    }
+
+    /// Returns an iterator that scans the loaded table as an array,
+    /// yielding directory entries in disk order.
+    ///
+    /// Unlike `walk_dirent_tree`, this does not follow the left and right
+    /// child offsets, and so still finds every entry if those are corrupt.
+    pub fn scan_dirents<E>(&self) -> DirentScanIter<'_, E> {
+        DirentScanIter {
+            table: self,
+            offset: 0,
+            etype: core::marker::PhantomData,
+        }
+    }
+
+    /// Returns views of all directory entries in the table, in the given order
+    pub fn dirent_views<E>(
+        &self,
+        order: DirentOrder,
+    ) -> Result<Vec<DirectoryEntryView<'_>>, util::Error<E>> {
+        match order {
+            DirentOrder::Tree => self.walk_dirent_views(),
+            DirentOrder::Disk => {
+                let mut scan = self.scan_dirents::<E>();
+                core::iter::from_fn(|| scan.next_view()).collect()
+            }
+        }
+    }
+
+    /// Returns all directory entries in the table, in the given order
+    pub fn dirents<E>(
+        &self,
+        order: DirentOrder,
+    ) -> Result<Vec<DirectoryEntryNode>, util::Error<E>> {
+        match order {
+            DirentOrder::Tree => self.walk_dirent_tree(),
+            DirentOrder::Disk => self.scan_dirents().collect(),
+        }
+    }
+}
+
+/// Iterator over the entries of a `LoadedDirectoryEntryTable`, in disk order.
+///
+/// The table is scanned sector by sector. Directory entries are 4-byte aligned
+/// and never cross a sector boundary, so any 0xff padding is skipped up to the
+/// next 4-byte or sector boundary.
+pub struct DirentScanIter<'a, E> {
+    table: &'a LoadedDirectoryEntryTable,
+    offset: u32,
+    etype: core::marker::PhantomData<E>,
+}
+
+impl<'a, E> DirentScanIter<'a, E> {
+    /// Advances the scan, returning a view of the next entry
+    pub fn next_view(&mut self) -> Option<Result<DirectoryEntryView<'a>, util::Error<E>>> {
+        let sector_size = layout::SECTOR_SIZE as u32;
+        let size = self.table.table.region.size;
+
+        while self.offset < size {
+            let offset = self.offset;
+            let sector_end = core::cmp::min(size, (offset / sector_size + 1) * sector_size);
+
+            // Not enough room left in this sector for another entry
+            if offset + 0xe > sector_end {
+                self.offset = sector_end;
+                continue;
+            }
+
+            // Padding is filled with 0xff, and no valid entry has a left child offset of 0xffff
+            let header = &self.table.data[offset as usize..];
+            if header[0] == 0xff && header[1] == 0xff {
+                self.offset = offset + 4;
+                continue;
+            }
+
+            // Entries always have a name. Anything else is unused space in the sector.
+            let name_len = header[0xd] as u32;
+            if name_len == 0 || offset + 0xe + name_len > sector_end {
+                self.offset = sector_end;
+                continue;
+            }
+
+            let dirent_len = 0xe + name_len;
+            self.offset = offset + dirent_len + (4 - dirent_len % 4) % 4;
+
+            let dirent = self.table.view_at(offset).transpose()?;
+            if let Ok(ref dirent) = dirent {
+                dprintln!("[scan_dirents] Found {:?} at offset {}", dirent, offset);
+            }
+
+            return Some(dirent);
+        }
+
+        None
+    }
+}
+
+impl<'a, E> Iterator for DirentScanIter<'a, E> {
+    type Item = Result<DirectoryEntryNode, util::Error<E>>;
+
+    fn next(&mut self) -> Option<Self::Item> {
+        self.next_view().map(|view| view.map(|view| view.to_node()))
+    }
+}
+
+impl VolumeDescriptor {
+    pub async fn root_dirent<E>(
+        &self,
+        dev: &mut impl BlockDeviceRead<E>,
+    ) -> Result<Option<DirectoryEntryNode>, util::Error<E>> {
+        if self.root_table.is_empty() {
+            return Err(util::Error::DirectoryEmpty);
+        }
+
+        read_dirent(dev, self.root_table.offset(0)?).await
+    }
+}
+
+impl DirectoryEntryTable {
+    /// Reads the entire directory entry table into memory with a single
+    /// device read. The region size is rounded up to whole sectors.
+    pub async fn load<E>(
+        &self,
+        dev: &mut impl BlockDeviceRead<E>,
+    ) -> Result<LoadedDirectoryEntryTable, util::Error<E>> {
+        dprintln!("[load] Loading dirtab: {:?}", self);
+
+        let size = self.region.size as u64;
+        let size = size + (layout::SECTOR_SIZE - size % layout::SECTOR_SIZE) % layout::SECTOR_SIZE;
+        let mut data = alloc::vec![0; size as usize].into_boxed_slice();
+
+        if !self.is_empty() {
+            let offset = self.offset(0)?;
+            dev.read(offset, &mut data)
+                .await
+                .map_err(|e| util::Error::IOError(e))?;
+        }
+
+        Ok(LoadedDirectoryEntryTable { table: *self, data })
+    }
+
+    /// Reads several directory entry tables into memory with one batched device read.
+    /// Tables are returned in the same order as `tables`.
+    pub async fn load_many<E>(
+        dev: &mut impl BlockDeviceRead<E>,
+        tables: &[DirectoryEntryTable],
+    ) -> Result<Vec<LoadedDirectoryEntryTable>, util::Error<E>> {
+        let mut data = Vec::with_capacity(tables.len());
+        let mut offsets = Vec::with_capacity(tables.len());
+        for table in tables {
+            let size = table.region.size as u64;
+            let size =
+                size + (layout::SECTOR_SIZE - size % layout::SECTOR_SIZE) % layout::SECTOR_SIZE;
+            data.push(alloc::vec![0; size as usize].into_boxed_slice());
+            offsets.push(match table.is_empty() {
+                true => None,
+                false => Some(table.offset(0)?),
+            });
+        }
+
+        let mut requests: Vec<(u64, &mut [u8])> = offsets
+            .iter()
+            .zip(data.iter_mut())
+            .filter_map(|(offset, buf)| offset.map(|offset| (offset, &mut buf[..])))
+            .collect();
+        dev.read_batch(&mut requests)
+            .await
+            .map_err(|e| util::Error::IOError(e))?;
+
+        Ok(tables
+            .iter()
+            .zip(data)
+            .map(|(table, data)| LoadedDirectoryEntryTable {
+                table: *table,
+                data,
+            })
+            .collect())
+    }
+
+    async fn find_dirent<E>(
+        &self,
+        dev: &mut impl BlockDeviceRead<E>,
+        name: &str,
+    ) -> Result<DirectoryEntryNode, util::Error<E>> {
+        if self.region.size == 0 {
+            return Err(util::Error::DoesNotExist);
+        }
+
+        self.load(dev).await?.find_dirent(name)
+    }
+
+    /// Retrieves the directory entry node corresponding to the provided path,
+    /// if it exists.
+    ///
+    /// Returns None if the root path is provided (root has no dirent)
+    /// or the path does not exist.
+    pub async fn walk_path<E>(
+        &self,
+        dev: &mut impl BlockDeviceRead<E>,
+        path: &str,
+    ) -> Result<DirectoryEntryNode, util::Error<E>> {
+        if path.is_empty() || path == "/" {
+            return Err(util::Error::NoDirent);
+        }
+
+        let mut dirent_tab = *self;
+        let mut path_iter = path
+            .trim_start_matches('/')
+            .split_terminator('/')
+            .peekable();
+
+        while let Some(segment) = path_iter.next() {
+            let dirent = dirent_tab.find_dirent(dev, segment).await?;
+            dprintln!("[walk_path] Got dirent: {:?}", dirent.node);
+            let dirent_data = &dirent.node.dirent;
+
+            if path_iter.peek().is_none() {
+                return Ok(dirent);
+            }
+
+            dirent_tab = dirent_data
+                .dirent_table()
+                .ok_or(util::Error::DoesNotExist)?;
+        }
+
+        Err(util::Error::DoesNotExist)
+    }
+
+    /// Walks the directory entry table in preorder, returning all directory entries.
+    ///
+    /// The table is loaded into memory with a single read before it is walked.
+    pub async fn walk_dirent_tree<E>(
+        &self,
+        dev: &mut impl BlockDeviceRead<E>,
+    ) -> Result<Vec<DirectoryEntryNode>, util::Error<E>> {
+        dprintln!("walk_dirent_tree: {:?}", self);
+
+        if self.is_empty() {
+            return Ok(Vec::new());
+        }
+
+        self.load(dev).await?.walk_dirent_tree()
+    }
+
+    /// Scans the directory entry table as an array, returning all directory
+    /// entries in disk order.
+    ///
+    /// This is a variant of `walk_dirent_tree` that reads entries sequentially
+    /// and does not depend on the tree's child offsets.
+    pub async fn scan_dirent_table<E>(
+        &self,
+        dev: &mut impl BlockDeviceRead<E>,
+    ) -> Result<Vec<DirectoryEntryNode>, util::Error<E>> {
+        dprintln!("scan_dirent_table: {:?}", self);
+
+        if self.is_empty() {
+            return Ok(Vec::new());
+        }
+
+        self.load(dev).await?.scan_dirents().collect()
+    }
+
+    /// Returns all directory entries in the table, in the given order
+    pub async fn read_dirents<E>(
+        &self,
+        dev: &mut impl BlockDeviceRead<E>,
+        order: DirentOrder,
+    ) -> Result<Vec<DirectoryEntryNode>, util::Error<E>> {
+        match order {
+            DirentOrder::Tree => self.walk_dirent_tree(dev).await,
+            DirentOrder::Disk => self.scan_dirent_table(dev).await,
+        }
+    }
+
+    pub async fn file_tree<E>(
+        &self,
+        dev: &mut impl BlockDeviceRead<E>,
+    ) -> Result<Vec<(alloc::string::String, DirectoryEntryNode)>, util::Error<E>> {
+        self.file_tree_with_order(dev, DirentOrder::Tree).await
+    }
+
+    /// Recursively lists all directory entries below this table, along with
+    /// the path of their parent directory. Each table is listed in the given order.
+    pub async fn file_tree_with_order<E>(
+        &self,
+        dev: &mut impl BlockDeviceRead<E>,
+        order: DirentOrder,
+    ) -> Result<Vec<(alloc::string::String, DirectoryEntryNode)>, util::Error<E>> {
+        use alloc::format;
+        use alloc::string::String;
+        use alloc::vec;
+
+        let mut dirents = vec![];
+
+        let mut stack = vec![(String::from(""), *self)];
+        while let Some((parent, tree)) = stack.pop() {
+            dprintln!("Descending through {}", parent);
+            let children = tree.read_dirents(dev, order).await?;
+            for child in children.iter() {
+                if let Some(dirent_table) = child.node.dirent.dirent_table() {
+                    let child_name = child.name_str()?;
+                    stack.push((format!("{}/{}", parent, child_name), dirent_table));
+                }
+
+                dirents.push((parent.clone(), *child));
+            }
+        }
+
+        Ok(dirents)
+    }
+}
+
+#[cfg(all(test, feature = "write"))]
+pub(crate) mod test {
+    use alloc::boxed::Box;
+    use alloc::format;
+    use alloc::string::String;
+    use alloc::vec::Vec;
+    use futures::executor;
+
+    use super::DirentOrder;
+
+    use crate::blockdev::{BlockDeviceRead, OutOfBounds};
+    use crate::layout::{self, DirectoryEntryTable};
+    use crate::write::{dirtab::DirectoryEntryTableWriter, sector::SectorAllocator};
+
+    /// Builds an image containing a single directory entry table at sector 33
+    /// with the given file names, and returns the image and the table.
+    fn image_with_dirtab(names: &[&str]) -> (Vec<u8>, DirectoryEntryTable) {
+        let mut writer = DirectoryEntryTableWriter::default();
+        for (idx, name) in names.iter().enumerate() {
+            writer.add_file::<OutOfBounds>(name, idx as u32).unwrap();
+        }
+
+        writer.compute_size::<OutOfBounds>().unwrap();
+        let size = writer.dirtab_size();
+
+        let mut allocator = SectorAllocator::default();
+        let sector = allocator.allocate_contiguous(size);
+        let repr = writer.disk_repr::<OutOfBounds>(&mut allocator).unwrap();
+
+        let offset = (sector * layout::SECTOR_SIZE) as usize;
+        let mut image = alloc::vec![0; offset];
+        image.extend_from_slice(&repr.entry_table);
+
+        (image, DirectoryEntryTable::new(size as u32, sector as u32))
+    }
+
+    /// Builds an image with the layout:
+    /// /
+    /// -- /Dir
+    /// -- -- /Dir/file.bin
+    /// -- -- /Dir/Sub
+    /// -- /top.xbe
+    pub(crate) fn nested_image() -> (Vec<u8>, DirectoryEntryTable) {
+        let mut sub = DirectoryEntryTableWriter::default();
+        sub.compute_size::<OutOfBounds>().unwrap();
+
+        let mut dir = DirectoryEntryTableWriter::default();
+        dir.add_file::<OutOfBounds>("file.bin", 16).unwrap();
+        dir.add_dir::<OutOfBounds>("Sub", sub.dirtab_size() as u32)
+            .unwrap();
+        dir.compute_size::<OutOfBounds>().unwrap();
+
+        let mut root = DirectoryEntryTableWriter::default();
+        root.add_dir::<OutOfBounds>("Dir", dir.dirtab_size() as u32)
+            .unwrap();
+        root.add_file::<OutOfBounds>("top.xbe", 16).unwrap();
+        root.compute_size::<OutOfBounds>().unwrap();
+
+        let mut allocator = SectorAllocator::default();
+        let root_size = root.dirtab_size();
+        let root_sector = allocator.allocate_contiguous(root_size);
+        let root_repr = root.disk_repr::<OutOfBounds>(&mut allocator).unwrap();
+        let dir_sector = root_repr
+            .file_listing
+            .iter()
+            .find(|entry| entry.is_dir)
+            .unwrap()
+            .sector;
+        let dir_repr = dir.disk_repr::<OutOfBounds>(&mut allocator).unwrap();
+
+        // Empty tables are never written, so fill unused space as if it were padding
+        let mut image = alloc::vec![0xff; 64 * layout::SECTOR_SIZE as usize];
+        for (sector, table) in [(root_sector, root_repr), (dir_sector, dir_repr)] {
+            let offset = (sector * layout::SECTOR_SIZE) as usize;
+            image[offset..offset + table.entry_table.len()].copy_from_slice(&table.entry_table);
+        }
+
+        (
+            image,
+            DirectoryEntryTable::new(root_size as u32, root_sector as u32),
+        )
+    }
+
+    /// Block device that counts the number of read calls made against it
+    struct CountingDevice {
+        data: Vec<u8>,
+        reads: usize,
+    }
+
+    #[async_trait::async_trait(?Send)]
+    impl BlockDeviceRead<OutOfBounds> for CountingDevice {
+        async fn read(&mut self, offset: u64, buffer: &mut [u8]) -> Result<(), OutOfBounds> {
+            self.reads += 1;
+            self.data.read(offset, buffer).await
+        }
+    }
+
+    #[test]
+    fn test_loaded_dirtab_single_read() {
+        let names = ["default.xbe", "Media", "a_b", "abb", "NFL.png", "zzz"];
+        let (data, table) = image_with_dirtab(&names);
+        let mut dev = CountingDevice { data, reads: 0 };
+
+        let listing = executor::block_on(table.walk_dirent_tree(&mut dev)).unwrap();
+        assert_eq!(dev.reads, 1);
+        assert_eq!(listing.len(), names.len());
+
+        let dirent = executor::block_on(table.walk_path(&mut dev, "/nfl.PNG")).unwrap();
+        assert_eq!(dev.reads, 2);
+        assert_eq!(dirent.name_str::<OutOfBounds>().unwrap(), "NFL.png");
+        assert_eq!(dirent.node.dirent.data.size(), 4);
+    }
+
+    #[test]
+    fn test_loaded_dirtab_lookup() {
+        let names = ["default.xbe", "Media", "a_b", "abb", "NFL.png", "zzz"];
+        let (mut data, table) = image_with_dirtab(&names);
+
+        let loaded = executor::block_on(table.load(&mut data)).unwrap();
+        assert_eq!(loaded.as_bytes().len() as u64, layout::SECTOR_SIZE);
+
+        for name in names {
+            let dirent = loaded.find_dirent::<OutOfBounds>(name).unwrap();
+            assert_eq!(dirent.name_str::<OutOfBounds>().unwrap(), name);
+        }
+
+        assert!(loaded.find_dirent::<OutOfBounds>("missing").is_err());
+    }
+
+    #[test]
+    fn test_scan_dirents_multiple_sectors() {
+        let names: Vec<String> = (0..300)
+            .map(|i| format!("file_number_{:04}.bin", i))
+            .collect();
+        let names: Vec<&str> = names.iter().map(|s| s.as_str()).collect();
+        let (mut data, table) = image_with_dirtab(&names);
+        assert!(table.region.size as u64 > 2 * layout::SECTOR_SIZE);
+
+        let loaded = executor::block_on(table.load(&mut data)).unwrap();
+        let mut walked: Vec<String> = loaded
+            .walk_dirent_tree::<OutOfBounds>()
+            .unwrap()
+            .iter()
+            .map(|dirent| dirent.name_str::<OutOfBounds>().unwrap().into_owned())
+            .collect();
+        let scanned: Vec<String> = loaded
+            .scan_dirents::<OutOfBounds>()
+            .map(|dirent| {
+                dirent
+                    .unwrap()
+                    .name_str::<OutOfBounds>()
+                    .unwrap()
+                    .into_owned()
+            })
+            .collect();
+
+        // Entries are laid out in disk order, so scanning is not sorted by name,
+        // but should find the same set of entries as walking the tree.
+        let mut sorted_scan = scanned.clone();
+        sorted_scan.sort();
+        walked.sort();
+        assert_eq!(sorted_scan, walked);
+        assert_eq!(scanned.len(), names.len());
+    }
+
+    #[test]
+    fn test_scan_dirents_corrupt_children() {
+        let names = ["default.xbe", "Media", "a_b", "abb", "NFL.png", "zzz"];
+        let (mut data, table) = image_with_dirtab(&names);
+
+        // Point every child offset back at the root
+        let mut offset = table.offset::<OutOfBounds>(0).unwrap() as usize;
+        loop {
+            data[offset..offset + 4].copy_from_slice(&[0, 0, 0, 0]);
+            let dirent_len = 0xe + data[offset + 0xd] as usize;
+            offset += dirent_len + (4 - dirent_len % 4) % 4;
+            if data[offset] == 0xff {
+                break;
+            }
+        }
+
+        let tree = executor::block_on(table.walk_dirent_tree(&mut data)).unwrap();
+        assert_eq!(tree.len(), 1);
+
+        let scanned = executor::block_on(table.read_dirents(&mut data, DirentOrder::Disk)).unwrap();
+        assert_eq!(scanned.len(), names.len());
+    }
+}
@@ -0,0 +1,316 @@
+use alloc::vec::Vec;
+use core::marker::PhantomData;
+
+use crate::blockdev::BlockDeviceRead;
+use crate::layout::{self, DirectoryEntryDiskData};
+use crate::util;
+
+/// Default size of the buffer that `FileReader` reads through
+pub const DEFAULT_STREAM_BUFFER_SIZE: usize = 64 * layout::SECTOR_SIZE as usize;
+
+/// Reads the data region of a file through a bounded, reusable buffer.
+///
+/// Memory use is capped by the buffer size regardless of the file size,
+/// and seeking only moves the read position, so reads after a seek touch
+/// just the part of the file that is requested.
+///
+/// Async callers can consume the file with `next_chunk` or `read_some`. With the
+/// `std` feature, the reader also implements `std::io::Read`, `BufRead` and
+/// `Seek` for devices that complete their reads immediately.
+pub struct FileReader<'a, D: ?Sized, E> {
+    dev: &'a mut D,
+    offset: u64,
+    size: u64,
+    pos: u64,
+
+    buffer: Vec<u8>,
+    buffer_pos: u64,
+    buffer_len: usize,
+
+    _e: PhantomData<E>,
+}
+
+impl<'a, D, E> FileReader<'a, D, E>
+where
+    D: BlockDeviceRead<E> + ?Sized,
+{
+    pub fn new(dev: &'a mut D, dirent: &DirectoryEntryDiskData) -> Result<Self, util::Error<E>> {
+        Self::with_buffer_size(dev, dirent, DEFAULT_STREAM_BUFFER_SIZE)
+    }
+
+    /// Creates a reader that holds at most `buffer_size` bytes of the file at a time
+    pub fn with_buffer_size(
+        dev: &'a mut D,
+        dirent: &DirectoryEntryDiskData,
+        buffer_size: usize,
+    ) -> Result<Self, util::Error<E>> {
+        let size = dirent.data.size as u64;
+        let offset = if size == 0 { 0 } else { dirent.data.offset(0)? };
+
+        let buffer_size = buffer_size.max(1).min(size as usize);
+        Ok(Self {
+            dev,
+            offset,
+            size,
+            pos: 0,
+            buffer: alloc::vec![0; buffer_size],
+            buffer_pos: 0,
+            buffer_len: 0,
+            _e: PhantomData,
+        })
+    }
+
+    /// Size of the file in bytes
+    pub fn len(&self) -> u64 {
+        self.size
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.size == 0
+    }
+
+    /// Current position within the file
+    pub fn position(&self) -> u64 {
+        self.pos
+    }
+
+    /// Number of bytes left between the current position and the end of the file
+    pub fn remaining(&self) -> u64 {
+        self.size.saturating_sub(self.pos)
+    }
+
+    /// Moves the read position to `pos` bytes from the start of the file.
+    /// Positions past the end of the file are allowed, and read nothing.
+    pub fn set_position(&mut self, pos: u64) {
+        self.pos = pos;
+    }
+
+    /// Returns the range of the buffer holding data at the current position,
+    /// reading the next window of the file if the position is not buffered
+    async fn fill(&mut self) -> Result<core::ops::Range<usize>, util::Error<E>> {
+        if self.pos >= self.size {
+            return Ok(0..0);
+        }
+
+        let buffer_end = self.buffer_pos + self.buffer_len as u64;
+        if self.pos < self.buffer_pos || self.pos >= buffer_end {
+            let len = self.buffer.len().min(self.remaining() as usize);
+            self.dev
+                .read(self.offset + self.pos, &mut self.buffer[0..len])
+                .await
+                .map_err(|e| util::Error::IOError(e))?;
+            self.buffer_pos = self.pos;
+            self.buffer_len = len;
+        }
+
+        let start = (self.pos - self.buffer_pos) as usize;
+        Ok(start..self.buffer_len)
+    }
+
+    /// Advances the read position by `amount` bytes without reading them
+    pub fn skip(&mut self, amount: usize) {
+        self.pos = self.pos.saturating_add(amount as u64);
+    }
+
+    /// Returns the next chunk of the file, of at most the buffer size,
+    /// or None once the end of the file is reached
+    pub async fn next_chunk(&mut self) -> Result<Option<&[u8]>, util::Error<E>> {
+        let range = self.fill().await?;
+        if range.is_empty() {
+            return Ok(None);
+        }
+
+        self.pos += range.len() as u64;
+        Ok(Some(&self.buffer[range]))
+    }
+
+    /// Reads from the current position into `buf`, returning the number of bytes read.
+    ///
+    /// Reads that are at least as large as the buffer bypass it and go to the device directly.
+    pub async fn read_some(&mut self, buf: &mut [u8]) -> Result<usize, util::Error<E>> {
+        let len = buf.len().min(self.remaining() as usize);
+        if len == 0 {
+            return Ok(0);
+        }
+
+        let buffered =
+            self.pos >= self.buffer_pos && self.pos < self.buffer_pos + self.buffer_len as u64;
+        if !buffered && len >= self.buffer.len() {
+            self.dev
+                .read(self.offset + self.pos, &mut buf[0..len])
+                .await
+                .map_err(|e| util::Error::IOError(e))?;
+            self.pos += len as u64;
+            return Ok(len);
+        }
+
+        let range = self.fill().await?;
+        let len = len.min(range.len());
+        buf[0..len].copy_from_slice(&self.buffer[range.start..range.start + len]);
+        self.pos += len as u64;
+        Ok(len)
+    }
+}
+
+impl DirectoryEntryDiskData {
+    /// Opens a streaming reader over this entry's data
+    pub fn reader<'a, D, E>(&self, dev: &'a mut D) -> Result<FileReader<'a, D, E>, util::Error<E>>
+    where
+        D: BlockDeviceRead<E> + ?Sized,
+    {
+        FileReader::new(dev, self)
+    }
+}
+
+/// Drives a device future that is expected to complete without waiting,
+/// as the std-backed block devices do
+#[cfg(feature = "std")]
+fn poll_ready<T>(
+    fut: impl core::future::Future<Output = Result<T, util::Error<std::io::Error>>>,
+) -> std::io::Result<T> {
+    use core::task::{Context, Poll, Waker};
+
+    let mut fut = core::pin::pin!(fut);
+    let mut cx = Context::from_waker(Waker::noop());
+    match fut.as_mut().poll(&mut cx) {
+        Poll::Ready(Ok(val)) => Ok(val),
+        Poll::Ready(Err(util::Error::IOError(e))) => Err(e),
+        Poll::Ready(Err(e)) => Err(std::io::Error::new(
+            std::io::ErrorKind::InvalidData,
+            alloc::string::String::from(e),
+        )),
+        Poll::Pending => Err(std::io::ErrorKind::WouldBlock.into()),
+    }
+}
+
+#[cfg(feature = "std")]
+impl<D> std::io::Read for FileReader<'_, D, std::io::Error>
+where
+    D: BlockDeviceRead<std::io::Error> + ?Sized,
+{
+    fn read(&mut self, buf: &mut [u8]) -> std::io::Result<usize> {
+        poll_ready(self.read_some(buf))
+    }
+}
+
+#[cfg(feature = "std")]
+impl<D> std::io::BufRead for FileReader<'_, D, std::io::Error>
+where
+    D: BlockDeviceRead<std::io::Error> + ?Sized,
+{
+    fn fill_buf(&mut self) -> std::io::Result<&[u8]> {
+        let range = poll_ready(self.fill())?;
+        Ok(&self.buffer[range])
+    }
+
+    fn consume(&mut self, amount: usize) {
+        self.skip(amount)
+    }
+}
+
+#[cfg(feature = "std")]
+impl<D, E> std::io::Seek for FileReader<'_, D, E>
+where
+    D: BlockDeviceRead<E> + ?Sized,
+{
+    fn seek(&mut self, pos: std::io::SeekFrom) -> std::io::Result<u64> {
+        use std::io::SeekFrom;
+
+        let pos = match pos {
+            SeekFrom::Start(pos) => Some(pos),
+            SeekFrom::Current(delta) => self.pos.checked_add_signed(delta),
+            SeekFrom::End(delta) => self.size.checked_add_signed(delta),
+        };
+
+        self.pos = pos.ok_or_else(|| std::io::Error::from(std::io::ErrorKind::InvalidInput))?;
+        Ok(self.pos)
+    }
+}
+
+#[cfg(test)]
+mod test {
+    use alloc::vec::Vec;
+    use futures::executor;
+
+    use super::FileReader;
+    use crate::layout::{DirectoryEntryDiskData, DirentAttributes, DiskRegion, SECTOR_SIZE};
+
+    fn image() -> (Vec<u8>, DirectoryEntryDiskData) {
+        let image: Vec<u8> = (0..8 * SECTOR_SIZE as usize)
+            .map(|i| (i % 251) as u8)
+            .collect();
+        let dirent = DirectoryEntryDiskData {
+            data: DiskRegion {
+                sector: 2,
+                size: 3 * SECTOR_SIZE as u32 + 100,
+            },
+            attributes: DirentAttributes(0),
+            filename_length: 0,
+        };
+
+        (image, dirent)
+    }
+
+    #[test]
+    fn test_stream_chunks() {
+        let (mut image, dirent) = image();
+        let start = 2 * SECTOR_SIZE as usize;
+        let expected = image[start..start + dirent.data.size as usize].to_vec();
+
+        let mut reader = FileReader::with_buffer_size(&mut image, &dirent, 1000).unwrap();
+        let mut data = Vec::new();
+        while let Some(chunk) = executor::block_on(reader.next_chunk()).unwrap() {
+            assert!(chunk.len() <= 1000);
+            data.extend_from_slice(chunk);
+        }
+
+        assert_eq!(data, expected);
+        assert_eq!(reader.remaining(), 0);
+    }
+
+    #[cfg(feature = "std")]
+    #[test]
+    fn test_stream_read_and_seek() {
+        use std::io::{Read, Seek, SeekFrom};
+
+        let file: Vec<u8> = (0..8 * SECTOR_SIZE as usize)
+            .map(|i| (i % 251) as u8)
+            .collect();
+        let mut dev = std::io::Cursor::new(file.clone());
+        let (_, dirent) = image();
+        let start = 2 * SECTOR_SIZE as usize;
+        let end = start + dirent.data.size as usize;
+
+        let mut reader = dirent.reader(&mut dev).unwrap();
+        let mut data = Vec::new();
+        reader.read_to_end(&mut data).unwrap();
+        assert_eq!(data, &file[start..end]);
+
+        assert_eq!(
+            reader.seek(SeekFrom::End(-10)).unwrap(),
+            end as u64 - start as u64 - 10
+        );
+        let mut tail = [0; 32];
+        assert_eq!(reader.read(&mut tail).unwrap(), 10);
+        assert_eq!(&tail[0..10], &file[end - 10..end]);
+
+        reader.seek(SeekFrom::Start(5000)).unwrap();
+        let mut mid = [0; 16];
+        reader.read_exact(&mut mid).unwrap();
+        assert_eq!(&mid, &file[start + 5000..start + 5016]);
+    }
+
+    #[test]
+    fn test_stream_empty() {
+        let mut image = [0u8; 8];
+        let dirent = DirectoryEntryDiskData {
+            data: DiskRegion { sector: 0, size: 0 },
+            attributes: DirentAttributes(0),
+            filename_length: 0,
+        };
+
+        let mut reader = FileReader::new(&mut image, &dirent).unwrap();
+        assert!(reader.is_empty());
+        assert!(executor::block_on(reader.next_chunk()).unwrap().is_none());
+    }
+}
@@ -0,0 +1,391 @@
+use alloc::string::String;
+use alloc::vec;
+use alloc::vec::Vec;
+
+use crate::blockdev::BlockDeviceRead;
+use crate::layout::{
+    DirectoryEntryDiskData, DirectoryEntryDiskNode, DirectoryEntryNode, DirectoryEntryTable,
+    DirectoryEntryView, DirentAttributes, DiskRegion,
+};
+use crate::util;
+
+use super::DirentOrder;
+
+/// Parent index of entries in the root directory
+pub const NO_PARENT: u32 = u32::MAX;
+
+/// Listing of every directory entry below a directory entry table,
+/// stored as parallel arrays rather than one `DirectoryEntryNode` per entry.
+///
+/// Names are kept in a single blob, and each entry only stores the index of
+/// its parent directory. Full paths are reconstructed on demand.
+/// Entries are kept in the same order as `DirectoryEntryTable::file_tree`,
+/// so a directory always precedes its children.
+#[derive(Clone, Debug, Default, Eq, PartialEq)]
+pub struct FileTree {
+    parents: Vec<u32>,
+    sectors: Vec<u32>,
+    sizes: Vec<u32>,
+    attributes: Vec<u8>,
+    name_ends: Vec<u32>,
+    names: Vec<u8>,
+}
+
+impl FileTree {
+    pub fn new() -> Self {
+        Self::default()
+    }
+
+    /// Returns the number of entries in the tree
+    pub fn len(&self) -> usize {
+        self.parents.len()
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.parents.is_empty()
+    }
+
+    /// Appends an entry below the directory at index `parent`,
+    /// or `NO_PARENT` for the root directory. Returns the index of the new entry.
+    pub fn push<E>(
+        &mut self,
+        parent: u32,
+        dirent: &DirectoryEntryView,
+    ) -> Result<u32, util::Error<E>> {
+        let idx: u32 = self
+            .len()
+            .try_into()
+            .ok()
+            .filter(|idx| *idx != NO_PARENT)
+            .ok_or(util::Error::TooManyDirectoryEntries)?;
+        if parent != NO_PARENT && parent >= idx {
+            return Err(util::Error::DoesNotExist);
+        }
+
+        let name = dirent.name_slice();
+        let name_end: u32 = (self.names.len() + name.len())
+            .try_into()
+            .map_err(|_| util::Error::TooManyDirectoryEntries)?;
+
+        let data = dirent.node.dirent.data;
+        self.parents.push(parent);
+        self.sectors.push(data.sector);
+        self.sizes.push(data.size);
+        self.attributes.push(dirent.node.dirent.attributes.0);
+        self.name_ends.push(name_end);
+        self.names.extend_from_slice(name);
+
+        Ok(idx)
+    }
+
+    /// Parent directory indices of every entry, `NO_PARENT` for the root directory
+    pub fn parents(&self) -> &[u32] {
+        &self.parents
+    }
+
+    /// Starting sectors of every entry
+    pub fn sectors(&self) -> &[u32] {
+        &self.sectors
+    }
+
+    /// Data sizes of every entry
+    pub fn sizes(&self) -> &[u32] {
+        &self.sizes
+    }
+
+    /// Raw attribute bits of every entry
+    pub fn attributes(&self) -> &[u8] {
+        &self.attributes
+    }
+
+    /// Returns the index of the directory containing entry `idx`,
+    /// or None if it is in the root directory
+    pub fn parent(&self, idx: usize) -> Option<usize> {
+        match self.parents[idx] {
+            NO_PARENT => None,
+            parent => Some(parent as usize),
+        }
+    }
+
+    pub fn region(&self, idx: usize) -> DiskRegion {
+        DiskRegion {
+            sector: self.sectors[idx],
+            size: self.sizes[idx],
+        }
+    }
+
+    pub fn is_directory(&self, idx: usize) -> bool {
+        DirentAttributes(self.attributes[idx]).directory()
+    }
+
+    pub fn name_slice(&self, idx: usize) -> &[u8] {
+        let start = match idx {
+            0 => 0,
+            idx => self.name_ends[idx - 1] as usize,
+        };
+
+        &self.names[start..self.name_ends[idx] as usize]
+    }
+
+    /// Returns a UTF-8 encoded representation of the name of entry `idx`
+    pub fn name_str<E>(&self, idx: usize) -> Result<alloc::borrow::Cow<'_, str>, util::Error<E>> {
+        encoding_rs::WINDOWS_1252
+            .decode_without_bom_handling_and_without_replacement(self.name_slice(idx))
+            .ok_or(util::Error::StringEncodingError)
+    }
+
+    /// Reconstructs the directory entry at index `idx`.
+    ///
+    /// The tree does not keep the left and right child offsets,
+    /// which are only meaningful within a directory entry table, so they are zeroed.
+    pub fn dirent(&self, idx: usize) -> DirectoryEntryNode {
+        let name = self.name_slice(idx);
+        let mut dirent = DirectoryEntryNode {
+            node: DirectoryEntryDiskNode {
+                left_entry_offset: 0,
+                right_entry_offset: 0,
+                dirent: DirectoryEntryDiskData {
+                    data: self.region(idx),
+                    attributes: DirentAttributes(self.attributes[idx]),
+                    filename_length: name.len() as u8,
+                },
+            },
+            name: [0; 256],
+        };
+
+        dirent.name[0..name.len()].copy_from_slice(name);
+        dirent
+    }
+
+    /// Returns the names of each directory leading to entry `idx`,
+    /// followed by the name of the entry itself
+    pub fn path_segments<E>(&self, idx: usize) -> Result<Vec<String>, util::Error<E>> {
+        let mut segments = Vec::new();
+        let mut idx = Some(idx);
+        while let Some(current) = idx {
+            segments.push(self.name_str(current)?.into_owned());
+            idx = self.parent(current);
+        }
+
+        segments.reverse();
+        Ok(segments)
+    }
+
+    /// Returns the full path of entry `idx`, e.g. `/Dir/file.bin`
+    pub fn path<E>(&self, idx: usize) -> Result<String, util::Error<E>> {
+        let mut path = String::new();
+        for segment in self.path_segments(idx)? {
+            path.push('/');
+            path.push_str(&segment);
+        }
+
+        Ok(path)
+    }
+
+    /// Returns the path of the directory containing entry `idx`,
+    /// in the same format as `DirectoryEntryTable::file_tree`
+    pub fn parent_path<E>(&self, idx: usize) -> Result<String, util::Error<E>> {
+        match self.parent(idx) {
+            Some(parent) => self.path(parent),
+            None => Ok(String::new()),
+        }
+    }
+
+    /// Returns the indices of the entries directly within the directory
+    /// at index `parent`, or `NO_PARENT` for the root directory
+    pub fn children(&self, parent: u32) -> impl Iterator<Item = usize> + '_ {
+        self.parents
+            .iter()
+            .enumerate()
+            .filter(move |(_, p)| **p == parent)
+            .map(|(idx, _)| idx)
+    }
+
+    /// Returns the indices of every entry, ordered by starting sector
+    pub fn sector_order(&self) -> Vec<usize> {
+        let mut order: Vec<usize> = (0..self.len()).collect();
+        order.sort_by_key(|idx| self.sectors[*idx]);
+        order
+    }
+
+    /// Expands the tree into the format returned by `DirectoryEntryTable::file_tree`
+    pub fn to_file_tree<E>(&self) -> Result<Vec<(String, DirectoryEntryNode)>, util::Error<E>> {
+        // Directories precede their children, so each directory path is built once
+        let mut dir_paths: Vec<Option<String>> = vec![None; self.len()];
+        let mut tree = Vec::with_capacity(self.len());
+        for idx in 0..self.len() {
+            let parent_path = match self.parent(idx) {
+                Some(parent) => dir_paths[parent]
+                    .clone()
+                    .ok_or(util::Error::IsNotDirectory)?,
+                None => String::new(),
+            };
+
+            if self.is_directory(idx) {
+                let mut path = parent_path.clone();
+                path.push('/');
+                path.push_str(&self.name_str(idx)?);
+                dir_paths[idx] = Some(path);
+            }
+
+            tree.push((parent_path, self.dirent(idx)));
+        }
+
+        Ok(tree)
+    }
+
+    pub(super) fn name_ends(&self) -> &[u32] {
+        &self.name_ends
+    }
+
+    pub(super) fn names(&self) -> &[u8] {
+        &self.names
+    }
+
+    /// Assembles a tree from its columns, checking that they are consistent
+    pub(super) fn from_parts(
+        parents: Vec<u32>,
+        sectors: Vec<u32>,
+        sizes: Vec<u32>,
+        attributes: Vec<u8>,
+        name_ends: Vec<u32>,
+        names: Vec<u8>,
+    ) -> Option<Self> {
+        let len = parents.len();
+        if [
+            sectors.len(),
+            sizes.len(),
+            attributes.len(),
+            name_ends.len(),
+        ]
+        .iter()
+        .any(|l| *l != len)
+        {
+            return None;
+        }
+
+        let parents_valid = parents
+            .iter()
+            .enumerate()
+            .all(|(idx, parent)| *parent == NO_PARENT || (*parent as usize) < idx);
+        let mut start = 0;
+        let names_valid = name_ends.iter().all(|end| {
+            let valid = *end >= start && *end - start <= 0xff;
+            start = *end;
+            valid
+        });
+        if !parents_valid || !names_valid || start as usize != names.len() {
+            return None;
+        }
+
+        Some(Self {
+            parents,
+            sectors,
+            sizes,
+            attributes,
+            name_ends,
+            names,
+        })
+    }
+}
+
+impl DirectoryEntryTable {
+    /// Recursively lists all directory entries below this table into a `FileTree`.
+    /// Each table is listed in the given order.
+    pub async fn compact_file_tree<E>(
+        &self,
+        dev: &mut impl BlockDeviceRead<E>,
+        order: DirentOrder,
+    ) -> Result<FileTree, util::Error<E>> {
+        let mut tree = FileTree::new();
+        if self.is_empty() {
+            return Ok(tree);
+        }
+
+        let mut stack = vec![(NO_PARENT, self.load(dev).await?)];
+        while let Some((parent, loaded)) = stack.pop() {
+            let mut subdirs = Vec::new();
+            let mut tables = Vec::new();
+            for child in loaded.dirent_views(order)?.iter() {
+                let idx = tree.push(parent, child)?;
+                if let Some(dirent_table) = child.node.dirent.dirent_table() {
+                    if !dirent_table.is_empty() {
+                        subdirs.push(idx);
+                        tables.push(dirent_table);
+                    }
+                }
+            }
+
+            // Load every subdirectory of this directory in one batch
+            let loaded = DirectoryEntryTable::load_many(dev, &tables).await?;
+            stack.extend(subdirs.into_iter().zip(loaded));
+        }
+
+        Ok(tree)
+    }
+}
+
+#[cfg(all(test, feature = "write"))]
+mod test {
+    use alloc::vec::Vec;
+    use futures::executor;
+
+    use super::{FileTree, NO_PARENT};
+    use crate::blockdev::OutOfBounds;
+    use crate::read::test::nested_image;
+    use crate::read::DirentOrder;
+
+    #[test]
+    fn test_compact_tree_matches_file_tree() {
+        let (mut image, root) = nested_image();
+        let expected = executor::block_on(root.file_tree(&mut image)).unwrap();
+        let tree =
+            executor::block_on(root.compact_file_tree(&mut image, DirentOrder::Tree)).unwrap();
+
+        let actual = tree.to_file_tree::<OutOfBounds>().unwrap();
+        assert_eq!(expected.len(), actual.len());
+        for ((dir_a, node_a), (dir_b, node_b)) in expected.iter().zip(actual.iter()) {
+            assert_eq!(dir_a, dir_b);
+            assert_eq!(node_a.name_slice(), node_b.name_slice());
+            assert_eq!(node_a.node.dirent, node_b.node.dirent);
+        }
+
+        let file = (0..tree.len())
+            .find(|idx| tree.name_slice(*idx) == b"file.bin")
+            .unwrap();
+        assert_eq!(tree.path::<OutOfBounds>(file).unwrap(), "/Dir/file.bin");
+        assert_eq!(tree.parent_path::<OutOfBounds>(file).unwrap(), "/Dir");
+        assert_eq!(tree.sizes()[file], 16);
+        assert_eq!(tree.children(NO_PARENT).count(), 2);
+
+        let order = tree.sector_order();
+        assert!(order
+            .windows(2)
+            .all(|w| tree.sectors()[w[0]] <= tree.sectors()[w[1]]));
+    }
+
+    #[test]
+    fn test_compact_tree_rejects_bad_parents() {
+        let (mut image, root) = nested_image();
+        let dirent = executor::block_on(root.walk_path(&mut image, "/top.xbe")).unwrap();
+
+        let mut tree = FileTree::new();
+        assert!(tree.push::<OutOfBounds>(0, &dirent.view()).is_err());
+        assert_eq!(
+            tree.push::<OutOfBounds>(NO_PARENT, &dirent.view()).unwrap(),
+            0
+        );
+        assert!(tree.push::<OutOfBounds>(1, &dirent.view()).is_err());
+
+        let parts: Vec<u32> = Vec::from([1]);
+        assert!(FileTree::from_parts(
+            parts.clone(),
+            parts.clone(),
+            parts.clone(),
+            Vec::from([0]),
+            parts,
+            Vec::from([b'a']),
+        )
+        .is_none());
+    }
+}
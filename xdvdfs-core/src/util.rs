@@ -15,6 +15,7 @@ pub enum Error<E> {
     NameTooLong,
     InvalidFileName,
     TooManyDirectoryEntries,
+    InvalidIndex,
     Unexpected(alloc::string::String),
 }
 
@@ -33,6 +34,7 @@ impl<E> Error<E> {
             Self::NameTooLong => "File name is too long",
             Self::InvalidFileName => "Invalid file name",
             Self::TooManyDirectoryEntries => "Too many entries in directory",
+            Self::InvalidIndex => "Invalid or unsupported index file",
             Self::Unexpected(_) => "Unexpected error",
         }
     }
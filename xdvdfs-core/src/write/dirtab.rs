@@ -21,6 +21,7 @@ pub struct DirectoryEntryTableWriter {
 pub struct FileListingEntry {
     pub name: String,
     pub sector: u64,
+    pub size: u64,
     pub is_dir: bool,
 }
 
@@ -122,8 +123,19 @@ impl DirectoryEntryTableWriter {
     /// Returns a byte slice representing the on-disk directory entry table,
     /// and a mapping of files to allocated sectors
     pub fn disk_repr<E>(
-        mut self,
+        self,
         allocator: &mut SectorAllocator,
+    ) -> Result<DirectoryEntryTableDiskRepr, util::Error<E>> {
+        self.disk_repr_with(|_, dirent| allocator.allocate_contiguous(dirent.data.size as u64))
+    }
+
+    /// Like `disk_repr`, but the sector of each entry is chosen by `allocate`,
+    /// which is called with the entry name and its dirent.
+    /// This lets an `AllocationPolicy` place entries, and entries with identical
+    /// contents share one region.
+    pub fn disk_repr_with<E>(
+        mut self,
+        mut allocate: impl FnMut(&str, &DirectoryEntryDiskData) -> u64,
     ) -> Result<DirectoryEntryTableDiskRepr, util::Error<E>> {
         self.table.reorder_backing_preorder();
 
@@ -181,12 +193,13 @@ impl DirectoryEntryTableWriter {
                 dirent,
             };
 
-            let sector = allocator.allocate_contiguous(dirent.dirent.data.size as u64);
+            let sector = allocate(node.data().name_str(), &dirent.dirent);
             dirent.dirent.data.sector = sector.try_into().or_unexpected()?;
 
             file_listing.push(FileListingEntry {
                 name: node.data().name_str().to_string(),
                 sector,
+                size: dirent.dirent.data.size as u64,
                 is_dir: dirent.dirent.attributes.directory(),
             });
 
@@ -31,6 +31,37 @@ pub trait Filesystem<RawHandle: BlockDeviceWrite<E>, E> {
     /// Read a directory, and return a list of entries within it
     async fn read_dir(&mut self, path: &Path) -> Result<Vec<FileEntry>, E>;
 
+    /// Returns a recursive listing of paths in reverse order
+    /// e.g. for a path hierarchy like this:
+    /// /
+    /// -- /a
+    /// -- -- /a/b
+    /// -- /b
+    /// It might return the list: ["/b", "/a/b", "/a", "/"]
+    ///
+    /// Every directory is listed after all of its subdirectories.
+    async fn read_dir_tree(&mut self, root: &Path) -> Result<Vec<DirectoryTreeEntry>, E> {
+        let mut dirs = alloc::vec![PathBuf::from(root)];
+
+        let mut out = Vec::new();
+
+        while let Some(dir) = dirs.pop() {
+            let listing = self.read_dir(&dir).await?;
+
+            for entry in listing.iter() {
+                if let FileType::Directory = entry.file_type {
+                    dirs.push(entry.path.clone());
+                }
+            }
+
+            out.push(DirectoryTreeEntry { dir, listing });
+        }
+
+        // FIXME: Remove this and just use a reverse iterator
+        out.reverse();
+        Ok(out)
+    }
+
     /// Copy the entire contents of file `src` into `dest` at the specified offset
     async fn copy_file_in(
         &mut self,
@@ -38,10 +69,512 @@ pub trait Filesystem<RawHandle: BlockDeviceWrite<E>, E> {
         dest: &mut RawHandle,
         offset: u64,
     ) -> Result<u64, E>;
+
+    /// Groups the files in `files` whose contents are identical, so that each group can
+    /// share one region of the image. Every group holds at least two paths.
+    ///
+    /// The default finds no duplicates.
+    async fn find_duplicates(&mut self, _files: &[&FileEntry]) -> Result<Vec<Vec<PathBuf>>, E> {
+        Ok(Vec::new())
+    }
+
+    /// Copy each file in `files` into `dest` at the offset paired with it,
+    /// calling `progress` with the index of each file once it has been copied.
+    /// Each buffer in `tables` is written at its offset between the files.
+    ///
+    /// Both lists are sorted by offset, and `dest` is written in ascending offset order.
+    /// Every file is given in one call, so an implementation may read ahead of the file
+    /// being written.
+    async fn copy_files_in(
+        &mut self,
+        files: &[(PathBuf, u64)],
+        tables: &[(u64, &[u8])],
+        dest: &mut RawHandle,
+        progress: &dyn Fn(usize),
+    ) -> Result<(), E> {
+        let mut tables = tables;
+        for (idx, (src, offset)) in files.iter().enumerate() {
+            let (before, after) = tables.split_at(tables.partition_point(|(o, _)| o < offset));
+            for (table_offset, table) in before {
+                dest.write(*table_offset, table).await?;
+            }
+
+            tables = after;
+            self.copy_file_in(src, dest, *offset).await?;
+            progress(idx);
+        }
+
+        for (offset, table) in tables {
+            dest.write(*offset, table).await?;
+        }
+
+        Ok(())
+    }
+}
+
+/// Default size of each buffer used to copy files into an image
+#[cfg(not(target_family = "wasm"))]
+pub const DEFAULT_COPY_BUFFER_SIZE: usize = 1024 * 1024;
+
+/// Default number of buffers each reader thread can fill ahead of the writer
+#[cfg(not(target_family = "wasm"))]
+pub const DEFAULT_COPY_BUFFERS: usize = 4;
+
+/// Default number of threads reading source files ahead of the writer
+#[cfg(not(target_family = "wasm"))]
+pub const DEFAULT_READ_THREADS: usize = 2;
+
+#[cfg(not(target_family = "wasm"))]
+pub struct StdFilesystem {
+    buffer_size: usize,
+    buffers: usize,
+    read_threads: usize,
+    dedup: bool,
+}
+
+#[cfg(not(target_family = "wasm"))]
+impl Default for StdFilesystem {
+    fn default() -> Self {
+        Self {
+            buffer_size: DEFAULT_COPY_BUFFER_SIZE,
+            buffers: DEFAULT_COPY_BUFFERS,
+            read_threads: DEFAULT_READ_THREADS,
+            dedup: false,
+        }
+    }
+}
+
+#[cfg(not(target_family = "wasm"))]
+impl StdFilesystem {
+    pub fn new() -> Self {
+        Self::default()
+    }
+
+    /// Copies files through `count` buffers of `size` bytes per reader thread
+    pub fn with_copy_buffers(mut self, size: usize, count: usize) -> Self {
+        self.buffer_size = size.max(1);
+        self.buffers = count.max(1);
+        self
+    }
+
+    /// Sets the number of threads that read source files ahead of the writer
+    pub fn with_read_threads(mut self, threads: usize) -> Self {
+        self.read_threads = threads.max(1);
+        self
+    }
+
+    /// Enables `find_duplicates`, which reads every file that shares its size with another
+    pub fn with_dedup(mut self, dedup: bool) -> Self {
+        self.dedup = dedup;
+        self
+    }
+}
+
+/// Number of threads that list directories in parallel when scanning a source tree.
+/// Scanning is bound by I/O latency, so this is not tied to the number of CPUs.
+#[cfg(not(target_family = "wasm"))]
+const SCAN_THREADS: usize = 16;
+
+#[cfg(not(target_family = "wasm"))]
+fn std_read_dir(dir: &Path) -> std::io::Result<Vec<FileEntry>> {
+    use std::io;
+
+    let mut listing = Vec::new();
+    for de in std::fs::read_dir(dir)? {
+        let de = de?;
+
+        // The entry type usually comes from the directory listing itself,
+        // so only files need a stat call, made relative to the directory
+        let file_type = de.file_type()?;
+        let (file_type, len) = if file_type.is_dir() {
+            (FileType::Directory, 0)
+        } else if file_type.is_file() {
+            (FileType::File, de.metadata()?.len())
+        } else {
+            return Err(io::Error::from(io::ErrorKind::Unsupported));
+        };
+
+        listing.push(FileEntry {
+            path: de.path(),
+            file_type,
+            len,
+        });
+    }
+
+    Ok(listing)
+}
+
+/// Lists the directory tree under `root`, reading up to `threads` directories at once.
+/// Directories are returned deepest first, so each comes after its subdirectories.
+#[cfg(not(target_family = "wasm"))]
+fn std_scan_dir_tree(root: &Path, threads: usize) -> std::io::Result<Vec<DirectoryTreeEntry>> {
+    use std::sync::{Condvar, Mutex};
+
+    struct ScanState {
+        pending: Vec<PathBuf>,
+        active: usize,
+        error: Option<std::io::Error>,
+        out: Vec<DirectoryTreeEntry>,
+    }
+
+    let state = Mutex::new(ScanState {
+        pending: alloc::vec![PathBuf::from(root)],
+        active: 0,
+        error: None,
+        out: Vec::new(),
+    });
+    let changed = Condvar::new();
+
+    let worker = || loop {
+        let dir = {
+            let mut state = state.lock().unwrap();
+            loop {
+                if state.error.is_some() {
+                    return;
+                }
+
+                if let Some(dir) = state.pending.pop() {
+                    state.active += 1;
+                    break dir;
+                }
+
+                if state.active == 0 {
+                    return;
+                }
+
+                state = changed.wait(state).unwrap();
+            }
+        };
+
+        let listing = std_read_dir(&dir);
+
+        let mut state = state.lock().unwrap();
+        state.active -= 1;
+        match listing {
+            Ok(listing) => {
+                for entry in listing.iter() {
+                    if let FileType::Directory = entry.file_type {
+                        state.pending.push(entry.path.clone());
+                    }
+                }
+
+                state.out.push(DirectoryTreeEntry { dir, listing });
+            }
+            Err(e) => {
+                state.error.get_or_insert(e);
+            }
+        }
+
+        changed.notify_all();
+    };
+
+    std::thread::scope(|s| {
+        for _ in 0..threads.max(1) {
+            s.spawn(worker);
+        }
+    });
+
+    let state = state.into_inner().unwrap();
+    if let Some(e) = state.error {
+        return Err(e);
+    }
+
+    let mut out = state.out;
+    out.sort_by(|a, b| {
+        let depth = |entry: &DirectoryTreeEntry| entry.dir.components().count();
+        depth(b).cmp(&depth(a)).then_with(|| a.dir.cmp(&b.dir))
+    });
+    Ok(out)
+}
+
+#[cfg(not(target_family = "wasm"))]
+fn write_zeros(dest: &mut impl std::io::Write, len: u64) -> std::io::Result<()> {
+    static ZEROS: [u8; 64 * 1024] = [0; 64 * 1024];
+
+    let mut remaining = len;
+    while remaining > 0 {
+        let chunk = remaining.min(ZEROS.len() as u64) as usize;
+        dest.write_all(&ZEROS[0..chunk])?;
+        remaining -= chunk as u64;
+    }
+
+    Ok(())
+}
+
+/// Writes the tables that start before `end`, and removes them from `tables`
+#[cfg(not(target_family = "wasm"))]
+fn write_tables_before(
+    dest: &mut (impl std::io::Write + std::io::Seek),
+    tables: &mut &[(u64, &[u8])],
+    end: u64,
+) -> std::io::Result<()> {
+    let remaining = *tables;
+    let (before, after) = remaining.split_at(remaining.partition_point(|(o, _)| *o < end));
+    for (offset, table) in before {
+        dest.seek(std::io::SeekFrom::Start(*offset))?;
+        dest.write_all(table)?;
+    }
+
+    *tables = after;
+    Ok(())
+}
+
+/// Returns an identity shared by every hard link to the file at `path`
+#[cfg(unix)]
+fn std_file_id(path: &Path) -> std::io::Result<Option<(u64, u64)>> {
+    use std::os::unix::fs::MetadataExt;
+
+    let meta = std::fs::metadata(path)?;
+    Ok(Some((meta.dev(), meta.ino())))
+}
+
+#[cfg(all(not(unix), not(target_family = "wasm")))]
+fn std_file_id(_path: &Path) -> std::io::Result<Option<(u64, u64)>> {
+    Ok(None)
+}
+
+#[cfg(not(target_family = "wasm"))]
+fn std_hash_file(path: &Path, buf: &mut [u8]) -> std::io::Result<u64> {
+    use core::hash::Hasher;
+    use std::io::Read;
+
+    let mut file = std::fs::File::open(path)?;
+    let mut hasher = std::collections::hash_map::DefaultHasher::new();
+    loop {
+        match Read::read(&mut file, buf)? {
+            0 => return Ok(hasher.finish()),
+            n => hasher.write(&buf[0..n]),
+        }
+    }
+}
+
+#[cfg(not(target_family = "wasm"))]
+fn std_same_contents(a: &Path, b: &Path, len: u64, buf_size: usize) -> std::io::Result<bool> {
+    use std::io::Read;
+
+    let (mut a, mut b) = (std::fs::File::open(a)?, std::fs::File::open(b)?);
+    let (mut buf_a, mut buf_b) = (alloc::vec![0; buf_size], alloc::vec![0; buf_size]);
+    let mut remaining = len;
+    while remaining > 0 {
+        let chunk = remaining.min(buf_size as u64) as usize;
+        a.read_exact(&mut buf_a[0..chunk])?;
+        b.read_exact(&mut buf_b[0..chunk])?;
+        if buf_a[0..chunk] != buf_b[0..chunk] {
+            return Ok(false);
+        }
+
+        remaining -= chunk as u64;
+    }
+
+    Ok(true)
+}
+
+/// Groups files with identical contents.
+///
+/// Only files that share a size with another are read. Hard links to one file are
+/// grouped without reading them, and other candidates are hashed, then compared
+/// byte for byte against files with the same hash.
+#[cfg(not(target_family = "wasm"))]
+fn std_find_duplicates(
+    files: &[&FileEntry],
+    buf_size: usize,
+) -> std::io::Result<Vec<Vec<PathBuf>>> {
+    use alloc::collections::BTreeMap;
+
+    let mut by_size: BTreeMap<u64, Vec<&Path>> = BTreeMap::new();
+    for file in files {
+        if let FileType::File = file.file_type {
+            by_size.entry(file.len).or_default().push(&file.path);
+        }
+    }
+
+    let mut buf = alloc::vec![0; buf_size];
+    let mut groups = Vec::new();
+    for (len, paths) in by_size {
+        if paths.len() < 2 {
+            continue;
+        }
+
+        // Links to the same file are merged into one candidate
+        let mut candidates: Vec<Vec<PathBuf>> = Vec::new();
+        let mut by_id: BTreeMap<(u64, u64), usize> = BTreeMap::new();
+        for path in paths {
+            let linked = std_file_id(path)?.and_then(|id| {
+                let next = candidates.len();
+                let idx = *by_id.entry(id).or_insert(next);
+                (idx < next).then_some(idx)
+            });
+
+            match linked {
+                Some(idx) => candidates[idx].push(path.to_path_buf()),
+                None => candidates.push(alloc::vec![path.to_path_buf()]),
+            }
+        }
+
+        // Each hash bucket holds groups of candidates that compared equal
+        let mut by_hash: BTreeMap<u64, Vec<Vec<PathBuf>>> = BTreeMap::new();
+        for candidate in candidates {
+            let hash = std_hash_file(&candidate[0], &mut buf)?;
+            let bucket = by_hash.entry(hash).or_default();
+            let mut matched = None;
+            for (idx, group) in bucket.iter().enumerate() {
+                if std_same_contents(&group[0], &candidate[0], len, buf_size)? {
+                    matched = Some(idx);
+                    break;
+                }
+            }
+
+            match matched {
+                Some(idx) => bucket[idx].extend(candidate),
+                None => bucket.push(candidate),
+            }
+        }
+
+        groups.extend(
+            by_hash
+                .into_values()
+                .flatten()
+                .filter(|group| group.len() > 1),
+        );
+    }
+
+    Ok(groups)
+}
+
+/// Copies `src` into the file `dest` at `offset` without passing it through a buffer,
+/// and returns its length
+#[cfg(not(target_family = "wasm"))]
+fn std_copy_file_range(src: &Path, dest: &std::fs::File, offset: u64) -> std::io::Result<u64> {
+    let src = std::fs::File::open(src)?;
+    let len = src.metadata()?.len();
+    crate::blockdev::copy::copy_range(&src, 0, dest, offset, len)?;
+    Ok(len)
 }
 
+/// A piece of a source file, sent from a reader thread to the writer
 #[cfg(not(target_family = "wasm"))]
-pub struct StdFilesystem;
+enum CopyChunk {
+    Data(Vec<u8>),
+    Zeros(u64),
+    End,
+}
+
+/// Reads `path` into buffers taken from `free`, and sends them to the writer in order
+#[cfg(not(target_family = "wasm"))]
+fn std_read_chunks(
+    path: &Path,
+    buffer_size: usize,
+    tx: &std::sync::mpsc::SyncSender<std::io::Result<CopyChunk>>,
+    free: &std::sync::mpsc::Receiver<Vec<u8>>,
+) -> std::io::Result<()> {
+    use std::io::{self, Read, Seek, SeekFrom};
+
+    // The writer has stopped, so there is nobody left to report an error to
+    fn hung_up<T>(_: T) -> io::Error {
+        io::Error::from(io::ErrorKind::BrokenPipe)
+    }
+
+    let send = |chunk| tx.send(Ok(chunk)).map_err(hung_up);
+
+    let mut file = std::fs::File::open(path)?;
+    let len = file.metadata()?.len();
+
+    // Holes in sparse sources read as zeros, so they are sent without reading them
+    let mut pos = 0;
+    for (start, region_len) in crate::blockdev::sparse::data_regions(&file)? {
+        if start > pos {
+            send(CopyChunk::Zeros(start - pos))?;
+        }
+
+        file.seek(SeekFrom::Start(start))?;
+        let mut remaining = region_len;
+        while remaining > 0 {
+            let mut buf = free.recv().map_err(hung_up)?;
+            buf.resize(remaining.min(buffer_size as u64) as usize, 0);
+            file.read_exact(&mut buf)?;
+            remaining -= buf.len() as u64;
+            send(CopyChunk::Data(buf))?;
+        }
+
+        pos = start + region_len;
+    }
+
+    if len > pos {
+        send(CopyChunk::Zeros(len - pos))?;
+    }
+
+    send(CopyChunk::End)
+}
+
+/// Copies `files` and `tables` into `dest`, while reader threads fill a bounded pool
+/// of buffers with the files that follow the one being written.
+///
+/// Reader `k` reads files `k`, `k + threads`, and so on, so the writer takes each
+/// file from the reader that owns it and writes the files in the order given.
+#[cfg(not(target_family = "wasm"))]
+fn std_copy_files_in<T>(
+    fs: &StdFilesystem,
+    files: &[(PathBuf, u64)],
+    mut tables: &[(u64, &[u8])],
+    dest: &mut T,
+    progress: &dyn Fn(usize),
+) -> std::io::Result<()>
+where
+    T: std::io::Write + std::io::Seek,
+{
+    use std::io::{self, SeekFrom};
+    use std::sync::mpsc;
+
+    let threads = fs.read_threads.clamp(1, files.len().max(1));
+
+    std::thread::scope(|s| {
+        let mut readers = Vec::new();
+        for k in 0..threads {
+            let (tx, rx) = mpsc::sync_channel(fs.buffers);
+            let (free_tx, free) = mpsc::channel();
+            for _ in 0..fs.buffers {
+                // Buffers are allocated on first use, and reused after that
+                let _ = free_tx.send(Vec::new());
+            }
+
+            s.spawn(move || {
+                for (path, _) in files.iter().skip(k).step_by(threads) {
+                    if let Err(e) = std_read_chunks(path, fs.buffer_size, &tx, &free) {
+                        let _ = tx.send(Err(e));
+                        return;
+                    }
+                }
+            });
+
+            readers.push((rx, free_tx));
+        }
+
+        // Returning drops the channels, which stops any reader still running
+        for (idx, (_, offset)) in files.iter().enumerate() {
+            let (rx, free_tx) = &readers[idx % threads];
+            write_tables_before(dest, &mut tables, *offset)?;
+            dest.seek(SeekFrom::Start(*offset))?;
+
+            loop {
+                let chunk = rx
+                    .recv()
+                    .map_err(|_| io::Error::other("file reader stopped unexpectedly"))??;
+                match chunk {
+                    CopyChunk::Data(buf) => {
+                        dest.write_all(&buf)?;
+                        let _ = free_tx.send(buf);
+                    }
+                    CopyChunk::Zeros(len) => write_zeros(dest, len)?,
+                    CopyChunk::End => break,
+                }
+            }
+
+            progress(idx);
+        }
+
+        write_tables_before(dest, &mut tables, u64::MAX)
+    })
+}
 
 #[cfg(not(target_family = "wasm"))]
 #[async_trait(?Send)]
@@ -50,33 +583,25 @@ where
     T: std::io::Write + std::io::Seek + BlockDeviceWrite<std::io::Error>,
 {
     async fn read_dir(&mut self, dir: &Path) -> Result<Vec<FileEntry>, std::io::Error> {
-        use std::fs::DirEntry;
-        use std::io;
+        std_read_dir(dir)
+    }
 
-        let listing: io::Result<Vec<DirEntry>> = std::fs::read_dir(dir)?.collect();
-        let listing: io::Result<Vec<io::Result<FileEntry>>> = listing?
-            .into_iter()
-            .map(|de| {
-                de.metadata().map(|md| {
-                    let file_type = if md.is_dir() {
-                        FileType::Directory
-                    } else if md.is_file() {
-                        FileType::File
-                    } else {
-                        return Err(io::Error::from(io::ErrorKind::Unsupported));
-                    };
-
-                    Ok(FileEntry {
-                        path: de.path(),
-                        file_type,
-                        len: md.len(),
-                    })
-                })
-            })
-            .collect();
+    async fn read_dir_tree(
+        &mut self,
+        root: &Path,
+    ) -> Result<Vec<DirectoryTreeEntry>, std::io::Error> {
+        std_scan_dir_tree(root, SCAN_THREADS)
+    }
 
-        let listing: io::Result<Vec<FileEntry>> = listing?.into_iter().collect();
-        listing
+    async fn find_duplicates(
+        &mut self,
+        files: &[&FileEntry],
+    ) -> Result<Vec<Vec<PathBuf>>, std::io::Error> {
+        if !self.dedup {
+            return Ok(Vec::new());
+        }
+
+        std_find_duplicates(files, self.buffer_size)
     }
 
     async fn copy_file_in(
@@ -85,7 +610,11 @@ where
         dest: &mut T,
         offset: u64,
     ) -> Result<u64, std::io::Error> {
-        use std::io::SeekFrom;
+        use std::io::{Read, Seek, SeekFrom};
+
+        if let Some(dest) = dest.as_file() {
+            return std_copy_file_range(src, dest, offset);
+        }
 
         // FIXME: This is technically a race condition,
         // multiple threads could seek away from this position and corrupt the destination.
@@ -94,8 +623,45 @@ where
         dest.seek(SeekFrom::Start(offset))?;
 
         let file = std::fs::File::open(src)?;
-        let mut file = std::io::BufReader::with_capacity(1024 * 1024, file);
-        std::io::copy(&mut file, dest)
+        let len = file.metadata()?.len();
+        let regions = crate::blockdev::sparse::data_regions(&file)?;
+        let mut file = std::io::BufReader::with_capacity(self.buffer_size, file);
+        if regions[..] == [(0, len)] {
+            return std::io::copy(&mut file, dest);
+        }
+
+        // Holes in sparse sources read as zeros, so they are written out without reading them
+        let mut pos = 0;
+        for (start, region_len) in regions {
+            write_zeros(dest, start - pos)?;
+            file.seek(SeekFrom::Start(start))?;
+            std::io::copy(&mut (&mut file).take(region_len), dest)?;
+            pos = start + region_len;
+        }
+
+        write_zeros(dest, len - pos)?;
+        Ok(len)
+    }
+
+    async fn copy_files_in(
+        &mut self,
+        files: &[(PathBuf, u64)],
+        mut tables: &[(u64, &[u8])],
+        dest: &mut T,
+        progress: &dyn Fn(usize),
+    ) -> Result<(), std::io::Error> {
+        // The kernel reads ahead of a direct copy on its own
+        if let Some(mut dest) = dest.as_file() {
+            for (idx, (src, offset)) in files.iter().enumerate() {
+                write_tables_before(&mut dest, &mut tables, *offset)?;
+                std_copy_file_range(src, dest, *offset)?;
+                progress(idx);
+            }
+
+            return write_tables_before(&mut dest, &mut tables, u64::MAX);
+        }
+
+        std_copy_files_in(self, files, tables, dest, progress)
     }
 }
 
@@ -105,6 +671,8 @@ where
 {
     dev: D,
     volume: crate::layout::VolumeDescriptor,
+    dirent_order: crate::read::DirentOrder,
+    cache: crate::read::cache::DirectoryCache,
     etype: core::marker::PhantomData<E>,
 }
 
@@ -119,12 +687,34 @@ where
             Some(Self {
                 dev,
                 volume,
+                dirent_order: crate::read::DirentOrder::default(),
+                cache: crate::read::cache::DirectoryCache::new(
+                    volume.root_table,
+                    crate::read::cache::DEFAULT_CAPACITY,
+                ),
                 etype: core::marker::PhantomData,
             })
         } else {
             None
         }
     }
+
+    /// Sets the order in which `read_dir` lists directory entries
+    pub fn with_dirent_order(mut self, order: crate::read::DirentOrder) -> Self {
+        self.dirent_order = order;
+        self
+    }
+
+    /// Replaces the directory cache with one that holds at most `capacity` tables
+    pub fn with_cache_capacity(mut self, capacity: usize) -> Self {
+        self.cache = crate::read::cache::DirectoryCache::new(self.volume.root_table, capacity);
+        self
+    }
+
+    /// Returns hit, miss and eviction counts for the directory cache
+    pub fn cache_stats(&self) -> crate::read::cache::CacheStats {
+        self.cache.stats()
+    }
 }
 
 impl<E> From<util::Error<E>> for std::io::Error
@@ -145,22 +735,9 @@ where
 {
     async fn read_dir(&mut self, dir: &Path) -> Result<Vec<FileEntry>, E> {
         let path = dir.to_str().ok_or(util::Error::InvalidFileName)?;
-        let dirtab = if path == "/" {
-            self.volume.root_table
-        } else {
-            let dirent = self
-                .volume
-                .root_table
-                .walk_path(&mut self.dev, path)
-                .await?;
-            dirent
-                .node
-                .dirent
-                .dirent_table()
-                .ok_or(util::Error::IsNotDirectory)?
-        };
+        let dirtab = self.cache.dirent_table(&mut self.dev, path).await?;
 
-        let tree = dirtab.walk_dirent_tree(&mut self.dev).await?;
+        let tree = dirtab.dirents(self.dirent_order)?;
         let entries: Result<Vec<FileEntry>, util::Error<E>> = tree
             .into_iter()
             .map(|dirent| {
@@ -181,11 +758,7 @@ where
 
     async fn copy_file_in(&mut self, src: &Path, dest: &mut W, offset: u64) -> Result<u64, E> {
         let path = src.to_str().ok_or(util::Error::InvalidFileName)?;
-        let dirent = self
-            .volume
-            .root_table
-            .walk_path(&mut self.dev, path)
-            .await?;
+        let dirent = self.cache.walk_path(&mut self.dev, path).await?;
 
         let buf_size = 1024 * 1024;
         let mut buf = alloc::vec![0; buf_size as usize].into_boxed_slice();
@@ -208,3 +781,123 @@ where
         Ok(size as u64)
     }
 }
+
+#[cfg(all(test, not(target_family = "wasm")))]
+mod test {
+    use alloc::vec::Vec;
+    use std::path::PathBuf;
+
+    use super::{
+        std_copy_files_in, std_find_duplicates, std_read_dir, std_scan_dir_tree, FileType,
+        StdFilesystem,
+    };
+
+    #[test]
+    fn test_scan_lists_subdirs_first() {
+        let root = std::env::temp_dir().join(std::format!("xdvdfs-scan-{}", std::process::id()));
+        let dirs = ["a", "a/b", "a/b/c", "d", "d/e", "f"];
+        for dir in dirs {
+            std::fs::create_dir_all(root.join(dir)).unwrap();
+            std::fs::write(root.join(dir).join("file.bin"), dir.as_bytes()).unwrap();
+        }
+
+        let tree = std_scan_dir_tree(&root, 4).unwrap();
+        assert_eq!(tree.len(), dirs.len() + 1);
+
+        let position = |dir: &PathBuf| tree.iter().position(|entry| &entry.dir == dir).unwrap();
+        for entry in &tree {
+            let subdirs: Vec<_> = entry
+                .listing
+                .iter()
+                .filter(|e| matches!(e.file_type, FileType::Directory))
+                .collect();
+            for subdir in subdirs {
+                assert!(position(&subdir.path) < position(&entry.dir));
+            }
+
+            if entry.dir != root {
+                let file = entry.listing.iter().find(|e| e.path.ends_with("file.bin"));
+                let name = entry.dir.strip_prefix(&root).unwrap();
+                assert_eq!(file.unwrap().len, name.as_os_str().len() as u64);
+            }
+        }
+
+        std::fs::remove_dir_all(root).unwrap();
+    }
+
+    #[test]
+    fn test_copy_files_in_order() {
+        let root = std::env::temp_dir().join(std::format!("xdvdfs-copy-in-{}", std::process::id()));
+        std::fs::create_dir_all(&root).unwrap();
+
+        let mut files = Vec::new();
+        let mut offset = 64;
+        for (idx, len) in [5u64, 0, 100, 37, 250].into_iter().enumerate() {
+            let data: Vec<u8> = (0..len).map(|i| (i as usize + idx + 1) as u8).collect();
+            let path = root.join(std::format!("{}.bin", idx));
+            std::fs::write(&path, &data).unwrap();
+
+            files.push((path, offset));
+            offset += len + 3;
+        }
+
+        let fs = StdFilesystem::new()
+            .with_copy_buffers(16, 2)
+            .with_read_threads(3);
+        let mut dest = std::io::Cursor::new(Vec::new());
+        let copied = core::cell::RefCell::new(Vec::new());
+        let tables: [(u64, &[u8]); 2] = [(0, b"head"), (offset, b"tail")];
+        std_copy_files_in(&fs, &files, &tables, &mut dest, &|idx| {
+            copied.borrow_mut().push(idx)
+        })
+        .unwrap();
+
+        let out = dest.into_inner();
+        for (path, offset) in files.iter() {
+            let data = std::fs::read(path).unwrap();
+            let offset = *offset as usize;
+            assert_eq!(&out[offset..offset + data.len()], &data[..]);
+        }
+        for (offset, table) in tables {
+            let offset = offset as usize;
+            assert_eq!(&out[offset..offset + table.len()], table);
+        }
+        assert_eq!(copied.into_inner(), (0..files.len()).collect::<Vec<_>>());
+
+        std::fs::remove_dir_all(root).unwrap();
+    }
+
+    #[test]
+    fn test_find_duplicates() {
+        let root = std::env::temp_dir().join(std::format!("xdvdfs-dedup-{}", std::process::id()));
+        std::fs::create_dir_all(&root).unwrap();
+
+        let data: Vec<u8> = (0..5000).map(|i| (i % 251) as u8).collect();
+        let mut other = data.clone();
+        other[4999] ^= 1;
+        std::fs::write(root.join("a"), &data).unwrap();
+        std::fs::write(root.join("b"), &data).unwrap();
+        std::fs::write(root.join("c"), &other).unwrap();
+        std::fs::write(root.join("d"), b"unique").unwrap();
+        std::fs::hard_link(root.join("c"), root.join("e")).unwrap();
+
+        let listing = std_read_dir(&root).unwrap();
+        let files: Vec<_> = listing.iter().collect();
+        let mut groups = std_find_duplicates(&files, 1024).unwrap();
+        for group in groups.iter_mut() {
+            group.sort();
+        }
+        groups.sort();
+
+        let path = |name: &str| root.join(name);
+        assert_eq!(
+            groups,
+            alloc::vec![
+                alloc::vec![path("a"), path("b")],
+                alloc::vec![path("c"), path("e")],
+            ]
+        );
+
+        std::fs::remove_dir_all(root).unwrap();
+    }
+}
@@ -1,49 +1,19 @@
 use std::path::{Path, PathBuf};
 
-use alloc::collections::BTreeMap;
+use alloc::collections::{BTreeMap, BTreeSet};
+use serde::{Deserialize, Serialize};
 
 use crate::blockdev::BlockDeviceWrite;
 use crate::util::ToUnexpectedError;
+use crate::write::sector::{AllocationPolicy, Region};
 use crate::write::{dirtab, fs, sector};
 use crate::{layout, util};
 
 use alloc::vec;
-use alloc::vec::Vec;
+use alloc::{boxed::Box, vec::Vec};
 
 use super::fs::DirectoryTreeEntry;
 
-/// Returns a recursive listing of paths in reverse order
-/// e.g. for a path hierarchy like this:
-/// /
-/// -- /a
-/// -- -- /a/b
-/// -- /b
-/// It might return the list: ["/b", "/a/b", "/a", "/"]
-async fn dir_tree<H: BlockDeviceWrite<E>, E>(
-    root: &Path,
-    fs: &mut (impl fs::Filesystem<H, E> + ?Sized),
-) -> Result<Vec<fs::DirectoryTreeEntry>, E> {
-    let mut dirs = vec![PathBuf::from(root)];
-
-    let mut out = Vec::new();
-
-    while let Some(dir) = dirs.pop() {
-        let listing = fs.read_dir(&dir).await?;
-
-        for entry in listing.iter() {
-            if let fs::FileType::Directory = entry.file_type {
-                dirs.push(entry.path.clone());
-            }
-        }
-
-        out.push(fs::DirectoryTreeEntry { dir, listing });
-    }
-
-    // FIXME: Remove this and just use a reverse iterator
-    out.reverse();
-    Ok(out)
-}
-
 fn create_dirent_tables<'a, E>(
     dirtree: &'a [DirectoryTreeEntry],
     progress_callback: &impl Fn(ProgressInfo),
@@ -100,80 +70,577 @@ pub enum ProgressInfo {
     FinishedPacking,
 }
 
-pub async fn create_xdvdfs_image<H: BlockDeviceWrite<E>, E>(
+/// A directory entry table placed in an image
+#[derive(Serialize, Deserialize, Debug, Clone)]
+pub struct PlannedDirectory {
+    pub path: PathBuf,
+    pub sector: u64,
+    pub size: u64,
+
+    /// On-disk representation of the table. This is not serialized with the plan,
+    /// so a deserialized plan cannot be written.
+    #[serde(skip)]
+    pub entry_table: Box<[u8]>,
+}
+
+/// A file placed in an image, with the path it is copied from
+#[derive(Serialize, Deserialize, Debug, Clone)]
+pub struct PlannedFile {
+    pub path: PathBuf,
+    pub sector: u64,
+    pub size: u64,
+}
+
+/// Complete layout of an image, computed before anything is written.
+///
+/// Directories and files are sorted by sector.
+#[derive(Serialize, Deserialize, Debug, Clone)]
+pub struct ImagePlan {
+    /// Size in bytes of the finished image, including padding
+    pub image_size: u64,
+    pub root_table: layout::DirectoryEntryTable,
+    pub directories: Vec<PlannedDirectory>,
+    pub files: Vec<PlannedFile>,
+
+    /// Files that share the region of a file in `files`, and are not copied
+    pub duplicates: Vec<PlannedFile>,
+}
+
+impl ImagePlan {
+    /// Checks that every directory table is present, which is not the case
+    /// for plans that were deserialized
+    fn check_tables<E>(&self) -> Result<(), util::Error<E>> {
+        match self
+            .directories
+            .iter()
+            .find(|dir| dir.entry_table.len() as u64 != dir.size)
+        {
+            Some(dir) => Err(util::Error::Unexpected(alloc::format!(
+                "plan is missing the directory table for {:?}",
+                dir.path
+            ))),
+            None => Ok(()),
+        }
+    }
+}
+
+/// Lays out an image of `source_dir` without writing anything,
+/// placing directory tables and files with `policy`.
+///
+/// Reports `FileCount`, `DirAdded`, and `FileAdded` for directories and duplicate files,
+/// as they are placed.
+pub async fn plan_xdvdfs_image<H: BlockDeviceWrite<E>, E>(
     source_dir: &Path,
     fs: &mut (impl fs::Filesystem<H, E> + ?Sized),
-    image: &mut H,
+    policy: &mut (impl AllocationPolicy + ?Sized),
     progress_callback: impl Fn(ProgressInfo),
-) -> Result<(), util::Error<E>> {
+) -> Result<ImagePlan, util::Error<E>> {
     // We need to compute the size of all dirent tables before
     // writing the image. As such, we iterate over a directory tree
     // in reverse order, such that dirents for leaf directories
     // are created before parents. Then, the other dirents can set their size
     // by tabulation.
 
-    let dirtree = dir_tree(source_dir, fs).await?;
+    let dirtree = fs.read_dir_tree(source_dir).await?;
     let dirent_tables = create_dirent_tables(&dirtree, &progress_callback)?;
 
+    // Files with identical contents are placed in one shared region,
+    // which is allocated for the first file of the group
+    let all_files: Vec<&fs::FileEntry> = dirtree
+        .iter()
+        .flat_map(|entry| entry.listing.iter())
+        .collect();
+    let duplicate_groups = fs.find_duplicates(&all_files).await?;
+    let mut duplicate_group: BTreeMap<&Path, usize> = BTreeMap::new();
+    for (idx, group) in duplicate_groups.iter().enumerate() {
+        for path in group {
+            duplicate_group.insert(path, idx);
+        }
+    }
+    let mut group_sectors: Vec<Option<u64>> = vec![None; duplicate_groups.len()];
+
+    // Let the policy see every region that will be allocated
+    let regions: Vec<Region> = dirent_tables
+        .iter()
+        .map(|(path, dirtab)| Region {
+            path,
+            size: dirtab.dirtab_size(),
+            is_dir: true,
+        })
+        .chain(
+            all_files
+                .iter()
+                .filter(|file| matches!(file.file_type, fs::FileType::File))
+                .filter(|file| {
+                    duplicate_group
+                        .get(file.path.as_path())
+                        .is_none_or(|group| duplicate_groups[*group][0] == file.path)
+                })
+                .map(|file| Region {
+                    path: &file.path,
+                    size: file.len,
+                    is_dir: false,
+                }),
+        )
+        .collect();
+    policy.prepare(&regions);
+
     // Now we can forward iterate through the dirtabs and allocate on-disk regions
     let mut dir_sectors: BTreeMap<PathBuf, u64> = BTreeMap::new();
-    let mut sector_allocator = sector::SectorAllocator::default();
 
     let root_dirtab = dirent_tables
         .first_key_value()
         .expect("should always have one dirent at minimum (root)");
     let root_dirtab_size = root_dirtab.1.dirtab_size();
-    let root_sector = sector_allocator.allocate_contiguous(root_dirtab_size);
+    let root_sector = policy.allocate(&Region {
+        path: root_dirtab.0,
+        size: root_dirtab_size,
+        is_dir: true,
+    });
     let root_table = layout::DirectoryEntryTable::new(
         root_dirtab_size.try_into().or_unexpected()?,
         root_sector.try_into().or_unexpected()?,
     );
     dir_sectors.insert(root_dirtab.0.to_path_buf(), root_sector);
 
+    let mut directories: Vec<PlannedDirectory> = Vec::new();
+    let mut files: Vec<PlannedFile> = Vec::new();
+    let mut duplicates: Vec<PlannedFile> = Vec::new();
+    let mut copied_regions: BTreeSet<(u64, u64)> = BTreeSet::new();
+
     for (path, dirtab) in dirent_tables.into_iter() {
         let dirtab_sector = dir_sectors
             .get(path)
             .expect("subdir sector allocation should have been previously computed");
-        let dirtab = dirtab.disk_repr(&mut sector_allocator)?;
-        progress_callback(ProgressInfo::DirAdded(path.to_path_buf(), *dirtab_sector));
+        let dirtab = dirtab.disk_repr_with(|name, dirent| {
+            let entry_path = path.join(name);
+            let is_dir = dirent.is_directory();
+            let group = (!is_dir)
+                .then(|| duplicate_group.get(entry_path.as_path()))
+                .flatten();
 
-        BlockDeviceWrite::write(
-            image,
-            dirtab_sector * layout::SECTOR_SIZE,
-            &dirtab.entry_table,
-        )
-        .await?;
+            let mut allocate = |path: &Path| {
+                policy.allocate(&Region {
+                    path,
+                    size: dirent.data.size as u64,
+                    is_dir,
+                })
+            };
+
+            match group {
+                Some(group) => *group_sectors[*group]
+                    .get_or_insert_with(|| allocate(&duplicate_groups[*group][0])),
+                None => allocate(&entry_path),
+            }
+        })?;
+        progress_callback(ProgressInfo::DirAdded(path.to_path_buf(), *dirtab_sector));
+        directories.push(PlannedDirectory {
+            path: path.to_path_buf(),
+            sector: *dirtab_sector,
+            size: dirtab.entry_table.len() as u64,
+            entry_table: dirtab.entry_table,
+        });
 
         for entry in dirtab.file_listing {
             let file_path = path.join(&entry.name);
-            progress_callback(ProgressInfo::FileAdded(
-                file_path.to_path_buf(),
-                entry.sector,
-            ));
 
             if entry.is_dir {
-                dir_sectors.insert(file_path.clone(), entry.sector);
+                progress_callback(ProgressInfo::FileAdded(file_path.clone(), entry.sector));
+                dir_sectors.insert(file_path, entry.sector);
             } else {
-                fs.copy_file_in(&file_path, image, entry.sector * layout::SECTOR_SIZE)
-                    .await?;
+                let file = PlannedFile {
+                    path: file_path,
+                    sector: entry.sector,
+                    size: entry.size,
+                };
+
+                // Only the first file placed in a shared region is copied.
+                // Empty files may share a sector with anything, as they take up no space.
+                if copied_regions.insert((entry.sector, entry.size)) {
+                    files.push(file);
+                } else {
+                    progress_callback(ProgressInfo::FileAdded(file.path.clone(), file.sector));
+                    duplicates.push(file);
+                }
             }
         }
     }
 
-    // Write volume info to sector 32
+    directories.sort_by_key(|dir| dir.sector);
+    files.sort_by_key(|file| file.sector);
+    duplicates.sort_by_key(|file| file.sector);
+
+    // The image ends with the last byte written, padded to a multiple of 32 sectors
+    let volume_size = core::mem::size_of::<layout::VolumeDescriptor>() as u64;
+    let end = directories
+        .iter()
+        .map(|dir| dir.sector * layout::SECTOR_SIZE + dir.size)
+        .chain(
+            files
+                .iter()
+                .map(|file| file.sector * layout::SECTOR_SIZE + file.size),
+        )
+        .fold(32 * layout::SECTOR_SIZE + volume_size, u64::max);
+    let image_size = end.div_ceil(32 * layout::SECTOR_SIZE) * 32 * layout::SECTOR_SIZE;
+
+    Ok(ImagePlan {
+        image_size,
+        root_table,
+        directories,
+        files,
+        duplicates,
+    })
+}
+
+/// Writes an image laid out by `plan_xdvdfs_image`, copying file data from `fs`.
+///
+/// The image is written in ascending offset order, so it can be streamed to outputs
+/// that cannot seek. Reports `FileAdded` for files as they are copied.
+pub async fn write_xdvdfs_image<H: BlockDeviceWrite<E>, E>(
+    plan: &ImagePlan,
+    fs: &mut (impl fs::Filesystem<H, E> + ?Sized),
+    image: &mut H,
+    progress_callback: impl Fn(ProgressInfo),
+) -> Result<(), util::Error<E>> {
+    plan.check_tables()?;
+
+    // Volume info goes in sector 32, which may follow files placed in the low sectors
     // FIXME: Set timestamp
-    let volume_info = layout::VolumeDescriptor::new(root_table);
+    let volume_info = layout::VolumeDescriptor::new(plan.root_table);
     let volume_info = volume_info.serialize()?;
 
-    BlockDeviceWrite::write(image, 32 * layout::SECTOR_SIZE, &volume_info).await?;
+    let mut tables: Vec<(u64, &[u8])> = plan
+        .directories
+        .iter()
+        .map(|dir| (dir.sector * layout::SECTOR_SIZE, &dir.entry_table[..]))
+        .collect();
+    tables.push((32 * layout::SECTOR_SIZE, &volume_info));
+    tables.sort_by_key(|(offset, _)| *offset);
+
+    // Files are passed on in sector order, so the filesystem can read ahead
+    // of the file being written
+    let files: Vec<(PathBuf, u64)> = plan
+        .files
+        .iter()
+        .map(|file| (file.path.clone(), file.sector * layout::SECTOR_SIZE))
+        .collect();
+
+    // Tables are written between the files, so the filesystem copies every file
+    // in one pass
+    fs.copy_files_in(&files, &tables, image, &|idx| {
+        let (file_path, offset) = &files[idx];
+        progress_callback(ProgressInfo::FileAdded(
+            file_path.clone(),
+            offset / layout::SECTOR_SIZE,
+        ));
+    })
+    .await?;
 
     let len = BlockDeviceWrite::len(image).await?;
-    if len % (32 * 2048) > 0 {
-        let padding = (32 * 2048) - len % (32 * 2048);
-        let padding = vec![0x00; padding.try_into().unwrap()];
+    if len < plan.image_size {
+        let padding = vec![0x00; (plan.image_size - len).try_into().or_unexpected()?];
         BlockDeviceWrite::write(image, len, &padding).await?;
     }
 
+    Ok(())
+}
+
+/// Writes an image laid out by `plan_xdvdfs_image` from host files into `image`,
+/// copying files on `jobs` threads.
+///
+/// Files occupy disjoint regions, so workers copy them with positional writes into the
+/// same file. The directory tables and volume descriptor are written once every file
+/// is in place, and `FileAdded` is reported from the calling thread.
+#[cfg(not(target_family = "wasm"))]
+pub fn write_xdvdfs_image_parallel(
+    plan: &ImagePlan,
+    image: &std::fs::File,
+    jobs: usize,
+    progress_callback: impl Fn(ProgressInfo),
+) -> Result<(), util::Error<std::io::Error>> {
+    use crate::blockdev::copy::copy_range_at;
+    use std::sync::atomic::{AtomicBool, AtomicUsize, Ordering};
+
+    plan.check_tables()?;
+
+    let next = AtomicUsize::new(0);
+    let failed = AtomicBool::new(false);
+    let (done_tx, done) = std::sync::mpsc::channel();
+
+    let copy_file = |file: &PlannedFile| {
+        let src = std::fs::File::open(&file.path)?;
+        copy_range_at(&src, 0, image, file.sector * layout::SECTOR_SIZE, file.size)
+    };
+
+    let worker = |done_tx: std::sync::mpsc::Sender<usize>| -> std::io::Result<()> {
+        while !failed.load(Ordering::Relaxed) {
+            let idx = next.fetch_add(1, Ordering::Relaxed);
+            let Some(file) = plan.files.get(idx) else {
+                break;
+            };
+
+            if let Err(e) = copy_file(file) {
+                failed.store(true, Ordering::Relaxed);
+                return Err(e);
+            }
+
+            let _ = done_tx.send(idx);
+        }
+
+        Ok(())
+    };
+
+    let results: Vec<std::io::Result<()>> = std::thread::scope(|s| {
+        let workers: Vec<_> = (0..jobs.clamp(1, plan.files.len().max(1)))
+            .map(|_| {
+                let done_tx = done_tx.clone();
+                s.spawn(move || worker(done_tx))
+            })
+            .collect();
+
+        // Every sender is owned by a worker, so this ends once they all have
+        drop(done_tx);
+        for idx in done.iter() {
+            let file = &plan.files[idx];
+            progress_callback(ProgressInfo::FileAdded(file.path.clone(), file.sector));
+        }
+
+        workers
+            .into_iter()
+            .map(|worker| worker.join().expect("image writer panicked"))
+            .collect()
+    });
+
+    for result in results {
+        result?;
+    }
+
+    let write_at = |offset: u64, buf: &[u8]| {
+        let mut image = image;
+        std::io::Seek::seek(&mut image, std::io::SeekFrom::Start(offset))?;
+        std::io::Write::write_all(&mut image, buf)
+    };
+
+    // FIXME: Set timestamp
+    let volume_info = layout::VolumeDescriptor::new(plan.root_table);
+    write_at(32 * layout::SECTOR_SIZE, &volume_info.serialize()?)?;
+    for dir in plan.directories.iter() {
+        write_at(dir.sector * layout::SECTOR_SIZE, &dir.entry_table)?;
+    }
+
+    if image.metadata()?.len() < plan.image_size {
+        image.set_len(plan.image_size)?;
+    }
+
+    Ok(())
+}
+
+pub async fn create_xdvdfs_image<H: BlockDeviceWrite<E>, E>(
+    source_dir: &Path,
+    fs: &mut (impl fs::Filesystem<H, E> + ?Sized),
+    image: &mut H,
+    progress_callback: impl Fn(ProgressInfo),
+) -> Result<(), util::Error<E>> {
+    let mut policy = sector::SectorAllocator::default();
+    let plan = plan_xdvdfs_image(source_dir, fs, &mut policy, &progress_callback).await?;
+    write_xdvdfs_image(&plan, fs, image, &progress_callback).await?;
+
     progress_callback(ProgressInfo::FinishedPacking);
     Ok(())
 }
+
+#[cfg(all(test, feature = "read"))]
+mod test {
+    use alloc::boxed::Box;
+    use alloc::vec::Vec;
+    use futures::executor;
+    use std::path::{Path, PathBuf};
+
+    use super::{
+        plan_xdvdfs_image, write_xdvdfs_image, write_xdvdfs_image_parallel, ImagePlan, PlannedFile,
+    };
+    use crate::blockdev::{sequential::SequentialWriter, OffsetWrapper, OutOfBounds};
+    use crate::write::fs::StdFilesystem;
+    use crate::write::sector::{
+        AlignedAllocator, AllocationPolicy, SectorAllocator, TightAllocator, ECC_BLOCK_SECTORS,
+    };
+
+    /// Creates a source tree in the temp directory, with empty files
+    /// and two files with the same contents
+    fn source_tree(name: &str) -> PathBuf {
+        let root =
+            std::env::temp_dir().join(std::format!("xdvdfs-img-{}-{}", name, std::process::id()));
+        let _ = std::fs::remove_dir_all(&root);
+        std::fs::create_dir_all(root.join("dir/sub")).unwrap();
+
+        let data: Vec<u8> = (0..5000).map(|i| (i % 251) as u8).collect();
+        let big: Vec<u8> = (0..40 * 2048 + 7).map(|i| (i % 241) as u8).collect();
+        std::fs::write(root.join("a.bin"), &data).unwrap();
+        std::fs::write(root.join("dir/copy.bin"), &data).unwrap();
+        std::fs::write(root.join("big.bin"), &big).unwrap();
+        std::fs::write(root.join("dir/sub/big.bin"), &big[1..]).unwrap();
+        std::fs::write(root.join("empty.bin"), b"").unwrap();
+        std::fs::write(root.join("dir/sub/empty.bin"), b"").unwrap();
+        std::fs::write(root.join("dir/sub/c.txt"), b"abc").unwrap();
+
+        root
+    }
+
+    fn plan(
+        source: &Path,
+        fs: &mut StdFilesystem,
+        policy: &mut (impl AllocationPolicy + ?Sized),
+    ) -> ImagePlan {
+        executor::block_on(plan_xdvdfs_image::<std::fs::File, _>(
+            source,
+            fs,
+            policy,
+            |_| {},
+        ))
+        .unwrap()
+    }
+
+    /// Writes `plan` to the file at `path`, and returns the image
+    fn write_file(plan: &ImagePlan, fs: &mut StdFilesystem, path: &Path) -> Vec<u8> {
+        let mut image = std::fs::File::create(path).unwrap();
+        executor::block_on(write_xdvdfs_image(plan, fs, &mut image, |_| {})).unwrap();
+        std::fs::read(path).unwrap()
+    }
+
+    fn count_entries(dir: &Path) -> usize {
+        std::fs::read_dir(dir)
+            .unwrap()
+            .map(|entry| {
+                let path = entry.unwrap().path();
+                1 + if path.is_dir() {
+                    count_entries(&path)
+                } else {
+                    0
+                }
+            })
+            .sum()
+    }
+
+    /// Checks that `image` holds exactly the entries below `source`
+    fn assert_contents(image: &[u8], source: &Path) {
+        let mut dev = executor::block_on(OffsetWrapper::new(image)).unwrap();
+        assert_eq!(dev.offset(), 0);
+
+        let volume = executor::block_on(crate::read::read_volume(&mut dev)).unwrap();
+        let tree = executor::block_on(volume.root_table.file_tree(&mut dev)).unwrap();
+        assert_eq!(tree.len(), count_entries(source));
+
+        for (parent, node) in tree {
+            let name = node.name_str::<OutOfBounds>().unwrap();
+            let path = source.join(parent.trim_start_matches('/')).join(&*name);
+            let dirent = node.node.dirent;
+            if dirent.is_directory() {
+                assert!(path.is_dir(), "{:?}", path);
+            } else {
+                let data = executor::block_on(dirent.read_data_all(&mut dev)).unwrap();
+                assert_eq!(&data[..], &std::fs::read(&path).unwrap()[..], "{:?}", path);
+            }
+        }
+    }
+
+    #[test]
+    fn test_plan_then_write() {
+        let source = source_tree("plan");
+        let mut fs = StdFilesystem::new();
+        let plan = plan(&source, &mut fs, &mut SectorAllocator::default());
+
+        let image = write_file(&plan, &mut fs, &source.with_extension("iso"));
+        assert_eq!(image.len() as u64, plan.image_size);
+        assert_contents(&image, &source);
+
+        // Deserialized plans have no directory tables, and cannot be written
+        let mut stale = plan.clone();
+        stale.directories[0].entry_table = Box::new([]);
+        let mut out = std::fs::File::create(source.with_extension("stale.iso")).unwrap();
+        assert!(executor::block_on(write_xdvdfs_image(&stale, &mut fs, &mut out, |_| {})).is_err());
+
+        std::fs::remove_file(source.with_extension("iso")).unwrap();
+        std::fs::remove_file(source.with_extension("stale.iso")).unwrap();
+        std::fs::remove_dir_all(source).unwrap();
+    }
+
+    #[test]
+    fn test_parallel_matches_sequential() {
+        let source = source_tree("parallel");
+        let serial_path = source.with_extension("iso");
+        let parallel_path = source.with_extension("parallel.iso");
+
+        // The aligned layout leaves gaps between files, and after the last table
+        let mut fs = StdFilesystem::new();
+        let policies: [&mut dyn AllocationPolicy; 2] = [
+            &mut SectorAllocator::default(),
+            &mut AlignedAllocator::new(ECC_BLOCK_SECTORS),
+        ];
+        for policy in policies {
+            let plan = plan(&source, &mut fs, policy);
+            let serial = write_file(&plan, &mut fs, &serial_path);
+
+            let image = std::fs::File::create(&parallel_path).unwrap();
+            write_xdvdfs_image_parallel(&plan, &image, 3, |_| {}).unwrap();
+            let parallel = std::fs::read(&parallel_path).unwrap();
+
+            assert_eq!(parallel.len() as u64, plan.image_size);
+            assert!(parallel == serial);
+        }
+
+        std::fs::remove_file(serial_path).unwrap();
+        std::fs::remove_file(parallel_path).unwrap();
+        std::fs::remove_dir_all(source).unwrap();
+    }
+
+    #[test]
+    fn test_layouts_round_trip() {
+        let source = source_tree("layouts");
+        let path = source.with_extension("iso");
+
+        let mut fs = StdFilesystem::new().with_dedup(true);
+        let policies: [&mut dyn AllocationPolicy; 2] = [
+            &mut TightAllocator::default(),
+            &mut AlignedAllocator::new(ECC_BLOCK_SECTORS),
+        ];
+        for (idx, policy) in policies.into_iter().enumerate() {
+            let plan = plan(&source, &mut fs, policy);
+            assert!(plan
+                .duplicates
+                .iter()
+                .any(|file| file.path.ends_with("copy.bin") || file.path.ends_with("a.bin")));
+            if idx == 0 {
+                // The tight layout places the root table and small files before sector 32
+                assert_eq!({ plan.root_table.region.sector }, 0);
+                assert!(plan
+                    .files
+                    .iter()
+                    .any(|file| file.size > 0 && file.sector < 32));
+
+                // Empty files take up no space, so they share a sector with another file
+                let shared = |empty: &PlannedFile| {
+                    plan.files
+                        .iter()
+                        .any(|file| file.size > 0 && file.sector == empty.sector)
+                };
+                let empty: Vec<_> = (plan.files.iter())
+                    .chain(plan.duplicates.iter())
+                    .filter(|file| file.size == 0)
+                    .collect();
+                assert_eq!(empty.len(), 2);
+                assert!(empty.into_iter().any(shared));
+            }
+
+            let image = write_file(&plan, &mut fs, &path);
+            assert_eq!(image.len() as u64, plan.image_size);
+            assert_contents(&image, &source);
+
+            let mut streamed = SequentialWriter::new(Vec::new());
+            executor::block_on(write_xdvdfs_image(&plan, &mut fs, &mut streamed, |_| {})).unwrap();
+            assert!(streamed.into_inner().unwrap() == image);
+        }
+
+        std::fs::remove_file(path).unwrap();
+        std::fs::remove_dir_all(source).unwrap();
+    }
+}
@@ -1,13 +1,46 @@
+use std::path::{Path, PathBuf};
+
+use alloc::collections::BTreeMap;
+use alloc::vec::Vec;
+
 use crate::layout::SECTOR_SIZE;
 
+/// Sector of the volume descriptor, which is never allocated
+const VOLUME_SECTOR: u64 = 32;
+
+/// Number of sectors in an ECC block of an Xbox DVD
+pub const ECC_BLOCK_SECTORS: u64 = 16;
+
+/// A directory table or file to be placed in an image
+#[derive(Debug, Clone, Copy)]
+pub struct Region<'a> {
+    pub path: &'a Path,
+    pub size: u64,
+    pub is_dir: bool,
+}
+
+/// Decides where directory tables and files are placed in an image
+pub trait AllocationPolicy {
+    /// Called once with every region before any of them is allocated,
+    /// for policies that depend on the whole layout
+    fn prepare(&mut self, _regions: &[Region]) {}
+
+    /// Allocates sectors for `region`, and returns the first of them.
+    /// The allocation must not overlap sector 32, or any earlier allocation.
+    fn allocate(&mut self, region: &Region) -> u64;
+}
+
+/// Default allocation policy, which places regions one after another from sector 33
 pub struct SectorAllocator {
     next_free: u64,
 }
 
 impl Default for SectorAllocator {
     fn default() -> Self {
-        // FIXME: Allow files to fill sectors 0..=31
-        Self { next_free: 33 }
+        // Sectors 0..=31 are left unused, see `TightAllocator`
+        Self {
+            next_free: VOLUME_SECTOR + 1,
+        }
     }
 }
 
@@ -29,3 +62,194 @@ impl SectorAllocator {
         allocation
     }
 }
+
+impl AllocationPolicy for SectorAllocator {
+    fn allocate(&mut self, region: &Region) -> u64 {
+        self.allocate_contiguous(region.size)
+    }
+}
+
+/// Allocation policy that packs regions as tightly as possible.
+///
+/// Regions that fit are placed in sectors 0..=31, ahead of the volume descriptor,
+/// and empty regions take up no space.
+pub struct TightAllocator {
+    low_free: u64,
+    next_free: u64,
+}
+
+impl Default for TightAllocator {
+    fn default() -> Self {
+        Self {
+            low_free: 0,
+            next_free: VOLUME_SECTOR + 1,
+        }
+    }
+}
+
+impl AllocationPolicy for TightAllocator {
+    fn allocate(&mut self, region: &Region) -> u64 {
+        if region.size == 0 {
+            return self.next_free;
+        }
+
+        let sectors = required_sectors(region.size);
+        if self.low_free + sectors <= VOLUME_SECTOR {
+            self.low_free += sectors;
+            return self.low_free - sectors;
+        }
+
+        self.next_free += sectors;
+        self.next_free - sectors
+    }
+}
+
+/// Allocation policy that starts large files on ECC block boundaries,
+/// so that the console reads them in whole blocks.
+///
+/// Smaller regions are placed in the gaps left by the alignment where they fit.
+pub struct AlignedAllocator {
+    align: u64,
+    min_size: u64,
+    next_free: u64,
+    gaps: Vec<(u64, u64)>,
+}
+
+impl AlignedAllocator {
+    /// Aligns files of at least `align` sectors to a multiple of `align` sectors
+    pub fn new(align: u64) -> Self {
+        let align = align.max(1);
+        Self {
+            align,
+            min_size: align * SECTOR_SIZE,
+            next_free: VOLUME_SECTOR + 1,
+            gaps: Vec::new(),
+        }
+    }
+
+    /// Aligns only files of at least `bytes` bytes
+    pub fn with_min_size(mut self, bytes: u64) -> Self {
+        self.min_size = bytes;
+        self
+    }
+}
+
+impl AllocationPolicy for AlignedAllocator {
+    fn allocate(&mut self, region: &Region) -> u64 {
+        let sectors = required_sectors(region.size);
+        if region.is_dir || region.size < self.min_size {
+            let gap = self.gaps.iter().position(|(_, len)| *len >= sectors);
+            if let Some(idx) = gap {
+                let (start, len) = self.gaps[idx];
+                if len == sectors {
+                    self.gaps.remove(idx);
+                } else {
+                    self.gaps[idx] = (start + sectors, len - sectors);
+                }
+
+                return start;
+            }
+
+            self.next_free += sectors;
+            return self.next_free - sectors;
+        }
+
+        let start = self.next_free.next_multiple_of(self.align);
+        if start > self.next_free {
+            self.gaps.push((self.next_free, start - self.next_free));
+        }
+
+        self.next_free = start + sectors;
+        start
+    }
+}
+
+/// Allocation policy that places regions in order of their path,
+/// whatever order they are allocated in.
+///
+/// Regions are placed by `inner` during `prepare`, so the layout only depends on
+/// the set of paths and sizes. Regions that were not prepared are placed afterwards.
+pub struct NameOrderAllocator<P: AllocationPolicy> {
+    inner: P,
+    sectors: BTreeMap<PathBuf, u64>,
+}
+
+impl<P: AllocationPolicy> NameOrderAllocator<P> {
+    pub fn new(inner: P) -> Self {
+        Self {
+            inner,
+            sectors: BTreeMap::new(),
+        }
+    }
+}
+
+impl<P: AllocationPolicy> AllocationPolicy for NameOrderAllocator<P> {
+    fn prepare(&mut self, regions: &[Region]) {
+        let mut regions = regions.to_vec();
+        regions.sort_by_key(|region| region.path);
+
+        self.inner.prepare(&regions);
+        for region in regions {
+            let sector = self.inner.allocate(&region);
+            self.sectors.insert(region.path.to_path_buf(), sector);
+        }
+    }
+
+    fn allocate(&mut self, region: &Region) -> u64 {
+        match self.sectors.remove(region.path) {
+            Some(sector) => sector,
+            None => self.inner.allocate(region),
+        }
+    }
+}
+
+#[cfg(test)]
+mod test {
+    use alloc::vec::Vec;
+    use std::path::Path;
+
+    use super::{
+        AlignedAllocator, AllocationPolicy, NameOrderAllocator, Region, SectorAllocator,
+        TightAllocator,
+    };
+
+    fn file(path: &str, size: u64) -> Region<'_> {
+        Region {
+            path: Path::new(path),
+            size,
+            is_dir: false,
+        }
+    }
+
+    #[test]
+    fn test_tight_allocator_uses_low_sectors() {
+        let mut policy = TightAllocator::default();
+        assert_eq!(policy.allocate(&file("a", 30 * 2048)), 0);
+        assert_eq!(policy.allocate(&file("b", 0)), 33);
+        assert_eq!(policy.allocate(&file("c", 3 * 2048)), 33);
+        assert_eq!(policy.allocate(&file("d", 2048)), 30);
+        assert_eq!(policy.allocate(&file("e", 1)), 31);
+        assert_eq!(policy.allocate(&file("f", 1)), 36);
+    }
+
+    #[test]
+    fn test_aligned_allocator_fills_gaps() {
+        let mut policy = AlignedAllocator::new(16);
+        assert_eq!(policy.allocate(&file("small", 100)), 33);
+        assert_eq!(policy.allocate(&file("big", 40 * 2048)), 48);
+        assert_eq!(policy.allocate(&file("gap", 5 * 2048)), 34);
+        assert_eq!(policy.allocate(&file("big2", 16 * 2048)), 96);
+        assert_eq!(policy.allocate(&file("tail", 20 * 2048)), 112);
+    }
+
+    #[test]
+    fn test_name_order_allocator() {
+        let regions = [file("b", 2048), file("a", 4096), file("c", 1)];
+        let mut policy = NameOrderAllocator::new(SectorAllocator::default());
+        policy.prepare(&regions);
+
+        let sectors: Vec<u64> = regions.iter().map(|r| policy.allocate(r)).collect();
+        assert_eq!(sectors, [35, 33, 36]);
+        assert_eq!(policy.allocate(&file("d", 1)), 37);
+    }
+}